@@ -40,6 +40,8 @@ from leapp.utils.output import beautify_actor_exception, report_errors, report_i
 @command_opt('report-schema', help='Specify report schema version for leapp-report.json',
              choices=['1.0.0', '1.1.0', '1.2.0'], default=get_config().get('report', 'schema'))
 @command_opt('nogpgcheck', is_flag=True, help='Disable RPM GPG checks. Same as yum/dnf --nogpgcheck option.')
+@command_opt('full-rescan', is_flag=True, help='Collect all system facts again instead of reusing facts'
+                                               ' not changed since the previous execution')
 @breadcrumbs.produces_breadcrumbs
 def upgrade(args, breadcrumbs):
     skip_phases_until = None
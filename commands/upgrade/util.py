@@ -218,6 +218,9 @@ def prepare_configuration(args):
     if args.nogpgcheck:
         os.environ['LEAPP_NOGPGCHECK'] = '1'
 
+    if args.full_rescan:
+        os.environ['LEAPP_FULL_FACTS_RESCAN'] = '1'
+
     # Check upgrade path and fail early if it's unsupported
     target_version, flavor = command_utils.vet_upgrade_path(args)
     os.environ['LEAPP_UPGRADE_PATH_TARGET_RELEASE'] = target_version
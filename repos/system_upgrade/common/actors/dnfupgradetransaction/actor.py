@@ -1,7 +1,7 @@
 import shutil
 
 from leapp.actors import Actor
-from leapp.libraries.common import dnfplugin
+from leapp.libraries.common import dnfplugin, metadatacache
 from leapp.libraries.stdlib import run
 from leapp.models import (
     DNFPluginTask,
@@ -63,3 +63,5 @@ class DnfUpgradeTransaction(Actor):
                 shutil.rmtree(userspace.path)
             except EnvironmentError:
                 self.log.info("Failed to remove temporary userspace - error ignored", exc_info=True)
+            # the DNF cache contains packages downloaded for the upgrade
+            metadatacache.remove_cache()
@@ -3,7 +3,7 @@ import shutil
 from distutils.version import LooseVersion
 
 from leapp.exceptions import StopActorExecutionError
-from leapp.libraries.common import dnfplugin, mounting
+from leapp.libraries.common import dnfplugin, mounting, overlaygen
 from leapp.libraries.common.config.version import get_target_major_version
 from leapp.libraries.stdlib import api, CalledProcessError
 from leapp.models import RequiredUpgradeInitramPackages  # deprecated
@@ -398,5 +398,6 @@ def process():
     target_iso = next(api.consume(TargetOSInstallationImage), None)
     with mounting.NspawnActions(base_dir=userspace_info.path) as context:
         with mounting.mount_upgrade_iso_to_root_dir(userspace_info.path, target_iso):
-            prepare_userspace_for_initram(context)
-            generate_initram_disk(context)
+            with overlaygen.track_container_size(userspace_info.path):
+                prepare_userspace_for_initram(context)
+                generate_initram_disk(context)
@@ -1,11 +1,31 @@
+import glob
+import os
 import warnings
 
 from leapp.exceptions import StopActorExecutionError
+from leapp.libraries.common import factsnapshot
 from leapp.libraries.common import module as module_lib
-from leapp.libraries.common import rpms
+from leapp.libraries.common import repofileutils, rpms
 from leapp.libraries.stdlib import api
 from leapp.models import InstalledRPM, RPM
 
+RPMDB_INPUTS = [
+    '/var/lib/rpm/Packages',
+    '/var/lib/rpm/rpmdb.sqlite',
+    '/usr/lib/sysimage/rpm/rpmdb.sqlite',
+    '/etc/dnf/modules.d',
+]
+"""
+Inputs of installed packages, reused from the previous leapp execution when not changed (see factsnapshot)
+
+Only the database files are used, as other files in the rpmdb directory (e.g.
+the __db.* environment) are modified by queries as well. Repository directories
+and metadata of repositories cached by DNF are added to the inputs, as module
+streams of packages are read from module metadata of repositories.
+"""
+
+DNF_CACHE_DIR = '/var/cache/dnf'
+
 no_yum = False
 no_yum_warning_msg = "package `yum` is unavailable"
 try:
@@ -104,8 +124,13 @@ def map_modular_rpms_to_modules():
     return rpm_streams
 
 
-# TODO(drehak) unit tests
-def process():
+def _get_inputs():
+    # repomd.xml and module metadata are replaced inside repodata directories when refreshed
+    repodata_dirs = sorted(glob.glob(os.path.join(DNF_CACHE_DIR, '*', 'repodata')))
+    return RPMDB_INPUTS + sorted(repofileutils.get_repodirs()) + [DNF_CACHE_DIR] + repodata_dirs
+
+
+def get_installed_rpms_facts():
     output = rpms.get_installed_rpms()
     pkg_repos = get_package_repository_data()
     rpm_streams = map_modular_rpms_to_modules()
@@ -130,4 +155,8 @@ def process():
             repository=repository,
             module=module,
             stream=stream))
-    api.produce(result)
+    return result
+
+
+def process():
+    api.produce(factsnapshot.reuse_or_collect('installed_rpms', _get_inputs(), InstalledRPM, get_installed_rpms_facts))
@@ -3,6 +3,7 @@ import sys
 import pytest
 
 from leapp.libraries.actor import rpmscanner
+from leapp.libraries.common import factsnapshot
 from leapp.libraries.common import module as module_lib
 from leapp.libraries.common import rpms, testutils
 from leapp.libraries.stdlib import api
@@ -101,8 +102,9 @@ MODULES = [
 
 
 @pytest.mark.skipif(no_yum and no_dnf, reason='yum/dnf is unavailable')
-def test_actor_execution(monkeypatch, current_actor_context):
+def test_actor_execution(monkeypatch, tmpdir, current_actor_context):
     monkeypatch.setattr(rpmscanner.module_lib, 'get_modules', lambda: [])
+    monkeypatch.setattr(factsnapshot, 'SNAPSHOT_DIR', tmpdir.strpath)
     current_actor_context.run()
     assert current_actor_context.consume(InstalledRPM)
     assert current_actor_context.consume(InstalledRPM)[0].items
@@ -152,10 +154,13 @@ PACKAGE_REPOS = {
 }
 
 
-def test_process(monkeypatch):
+def test_process(monkeypatch, tmpdir):
     monkeypatch.setattr(module_lib, 'get_modules', lambda: MODULES)
     monkeypatch.setattr(rpmscanner, 'get_package_repository_data', lambda: PACKAGE_REPOS)
     monkeypatch.setattr(rpms, 'get_installed_rpms', lambda: INSTALLED_RPMS)
+    monkeypatch.setattr(rpmscanner, '_get_inputs', lambda: [])
+    monkeypatch.setattr(factsnapshot, 'SNAPSHOT_DIR', tmpdir.strpath)
+    monkeypatch.setattr(factsnapshot, '_get_repository_version', lambda: None)
     monkeypatch.setattr(api, 'produce', testutils.produce_mocked())
 
     rpmscanner.process()
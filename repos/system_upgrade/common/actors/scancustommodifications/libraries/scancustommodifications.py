@@ -1,5 +1,10 @@
 import ast
+import grp
+import hashlib
+import json
 import os
+import pwd
+import stat
 
 from leapp.exceptions import StopActorExecution
 from leapp.libraries.common import rpms
@@ -9,6 +14,29 @@ from leapp.models import CustomModifications
 LEAPP_REPO_DIRS = ['/usr/share/leapp-repository']
 LEAPP_PACKAGES_TO_IGNORE = ['snactor']
 
+DIGEST_CACHE_PATH = '/var/lib/leapp/leapp-files-digests.json'
+"""
+Digests of leapp files computed by previous executions.
+
+Maps the path of a file to its size, mtime, ctime, digest algorithm and digest.
+The digest is reused as long as the size and both timestamps of the file
+are unchanged.
+"""
+
+RPMFILE_GHOST = 1 << 6
+"""File flag of files not shipped in the package (%ghost), these are not verified by rpm"""
+
+_DIGEST_ALGOS = {1: 'md5', 2: 'sha1', 8: 'sha256', 9: 'sha384', 10: 'sha512', 11: 'sha224'}
+"""Mapping of rpm file digest algorithm IDs (FILEDIGESTALGO) to hashlib names"""
+
+_RPM_FILES_QUERYFORMAT = (
+    r'[%{=NAME}\t%{FILENAMES}\t%{FILEFLAGS}\t%{FILEMODES}\t%{FILESIZES}\t%{=FILEDIGESTALGO}\t%{FILEDIGESTS}\t'
+    r'%{FILELINKTOS}\t%{FILEUSERNAME}\t%{FILEGROUPNAME}\n]'
+)
+
+_ACTOR_NAMES = {}
+"""Names of actors already deduced from actor.py files, so each file is parsed just once"""
+
 
 def _get_dirs_to_check(component):
     if component == 'repository':
@@ -24,6 +52,45 @@ def _get_rpms_to_check(component=None):
     return rpms.get_leapp_packages(components=[rpms.LeappComponents.REPOSITORY, rpms.LeappComponents.FRAMEWORK])
 
 
+def _parse_actor_name(actor_file):
+    """
+    Return the name attribute of the actor class defined in the given actor.py file, None if not found
+    """
+    data = None
+    with open(actor_file) as f:
+        try:
+            data = ast.parse(f.read())
+        except TypeError:
+            api.current_logger().warning('An error occurred while parsing %s, can not deduce actor name', actor_file)
+            return None
+    # NOTE(ivasilev) Making proper syntax analysis is not the goal here, so let's get away with the bare minimum.
+    # An actor file will have an Actor ClassDef with a name attribute and a process function defined
+    actor = next((obj for obj in data.body if isinstance(obj, ast.ClassDef) and obj.name and
+                  any(isinstance(o, ast.FunctionDef) and o.name == 'process' for o in obj.body)), None)
+    if not actor:
+        return None
+    # NOTE(ivasilev) obj.name attribute refers only to Class name, so for fetching name attribute need to go
+    # deeper
+    try:
+        return next((expr.value.s for expr in actor.body
+                     if isinstance(expr, ast.Assign) and expr.targets[-1].id == 'name'), None)
+    except (AttributeError, IndexError):
+        api.current_logger().warning("Syntax Analysis for %s has failed", actor_file)
+        return None
+
+
+def _get_actor_name(actor_file):
+    """
+    Return the name of the actor defined in the given actor.py file, None if not found
+
+    Files and libraries of an actor are all resolved to the same actor.py file,
+    so results are remembered for the whole execution.
+    """
+    if actor_file not in _ACTOR_NAMES:
+        _ACTOR_NAMES[actor_file] = _parse_actor_name(actor_file)
+    return _ACTOR_NAMES[actor_file]
+
+
 def deduce_actor_name(a_file):
     """
     A helper to map an actor/library to the actor name
@@ -36,28 +103,9 @@ def deduce_actor_name(a_file):
     # In case this function has been called on a non-actor file, let's go straight to recursive call on the assumed
     # location of the actor file.
     if os.path.basename(a_file) == 'actor.py':
-        data = None
-        with open(a_file) as f:
-            try:
-                data = ast.parse(f.read())
-            except TypeError:
-                api.current_logger().warning('An error occurred while parsing %s, can not deduce actor name', a_file)
-                return ''
-        # NOTE(ivasilev) Making proper syntax analysis is not the goal here, so let's get away with the bare minimum.
-        # An actor file will have an Actor ClassDef with a name attribute and a process function defined
-        actor = next((obj for obj in data.body if isinstance(obj, ast.ClassDef) and obj.name and
-                      any(isinstance(o, ast.FunctionDef) and o.name == 'process' for o in obj.body)), None)
-        # NOTE(ivasilev) obj.name attribute refers only to Class name, so for fetching name attribute need to go
-        # deeper
-        if actor:
-            try:
-                actor_name = next((expr.value.s for expr in actor.body
-                                   if isinstance(expr, ast.Assign) and expr.targets[-1].id == 'name'), None)
-            except (AttributeError, IndexError):
-                api.current_logger().warning("Syntax Analysis for %d has failed", a_file)
-                actor_name = None
-            if actor_name:
-                return actor_name
+        actor_name = _get_actor_name(a_file)
+        if actor_name:
+            return actor_name
 
     # Assuming here we are dealing with a library or a file, so let's discover actor filename and deduce actor name
     # from it. Actor is expected to be found under ../../actor.py
@@ -95,6 +143,146 @@ def _modification_model(filename, change_type, component, rpm_checks_str=''):
                                actor_name=deduce_actor_name(filename), rpm_checks_str=rpm_checks_str)
 
 
+def _get_rpm_files(rpms):
+    """
+    Return the mapping of given packages to the list of their files as recorded in the rpmdb
+
+    All packages are queried by a single rpm call. Each file is described
+    by the dict with path, flags, mode, size, digest_algo, digest, linkto,
+    user and group keys.
+    """
+    rpm_files = {rpm: [] for rpm in rpms}
+    if not rpms:
+        return rpm_files
+    res = _run_command(['rpm', '-q', '--queryformat', _RPM_FILES_QUERYFORMAT] + list(rpms),
+                       'Could not get a list of installed files from rpms {}'.format(', '.join(rpms)))
+    for line in res:
+        fields = line.split('\t')
+        if len(fields) != 10:
+            continue
+        name, path, flags, mode, size, digest_algo, digest, linkto, user, group = fields
+        rpm_files.setdefault(name, []).append({
+            'path': path,
+            'flags': int(flags),
+            'mode': int(mode),
+            'size': int(size),
+            # files of old packages without the algorithm specified are digested by md5
+            'digest_algo': int(digest_algo) if digest_algo.isdigit() else 1,
+            'digest': digest,
+            'linkto': linkto,
+            'user': user,
+            'group': group,
+        })
+    return rpm_files
+
+
+def _list_files(directory):
+    """
+    Return paths of regular files under the directory, same as `find <directory> -type f`
+    """
+    if not os.path.isdir(directory):
+        api.current_logger().warning('Could not get a list of leapp files from {}'.format(directory))
+        raise StopActorExecution()
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        for name in filenames + dirs:
+            path = os.path.join(root, name)
+            if stat.S_ISREG(os.lstat(path).st_mode):
+                files.append(path)
+    return files
+
+
+def _load_digest_cache():
+    try:
+        with open(DIGEST_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError):
+        return {}
+
+
+def _store_digest_cache(cache):
+    try:
+        with open(DIGEST_CACHE_PATH, 'w') as f:
+            json.dump(cache, f, sort_keys=True)
+    except (OSError, IOError) as e:
+        api.current_logger().debug('Could not store digests of leapp files: {}'.format(str(e)))
+
+
+def _get_digest(path, st, algo, cache):
+    """
+    Return the digest of the file using the given hashlib algorithm, reusing the cached one if the file is unchanged
+    """
+    key = [st.st_size, st.st_mtime, st.st_ctime, algo]
+    cached = cache.get(path)
+    if cached and cached[:-1] == key:
+        return cached[-1]
+    digest = hashlib.new(algo)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    cache[path] = key + [digest.hexdigest()]
+    return cache[path][-1]
+
+
+def _lookup_name(lookup, owner_id, names):
+    if owner_id not in names:
+        try:
+            names[owner_id] = lookup(owner_id)[0]
+        except KeyError:
+            names[owner_id] = None
+    return names[owner_id]
+
+
+def _is_file_modified(rpm_file, digest_cache, user_names, group_names):
+    """
+    Return True if the file might not match its record in the rpmdb
+
+    Checks the attributes verified by `rpm -V --nomtime` (except capabilities
+    and device numbers, not used by leapp files). False positives are fine,
+    files of such packages are verified by rpm afterwards.
+    """
+    if rpm_file['flags'] & RPMFILE_GHOST:
+        return False
+    path = rpm_file['path']
+    try:
+        st = os.lstat(path)
+        if (st.st_mode & 0o177777) != rpm_file['mode']:
+            return True
+        if _lookup_name(pwd.getpwuid, st.st_uid, user_names) != rpm_file['user']:
+            return True
+        if _lookup_name(grp.getgrgid, st.st_gid, group_names) != rpm_file['group']:
+            return True
+        if stat.S_ISLNK(st.st_mode):
+            return os.readlink(path) != rpm_file['linkto']
+        if stat.S_ISREG(st.st_mode):
+            algo = _DIGEST_ALGOS.get(rpm_file['digest_algo'])
+            return (
+                st.st_size != rpm_file['size']
+                or not algo
+                or _get_digest(path, st, algo, digest_cache) != rpm_file['digest']
+            )
+    except (OSError, IOError, ValueError):
+        # e.g. missing file or the digest algorithm not allowed in FIPS mode
+        return True
+    return False
+
+
+def _get_modified_rpms(rpms, rpm_files):
+    """
+    Return packages (from the given ones) with files that might have been modified
+    """
+    digest_cache = _load_digest_cache()
+    user_names = {}
+    group_names = {}
+    modified_rpms = [
+        rpm for rpm in rpms
+        if any(_is_file_modified(rpm_file, digest_cache, user_names, group_names) for rpm_file in rpm_files[rpm])
+    ]
+    # forget digests of removed files
+    _store_digest_cache({path: value for path, value in digest_cache.items() if os.path.exists(path)})
+    return modified_rpms
+
+
 def check_for_modifications(component):
     """
     This will return a list of any untypical files or changes to shipped leapp files discovered on the system.
@@ -102,23 +290,21 @@ def check_for_modifications(component):
     """
     rpms = _get_rpms_to_check(component)
     dirs = _get_dirs_to_check(component)
-    source_of_truth = []
     leapp_files = []
     # Let's collect data about what should have been installed from rpm
-    for rpm in rpms:
-        res = _run_command(['rpm', '-ql', rpm], 'Could not get a list of installed files from rpm {}'.format(rpm))
-        source_of_truth.extend(res)
+    rpm_files = _get_rpm_files(rpms)
+    source_of_truth = [rpm_file['path'] for files in rpm_files.values() for rpm_file in files]
     # Let's collect data about what's really on the system
     for directory in dirs:
-        res = _run_command(['find', directory, '-type', 'f'],
-                           'Could not get a list of leapp files from {}'.format(directory))
-        leapp_files.extend(res)
+        leapp_files.extend(_list_files(directory))
     # Let's check for unexpected additions
     custom_files = sorted(set(leapp_files) - set(source_of_truth))
     # Now let's check for modifications
     modified_files = []
     modified_configs = []
-    for rpm in rpms:
+    # NOTE: Only packages with files that do not match the rpmdb are verified by rpm, which
+    # provides the precise description of modifications
+    for rpm in _get_modified_rpms(rpms, rpm_files):
         res = _run_command(
                 ['rpm', '-V', '--nomtime', rpm], 'Could not check authenticity of the files from {}'.format(rpm),
                 # NOTE(ivasilev) check is False here as in case of any changes found exit code will be 1
@@ -1,3 +1,6 @@
+import hashlib
+import os
+
 import pytest
 
 from leapp.libraries.actor import scancustommodifications
@@ -58,22 +61,40 @@ def test_deduce_actor_name_from_file(a_file, name):
     assert scancustommodifications.deduce_actor_name(a_file) == name
 
 
+def test_deduce_actor_name_parses_actor_once(monkeypatch):
+    parsed = []
+
+    def mocked_parse_actor_name(actor_file):
+        parsed.append(actor_file)
+        return 'check_memcached'
+
+    monkeypatch.setattr(scancustommodifications, '_ACTOR_NAMES', {})
+    monkeypatch.setattr(scancustommodifications, '_parse_actor_name', mocked_parse_actor_name)
+    for a_file in ('repos/system_upgrade/el7toel8/actors/checkmemcached/actor.py',
+                   'repos/system_upgrade/el7toel8/actors/checkmemcached/libraries/checkmemcached.py'):
+        assert scancustommodifications.deduce_actor_name(a_file) == 'check_memcached'
+    assert parsed == ['repos/system_upgrade/el7toel8/actors/checkmemcached/actor.py']
+
+
+def _rpm_files_output(package, files):
+    return ['\t'.join([package, path, '0', '33188', '0', '8', '', '', 'root', 'root']) for path in files]
+
+
 def mocked__run_command(list_of_args, log_message, checked=True):
-    if list_of_args == ['rpm', '-ql', 'leapp-upgrade-el8toel9']:
+    if list_of_args[:2] == ['rpm', '-q'] and list_of_args[4:] == ['leapp-upgrade-el8toel9']:
         # get source of truth
-        return FILES_FROM_RPM.strip().split('\n')
-    if list_of_args and list_of_args[0] == 'find':
-        # listing files in directory
-        return FILES_ON_SYSTEM.strip().split('\n')
+        return _rpm_files_output('leapp-upgrade-el8toel9', FILES_FROM_RPM.strip().split('\n'))
     if list_of_args == ['rpm', '-V', '--nomtime', 'leapp-upgrade-el8toel9']:
         # checking authenticity
         return VERIFIED_FILES.strip().split('\n')
     return []
 
 
-def test_check_for_modifications(monkeypatch):
+def test_check_for_modifications(monkeypatch, tmpdir):
     monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(arch='x86_64', src_ver='8.9', dst_ver='9.3'))
     monkeypatch.setattr(scancustommodifications, '_run_command', mocked__run_command)
+    monkeypatch.setattr(scancustommodifications, '_list_files', lambda directory: FILES_ON_SYSTEM.strip().split('\n'))
+    monkeypatch.setattr(scancustommodifications, 'DIGEST_CACHE_PATH', os.path.join(tmpdir.strpath, 'digests.json'))
     modifications = scancustommodifications.check_for_modifications('repository')
     modified = [m for m in modifications if m.type == 'modified']
     custom = [m for m in modifications if m.type == 'custom']
@@ -87,3 +108,96 @@ def test_check_for_modifications(monkeypatch):
     assert len(configurations) == 1
     assert configurations[0].filename == 'etc/leapp/files/pes-events.json'
     assert configurations[0].rpm_checks_str == 'S.5....T.'
+
+
+def test_check_for_modifications_unmodified(monkeypatch):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(arch='x86_64', src_ver='8.9', dst_ver='9.3'))
+    monkeypatch.setattr(scancustommodifications, '_run_command', mocked__run_command)
+    monkeypatch.setattr(scancustommodifications, '_list_files', lambda directory: FILES_FROM_RPM.strip().split('\n'))
+    monkeypatch.setattr(scancustommodifications, '_get_modified_rpms', lambda rpms, rpm_files: [])
+    assert scancustommodifications.check_for_modifications('repository') == []
+
+
+def test_get_rpm_files(monkeypatch):
+    output = [
+        'leapp\t/usr/bin/leapp\t0\t33261\t25\t8\tabc\t\troot\troot',
+        'leapp\t/var/log/leapp\t64\t16832\t4096\t8\t\t\troot\troot',
+        'python3-leapp\t/usr/lib/leapp.py\t0\t41471\t8\t\t\tleapp.py\troot\troot',
+    ]
+    monkeypatch.setattr(scancustommodifications, '_run_command', lambda cmd, msg, checked=True: output)
+
+    rpm_files = scancustommodifications._get_rpm_files(['leapp', 'python3-leapp', 'leapp-deps'])
+
+    assert sorted(rpm_files) == ['leapp', 'leapp-deps', 'python3-leapp']
+    assert [f['path'] for f in rpm_files['leapp']] == ['/usr/bin/leapp', '/var/log/leapp']
+    assert rpm_files['leapp'][0]['mode'] == 0o100755
+    assert rpm_files['leapp'][1]['flags'] & scancustommodifications.RPMFILE_GHOST
+    assert rpm_files['python3-leapp'][0]['digest_algo'] == 1
+    assert rpm_files['python3-leapp'][0]['linkto'] == 'leapp.py'
+    assert rpm_files['leapp-deps'] == []
+
+
+def _rpm_file(path, content, **kwargs):
+    st = os.lstat(path)
+    rpm_file = {
+        'path': path,
+        'flags': 0,
+        'mode': st.st_mode,
+        'size': len(content),
+        'digest_algo': 8,
+        'digest': hashlib.sha256(content).hexdigest(),
+        'linkto': '',
+        'user': scancustommodifications._lookup_name(scancustommodifications.pwd.getpwuid, st.st_uid, {}),
+        'group': scancustommodifications._lookup_name(scancustommodifications.grp.getgrgid, st.st_gid, {}),
+    }
+    rpm_file.update(kwargs)
+    return rpm_file
+
+
+def _is_file_modified(rpm_file, digest_cache=None):
+    return scancustommodifications._is_file_modified(rpm_file, {} if digest_cache is None else digest_cache, {}, {})
+
+
+def test_is_file_modified(tmpdir):
+    path = tmpdir.join('actor.py')
+    path.write_binary(b'content')
+    rpm_file = _rpm_file(path.strpath, b'content')
+
+    assert not _is_file_modified(rpm_file)
+    assert not _is_file_modified(dict(rpm_file, path=tmpdir.join('missing').strpath, flags=1 << 6))
+    assert _is_file_modified(dict(rpm_file, path=tmpdir.join('missing').strpath))
+    assert _is_file_modified(dict(rpm_file, mode=rpm_file['mode'] ^ 0o002))
+    assert _is_file_modified(dict(rpm_file, user='not-existing-user'))
+    assert _is_file_modified(dict(rpm_file, digest_algo=0))
+
+    path.write_binary(b'changed')
+    assert _is_file_modified(rpm_file)
+
+
+def test_is_file_modified_symlink(tmpdir):
+    link = tmpdir.join('link')
+    link.mksymlinkto('actor.py')
+    rpm_file = _rpm_file(link.strpath, b'', linkto='actor.py')
+
+    assert not _is_file_modified(rpm_file)
+    assert _is_file_modified(dict(rpm_file, linkto='another.py'))
+
+
+def test_digest_cache(monkeypatch, tmpdir):
+    monkeypatch.setattr(scancustommodifications, 'DIGEST_CACHE_PATH', tmpdir.join('digests.json').strpath)
+    path = tmpdir.join('actor.py')
+    path.write_binary(b'content')
+    rpm_files = {'leapp-upgrade-el8toel9': [_rpm_file(path.strpath, b'content')]}
+
+    assert scancustommodifications._get_modified_rpms(['leapp-upgrade-el8toel9'], rpm_files) == []
+    digest_cache = scancustommodifications._load_digest_cache()
+    assert digest_cache[path.strpath][-1] == rpm_files['leapp-upgrade-el8toel9'][0]['digest']
+
+    # the cached digest is used as long as the file is not changed
+    digest_cache[path.strpath][-1] = 'cached'
+    assert _is_file_modified(rpm_files['leapp-upgrade-el8toel9'][0], digest_cache)
+
+    path.remove()
+    assert scancustommodifications._get_modified_rpms(['leapp-upgrade-el8toel9'], rpm_files) == [
+        'leapp-upgrade-el8toel9']
+    assert scancustommodifications._load_digest_cache() == {}
@@ -1,50 +1,26 @@
-from leapp import reporting
 from leapp.actors import Actor
-from leapp.models import SelinuxRelabelDecision
-from leapp.reporting import create_report, Report
+from leapp.libraries.actor import scheduleselinuxrelabeling
+from leapp.models import SELinuxCustom, SELinuxFacts, SELinuxModules, SelinuxRelabelDecision
+from leapp.reporting import Report
 from leapp.tags import FinalizationPhaseTag, IPUWorkflowTag
 
-COMMON_REPORT_TAGS = [reporting.Groups.SELINUX]
-
-related = [reporting.RelatedResource('file', '/.autorelabel')]
-
 
 class ScheduleSeLinuxRelabeling(Actor):
     """
     Schedule SELinux relabelling.
 
     If SELinux status was set to permissive or enforcing, a relabelling is necessary.
+
+    With (envar) LEAPP_SELINUX_TARGETED_RELABEL=1, only files changed by the upgrade
+    are relabeled during the first boot instead of the whole system, unless
+    the SELinux policy type changed, local SELinux customizations use types
+    removed from the target policy or the list of changed files is not available.
     """
 
     name = 'schedule_se_linux_relabelling'
-    consumes = (SelinuxRelabelDecision,)
+    consumes = (SELinuxCustom, SELinuxFacts, SELinuxModules, SelinuxRelabelDecision,)
     produces = (Report,)
     tags = (FinalizationPhaseTag, IPUWorkflowTag)
 
     def process(self):
-        for decision in self.consume(SelinuxRelabelDecision):
-            if decision.set_relabel:
-                try:
-                    with open('/.autorelabel', 'w'):
-                        pass
-                    create_report([
-                        reporting.Title('SElinux scheduled for relabelling'),
-                        reporting.Summary(
-                            '/.autorelabel file touched on root in order to schedule SElinux relabelling.'),
-                        reporting.Severity(reporting.Severity.INFO),
-                        reporting.Groups(COMMON_REPORT_TAGS),
-                    ] + related)
-
-                except EnvironmentError as e:
-                    # FIXME: add an "action required" flag later
-                    create_report([
-                        reporting.Title('Could not schedule SElinux for relabelling'),
-                        reporting.Summary('/.autorelabel file could not be created: {}.'.format(e)),
-                        reporting.Severity(reporting.Severity.HIGH),
-                        reporting.Groups(COMMON_REPORT_TAGS),
-                        reporting.Remediation(
-                            hint='Please set autorelabelling manually after the upgrade.'
-                        ),
-                        reporting.Groups([reporting.Groups.FAILURE])
-                    ] + related)
-                    self.log.critical('Could not schedule SElinux for relabelling: %s.' % e)
+        scheduleselinuxrelabeling.process()
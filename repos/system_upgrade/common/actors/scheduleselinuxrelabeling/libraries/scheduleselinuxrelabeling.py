@@ -0,0 +1,133 @@
+import os
+
+from leapp import reporting
+from leapp.libraries.common import selinuxrelabel
+from leapp.libraries.stdlib import api
+from leapp.models import SELinuxCustom, SELinuxFacts, SELinuxModules, SelinuxRelabelDecision
+
+SELINUX_CONFIG = '/etc/selinux/config'
+COMMON_REPORT_TAGS = [reporting.Groups.SELINUX]
+
+related = [reporting.RelatedResource('file', '/.autorelabel')]
+
+
+def _get_policy_type(config_path=SELINUX_CONFIG):
+    """
+    Return the SELinux policy type configured on the upgraded system or None if it cannot be read
+    """
+    try:
+        with open(config_path) as f:
+            for line in f:
+                key, _, value = line.strip().partition('=')
+                if key.strip() == 'SELINUXTYPE':
+                    return value.strip().strip('"\'')
+    except (OSError, IOError) as e:
+        api.current_logger().debug('Cannot read {}: {}'.format(config_path, str(e)))
+    return None
+
+
+def _uses_removed_types():
+    """
+    Return True if local SELinux customizations of the original system use types removed from the target policy
+
+    See the selinuxcontentscanner actor.
+    """
+    if any(custom.removed for custom in api.consume(SELinuxCustom)):
+        return True
+    for modules in api.consume(SELinuxModules):
+        if any(module.removed for module in modules.modules + modules.templates):
+            return True
+    return False
+
+
+def _get_full_relabel_reason(facts):
+    """
+    Return the reason why the whole system has to be relabeled or None when the targeted relabeling is sufficient
+
+    Labels of files not changed by the upgrade are kept by the targeted
+    relabeling, so they must have been valid for the policy used on the
+    upgraded system.
+
+    Known limitation: types removed from the target policy are detected only
+    in local customizations (semanage, custom policy modules). Files labeled
+    with types of the original distribution policy that have been removed
+    from the target policy (e.g. data of a daemon which is not shipped
+    anymore) keep their invalid labels unless they are changed by
+    the upgrade or located in `selinuxrelabel.RECURSIVE_PATHS`.
+    """
+    if not facts:
+        return 'SELinux facts of the original system are not available'
+    if not facts.enabled:
+        return 'SELinux was disabled on the original system, so files have not been labeled'
+    policy = _get_policy_type()
+    if policy != facts.policy:
+        return 'The SELinux policy type changed from {} to {}'.format(facts.policy, policy)
+    if _uses_removed_types():
+        return 'Local SELinux customizations of the original system use types removed from the target policy'
+    return None
+
+
+def _schedule_targeted_relabel():
+    paths = selinuxrelabel.get_relabel_paths()
+    tmp_path = selinuxrelabel.RELABEL_PATHS_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(''.join('{}\n'.format(path) for path in paths))
+    os.rename(tmp_path, selinuxrelabel.RELABEL_PATHS_PATH)
+    return len(paths)
+
+
+def _schedule_full_relabel():
+    try:
+        with open('/.autorelabel', 'w'):
+            pass
+        reporting.create_report([
+            reporting.Title('SElinux scheduled for relabelling'),
+            reporting.Summary(
+                '/.autorelabel file touched on root in order to schedule SElinux relabelling.'),
+            reporting.Severity(reporting.Severity.INFO),
+            reporting.Groups(COMMON_REPORT_TAGS),
+        ] + related)
+
+    except EnvironmentError as e:
+        # FIXME: add an "action required" flag later
+        reporting.create_report([
+            reporting.Title('Could not schedule SElinux for relabelling'),
+            reporting.Summary('/.autorelabel file could not be created: {}.'.format(e)),
+            reporting.Severity(reporting.Severity.HIGH),
+            reporting.Groups(COMMON_REPORT_TAGS),
+            reporting.Remediation(
+                hint='Please set autorelabelling manually after the upgrade.'
+            ),
+            reporting.Groups([reporting.Groups.FAILURE])
+        ] + related)
+        api.current_logger().critical('Could not schedule SElinux for relabelling: %s.' % e)
+
+
+def process():
+    if not any(decision.set_relabel for decision in api.consume(SelinuxRelabelDecision)):
+        return
+
+    if selinuxrelabel.is_targeted_relabel_enabled():
+        reason = _get_full_relabel_reason(next(api.consume(SELinuxFacts), None))
+        if reason is None:
+            try:
+                count = _schedule_targeted_relabel()
+            except (OSError, IOError, ValueError) as e:
+                reason = 'The list of files changed by the upgrade is not available: {}'.format(str(e))
+            else:
+                reporting.create_report([
+                    reporting.Title('SElinux scheduled for targeted relabelling'),
+                    reporting.Summary(
+                        'Files changed by the upgrade ({} paths) and the following directories will be'
+                        ' relabeled during the first boot of the upgraded system: {}. Labels of other files'
+                        ' are kept.'.format(count, ', '.join(selinuxrelabel.RECURSIVE_PATHS))
+                    ),
+                    reporting.Severity(reporting.Severity.INFO),
+                    reporting.Groups(COMMON_REPORT_TAGS),
+                    reporting.RelatedResource('file', selinuxrelabel.RELABEL_PATHS_PATH),
+                ])
+                return
+        api.current_logger().warning(
+            'Cannot use the targeted SELinux relabeling, the whole system will be relabeled: {}'.format(reason)
+        )
+    _schedule_full_relabel()
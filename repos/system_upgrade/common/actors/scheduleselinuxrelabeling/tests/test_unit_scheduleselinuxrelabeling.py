@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from leapp import reporting
+from leapp.libraries.actor import scheduleselinuxrelabeling
+from leapp.libraries.common import selinuxrelabel
+from leapp.libraries.common.testutils import create_report_mocked, CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api
+from leapp.models import SELinuxCustom, SELinuxFacts, SELinuxModule, SELinuxModules, SelinuxRelabelDecision
+
+TARGETED = {'LEAPP_SELINUX_TARGETED_RELABEL': '1'}
+
+
+def _facts(enabled=True, policy='targeted'):
+    return SELinuxFacts(
+        runtime_mode='permissive' if enabled else None,
+        static_mode='permissive',
+        enabled=enabled,
+        policy=policy,
+        mls_enabled=False,
+    )
+
+
+@pytest.fixture
+def relabel_env(monkeypatch, tmpdir):
+    monkeypatch.setattr(reporting, 'create_report', create_report_mocked())
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(selinuxrelabel, 'CHANGED_FILES_PATH', os.path.join(tmpdir.strpath, 'changed'))
+    monkeypatch.setattr(selinuxrelabel, 'UPGRADE_START_PATH', os.path.join(tmpdir.strpath, 'start'))
+    monkeypatch.setattr(selinuxrelabel, 'RELABEL_PATHS_PATH', os.path.join(tmpdir.strpath, 'relabel'))
+    monkeypatch.setattr(scheduleselinuxrelabeling, '_get_policy_type', lambda: 'targeted')
+    full_relabel = []
+    monkeypatch.setattr(scheduleselinuxrelabeling, '_schedule_full_relabel', lambda: full_relabel.append(True))
+    monkeypatch.setattr(selinuxrelabel, '_find_changed_files', lambda since: ['/usr/lib/locale/locale-archive'])
+    tmpdir.join('changed').write('/usr/bin/bash\n')
+    tmpdir.join('start').write('')
+    return tmpdir, full_relabel
+
+
+def test_no_relabel(monkeypatch, relabel_env):
+    tmpdir, full_relabel = relabel_env
+    msgs = [SelinuxRelabelDecision(set_relabel=False), _facts()]
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(msgs=msgs, envars=TARGETED))
+    scheduleselinuxrelabeling.process()
+    assert not full_relabel
+    assert not tmpdir.join('relabel').exists()
+
+
+def test_full_relabel_by_default(monkeypatch, relabel_env):
+    tmpdir, full_relabel = relabel_env
+    msgs = [SelinuxRelabelDecision(set_relabel=True), _facts()]
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(msgs=msgs))
+    scheduleselinuxrelabeling.process()
+    assert full_relabel
+    assert not tmpdir.join('relabel').exists()
+
+
+def test_targeted_relabel(monkeypatch, relabel_env):
+    tmpdir, full_relabel = relabel_env
+    msgs = [SelinuxRelabelDecision(set_relabel=True), _facts()]
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(msgs=msgs, envars=TARGETED))
+    scheduleselinuxrelabeling.process()
+    assert not full_relabel
+    assert tmpdir.join('relabel').read() == (
+        '/usr\n/usr/bin\n/usr/bin/bash\n/usr/lib\n/usr/lib/locale\n/usr/lib/locale/locale-archive\n'
+    )
+    assert reporting.create_report.called == 1
+
+
+@pytest.mark.parametrize('facts,policy,missing', (
+    (_facts(policy='mls'), 'targeted', None),
+    (_facts(enabled=False), 'targeted', None),
+    (None, 'targeted', None),
+    (_facts(), None, None),
+    (_facts(), 'targeted', 'changed'),
+    (_facts(), 'targeted', 'start'),
+))
+def test_targeted_relabel_fallback(monkeypatch, relabel_env, facts, policy, missing):
+    tmpdir, full_relabel = relabel_env
+    msgs = [SelinuxRelabelDecision(set_relabel=True)] + ([facts] if facts else [])
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(msgs=msgs, envars=TARGETED))
+    monkeypatch.setattr(scheduleselinuxrelabeling, '_get_policy_type', lambda: policy)
+    if missing:
+        tmpdir.join(missing).remove()
+    scheduleselinuxrelabeling.process()
+    assert full_relabel
+    assert not tmpdir.join('relabel').exists()
+    assert api.current_logger.warnmsg
+
+
+@pytest.mark.parametrize('customizations', (
+    [SELinuxCustom(commands=[], removed=['fcontext -a -f a -t cgdcbxd_exec_t -r \'s0\' \'/opt/cgdcbxd\''])],
+    [SELinuxModules(
+        modules=[SELinuxModule(name='custom', priority=400, content='', removed=['(allow cgdcbxd_t self (file))'])],
+        templates=[],
+    )],
+))
+def test_targeted_relabel_fallback_removed_types(monkeypatch, relabel_env, customizations):
+    tmpdir, full_relabel = relabel_env
+    msgs = [SelinuxRelabelDecision(set_relabel=True), _facts()] + customizations
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(msgs=msgs, envars=TARGETED))
+    scheduleselinuxrelabeling.process()
+    assert full_relabel
+    assert not tmpdir.join('relabel').exists()
+    assert api.current_logger.warnmsg
+
+
+def test_get_policy_type(tmpdir):
+    config = tmpdir.join('config')
+    config.write('# SELINUXTYPE=mls\nSELINUX=permissive\nSELINUXTYPE=targeted\n')
+    assert scheduleselinuxrelabeling._get_policy_type(config.strpath) == 'targeted'
+    assert scheduleselinuxrelabeling._get_policy_type(tmpdir.join('missing').strpath) is None
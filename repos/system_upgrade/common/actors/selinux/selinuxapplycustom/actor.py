@@ -5,6 +5,7 @@ from leapp import reporting
 from leapp.actors import Actor
 from leapp.libraries.actor import selinuxapplycustom
 from leapp.libraries.actor.selinuxapplycustom import BACKUP_DIRECTORY
+from leapp.libraries.common import semodule
 from leapp.libraries.stdlib import CalledProcessError, run
 from leapp.models import SELinuxCustom, SELinuxModules
 from leapp.tags import ApplicationsPhaseTag, IPUWorkflowTag
@@ -50,12 +51,10 @@ class SELinuxApplyCustom(Actor):
                 'Processing custom SELinux policy modules. Count: {}.'.format(len(semodules.modules))
             )
             # check for presence of udica templates and make sure to install their latest versions
-            selinuxapplycustom.install_udica_templates(semodules.templates)
+            operations = selinuxapplycustom.get_udica_templates_operations(semodules.templates)
+            # cil files of custom modules to be installed, mapped to module names
+            module_files = {}
 
-            if not semodules.modules:
-                continue
-
-            command = ['semodule']
             for module in semodules.modules:
                 # Skip modules that are already installed. This prevents DSP modules installed with wrong
                 # priority (usually 400) from being overwritten by an older version
@@ -69,8 +68,10 @@ class SELinuxApplyCustom(Actor):
                     continue
 
                 # cil module files need to be extracted to disk in order to be installed
+                # module name is given by the file name, so modules of the same name
+                # on different priorities are stored in separate directories
                 cil_filename = os.path.join(
-                    WORKING_DIRECTORY, '{}.cil'.format(module.name)
+                    WORKING_DIRECTORY, str(module.priority), '{}.cil'.format(module.name)
                 )
                 self.log.info(
                     'Installing module {} on priority {}.'.format(module.name, module.priority)
@@ -84,42 +85,27 @@ class SELinuxApplyCustom(Actor):
                     )
                 # write module content to disk
                 try:
+                    if not os.path.isdir(os.path.dirname(cil_filename)):
+                        os.mkdir(os.path.dirname(cil_filename))
                     with open(cil_filename, 'w') as cil_file:
                         cil_file.write(module.content)
-                except OSError as e:
+                except (OSError, IOError) as e:
                     self.log.warning('Error writing {} : {}'.format(cil_filename, e))
                     continue
 
-                command.extend(['-X', str(module.priority), '-i', cil_filename])
+                operations.append(['-X', str(module.priority), '-i', cil_filename])
+                module_files[cil_filename] = module.name
 
-            try:
-                run(command)
-            except CalledProcessError as e:
-                self.log.warning(
-                    'Error installing modules in a single transaction:'
-                    '{}\nRetrying -- now each module will be installed separately.'.format(e.stderr)
-                )
-                # Retry, but install each module separately
-                for module in semodules.modules:
-                    if module.name in installed_modules:
-                        continue
-                    cil_filename = os.path.join(
-                        WORKING_DIRECTORY, '{}.cil'.format(module.name)
-                    )
-                    self.log.info(
-                        'Installing module {} on priority {}.'.format(module.name, module.priority)
-                    )
-                    try:
-                        run(['semodule',
-                             '-X', str(module.priority),
-                             '-i', cil_filename
-                             ]
-                            )
-                    except CalledProcessError as e:
-                        self.log.warning('Error installing module: {}'.format(e.stderr))
-                        failed_modules.append(module.name)
-                        selinuxapplycustom.back_up_failed(cil_filename)
-                        continue
+            # Install udica templates and all custom modules by a single "semodule" call, so the policy
+            # is rebuilt just once. Failing modules are identified and skipped in case the call fails.
+            for operation, error in semodule.run_operations(operations):
+                cil_filename = operation[-1]
+                if cil_filename not in module_files:
+                    self.log.warning('Error installing udica template {}: {}'.format(cil_filename, error))
+                    continue
+                self.log.warning('Error installing module {}: {}'.format(module_files[cil_filename], error))
+                failed_modules.append(module_files[cil_filename])
+                selinuxapplycustom.back_up_failed(cil_filename)
 
         # import SELinux customizations collected by "semanage export"
         for custom in self.consume(SELinuxCustom):
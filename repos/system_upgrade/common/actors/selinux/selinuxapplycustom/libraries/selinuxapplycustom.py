@@ -35,26 +35,12 @@ def list_selinux_modules():
     return modules
 
 
-# determine which (if any) udica templates where installed and install their new versions
-def install_udica_templates(templates):
-    if not templates:
-        return
-
-    command = ['semodule']
-    for module in templates:
-        command.extend(
-            [
-                '-X',
-                str(module.priority),
-                '-i',
-                '/usr/share/udica/templates/{}.cil'.format(module.name)
-            ]
-        )
-
-    try:
-        run(command)
-    except CalledProcessError as e:
-        api.current_logger().warning('Error installing udica templates: {}'.format(e.stderr))
+# get semodule operations installing the latest versions of given udica templates
+def get_udica_templates_operations(templates):
+    return [
+        ['-X', str(module.priority), '-i', '/usr/share/udica/templates/{}.cil'.format(module.name)]
+        for module in templates
+    ]
 
 
 # move given file to the backup directory so that users can access it after the upgrade
@@ -44,25 +44,38 @@ UDICA_TEMPLATES = {"base_container", "config_container", "home_container", "log_
                    "net_container", "tmp_container", "tty_container", "virt_container", "x_container"}
 
 
-def check_module(name):
+def _compile_types_regex(types):
     """
-    Check if given module contains one of removed types and comment out corresponding lines.
+    Compile a regex matching any of given types as a whole word (same as `grep -w -E`)
+    """
+    return re.compile(r'\b(?:{})\b'.format('|'.join(re.escape(t) for t in sorted(set(types)))))
 
-    The function expects a text file "$name" containing cil policy
-    to be present in the current directory.
 
-    Returns a list of invalid lines.
-    """
+def _get_removed_types_regex():
     # get removed_types list based on upgrade path
     removed_types = REMOVED_TYPES_EL7 if version.get_source_major_version() == "7" else REMOVED_TYPES_EL8
+    return _compile_types_regex(removed_types)
 
-    try:
-        removed = run(["grep", "-w", "-E", "|".join(removed_types), name], split=True)
-        # Add ";" at the beginning of invalid lines (comment them out)
-        run(["sed", "-i", "/{}/s/^/;/g".format(r"\|".join(removed_types)), name])
-        return removed.get("stdout", [])
-    except CalledProcessError:
-        return []
+
+def check_module(content, removed_types_regex=None):
+    """
+    Check if given module contains one of removed types and comment out corresponding lines.
+
+    The content of the module (cil policy) is processed in memory.
+
+    Returns a tuple (content, removed) where "content" is the module
+    with invalid lines commented out and "removed" is a list of the invalid lines.
+    """
+    if removed_types_regex is None:
+        removed_types_regex = _get_removed_types_regex()
+    lines = content.split('\n')
+    removed = []
+    for i, line in enumerate(lines):
+        if removed_types_regex.search(line):
+            removed.append(line)
+            # Add ";" at the beginning of invalid lines (comment them out)
+            lines[i] = ';' + line
+    return ('\n'.join(lines), removed)
 
 
 def list_selinux_modules():
@@ -91,6 +104,60 @@ def list_selinux_modules():
     return modules
 
 
+def _read_extracted_module(name):
+    """
+    Read and remove the cil file extracted by semodule into the current directory
+    """
+    module_file = name + ".cil"
+    try:
+        with open(module_file) as cil_file:
+            return cil_file.read()
+    except (OSError, IOError) as e:
+        api.current_logger().warning("Error reading {}.cil : {}".format(name, e))
+        return None
+    finally:
+        try:
+            os.unlink(module_file)
+        except OSError:
+            pass
+
+
+def _extract_modules(priority, names):
+    """
+    Extract given modules of the same priority into cil and return their content
+
+    All modules are extracted by a single semodule call. In case it fails,
+    modules are extracted one by one to skip just those that cannot be extracted.
+    The function expects to be called in an empty working directory.
+
+    Returns a dict mapping module names to their content.
+    """
+    extract_cmd = ["semodule", "-c", "-X", priority]
+    try:
+        run(extract_cmd + [opt for name in names for opt in ("-E", name)])
+        extracted = names
+    except CalledProcessError:
+        extracted = []
+        for name in names:
+            try:
+                run(extract_cmd + ["-E", name])
+                extracted.append(name)
+            except CalledProcessError:
+                api.current_logger().warning("Module {} could not be extracted!".format(name))
+    contents = {}
+    for name in extracted:
+        content = _read_extracted_module(name)
+        if content is not None:
+            contents[name] = content
+    # remove leftovers of the failed batch call
+    for name in set(names) - set(extracted):
+        try:
+            os.unlink(name + ".cil")
+        except OSError:
+            pass
+    return contents
+
+
 def get_selinux_modules():
     """
     Read all custom SELinux policy modules from the system
@@ -109,20 +176,8 @@ def get_selinux_modules():
     template_list = []
     # list of rpms containing policy modules to be installed on RHEL 8
     install_rpms = []
-
-    # modules need to be extracted into cil files
-    # cd to /tmp/selinux and save working directory so that we can return there
-
-    # clear working directory
-    rmtree(WORKING_DIRECTORY, ignore_errors=True)
-
-    try:
-        wd = os.getcwd()
-        os.mkdir(WORKING_DIRECTORY)
-        os.chdir(WORKING_DIRECTORY)
-    except OSError:
-        api.current_logger().warning("Failed to access working directory! Aborting.")
-        return ([], [], [])
+    # custom modules to be extracted, per priority
+    custom_modules = {}
 
     for (name, priority) in modules:
         # Udica templates should not be transferred, we only need a list of their
@@ -142,40 +197,50 @@ def get_selinux_modules():
             # 100 - module from selinux-policy-* package
             # 200 - DSP module - installed by an RPM - handled by PES
             continue
-        # extract custom module and save it to SELinuxModule object
-        module_file = name + ".cil"
+        custom_modules.setdefault(priority, []).append(name)
+
+    # modules need to be extracted into cil files
+    # semodule extracts modules into the current directory, so cd to /tmp/selinux
+    # and save working directory so that we can return there
+    contents = {}
+    if custom_modules:
+        # clear working directory
+        rmtree(WORKING_DIRECTORY, ignore_errors=True)
+
         try:
-            run(["semodule", "-c", "-X", priority, "-E", name])
-            # check if the module contains invalid types and remove them if so
-            removed = check_module(module_file)
+            wd = os.getcwd()
+            os.mkdir(WORKING_DIRECTORY)
+            os.chdir(WORKING_DIRECTORY)
+        except OSError:
+            api.current_logger().warning("Failed to access working directory! Aborting.")
+            return ([], [], [])
 
-            # get content of the module
-            try:
-                with open(module_file) as cil_file:
-                    module_content = cil_file.read()
-            except OSError as e:
-                api.current_logger().warning("Error reading {}.cil : {}".format(name, e))
-                continue
+        # NOTE: modules of the same name can be installed on different priorities,
+        # so each priority is extracted separately
+        for priority, names in custom_modules.items():
+            for name, content in _extract_modules(priority, names).items():
+                contents[(name, priority)] = content
 
-            semodule_list.append(
-                SELinuxModule(
-                    name=name,
-                    priority=int(priority),
-                    content=module_content,
-                    removed=removed,
-                )
-            )
-        except CalledProcessError:
-            api.current_logger().warning("Module {} could not be extracted!".format(name))
-            continue
-        # rename the cil module file so that it does not clash
-        # with the same module on different priority
         try:
-            os.rename(module_file, "{}_{}".format(name, priority))
+            os.chdir(wd)
         except OSError:
-            api.current_logger().warning(
-                "Failed to rename module file {} to include priority.".format(name)
+            pass
+        rmtree(WORKING_DIRECTORY, ignore_errors=True)
+
+    # check if the modules contain invalid types and remove them if so
+    removed_types_regex = _get_removed_types_regex()
+    for (name, priority) in modules:
+        if (name, priority) not in contents:
+            continue
+        module_content, removed = check_module(contents[(name, priority)], removed_types_regex)
+        semodule_list.append(
+            SELinuxModule(
+                name=name,
+                priority=int(priority),
+                content=module_content,
+                removed=removed,
             )
+        )
 
     # Udica templates where moved to container-selinux package.
     # Make sure it is installed so that the templates can be reinstalled
@@ -185,25 +250,17 @@ def get_selinux_modules():
     # Process customizations introduced by "semanage"
     # this is necessary for check if container-selinux needs to be installed
     try:
-        run(["semanage", "export", "-f", "semanage"])
+        semanage = run(["semanage", "export"], split=True).get("stdout", [])
     except CalledProcessError:
-        pass
+        semanage = []
     # Check if modules contain any type, attribute, or boolean contained in container-selinux and install it if so
     # This is necessary since container policy module is part of selinux-policy-targeted in RHEL 7 (but not in RHEL 8)
-    try:
-        run(["grep", "-w", "-r", "-E", "|".join(CONTAINER_TYPES)], split=False)
+    container_types_regex = _compile_types_regex(CONTAINER_TYPES)
+    if (any(container_types_regex.search(module.content) for module in semodule_list)
+            or any(container_types_regex.search(line) for line in semanage)):
         # Request "container-selinux" to be installed since container types where used in local customizations
         # and container-selinux policy was removed from selinux-policy-* packages
         install_rpms.append("container-selinux")
-    except CalledProcessError:
-        # expected, ignore exception
-        pass
-
-    try:
-        os.chdir(wd)
-    except OSError:
-        pass
-    rmtree(WORKING_DIRECTORY, ignore_errors=True)
 
     return (semodule_list, template_list, list(set(install_rpms)))
 
@@ -1,6 +1,9 @@
+import os
+
 from leapp.libraries.actor import selinuxcontentscanner
 from leapp.libraries.common.config import version
-from leapp.libraries.stdlib import CalledProcessError
+from leapp.libraries.common.testutils import logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
 
 
 class run_mocked(object):
@@ -73,3 +76,76 @@ def test_get_selinux_customizations(monkeypatch):
     assert semanage_valid[1] == "port -a -t http_port_t -p udp 81"
     assert semanage_valid[2] == "fcontext -a -f a -t httpd_sys_content_t '/web(/.*)?'"
     assert semanage_removed == ["fcontext -a -f a -t cgdcbxd_exec_t '/ganesha(/.*)?'"]
+
+
+MODULE_CONTENT = {
+    "mock1": "(allow mock1_t container_runtime_t (file (read)))\n",
+    "mock2": "(typeattributeset cil_gen_require cephfs_t)\n(allow mock2_t cephfs_t (file (read)))\n"
+             "(allow mock2_t my_cephfs_t_new (file (read)))\n",
+    "zebra": "(allow zebra_t self (process (fork)))\n",
+}
+
+
+class run_extract_mocked(object):
+    """
+    Mock semodule extracting modules into the current directory
+    """
+    def __init__(self, broken=()):
+        self.commands = []
+        self.broken = broken
+
+    def __call__(self, args, split=False):
+        self.commands.append(args)
+        if args[:2] == ['semodule', '-lfull']:
+            return {'stdout': ["400 mock1 cil", "400 mock2 cil", "300 zebra cil", "200 zebra cil",
+                               "400 broken cil", "100 base_container cil"]}
+        if args == ['semanage', 'export']:
+            return {'stdout': ["boolean -m -1 cron_can_relabel"]}
+        if args[:4] == ['semodule', '-c', '-X', args[3]]:
+            names = args[5::2]
+            for name in names:
+                if name in self.broken:
+                    raise CalledProcessError(args, 1, "Mock error ;)")
+                with open(name + '.cil', 'w') as f:
+                    f.write(MODULE_CONTENT[name])
+            return {'stdout': []}
+        raise ValueError('Attempted to call unexpected command: {}'.format(args))
+
+
+def test_check_module(monkeypatch):
+    monkeypatch.setattr(version, "get_source_major_version", lambda: '8')
+
+    content, removed = selinuxcontentscanner.check_module(MODULE_CONTENT["mock2"])
+
+    assert removed == ["(typeattributeset cil_gen_require cephfs_t)", "(allow mock2_t cephfs_t (file (read)))"]
+    assert content == (";(typeattributeset cil_gen_require cephfs_t)\n;(allow mock2_t cephfs_t (file (read)))\n"
+                       "(allow mock2_t my_cephfs_t_new (file (read)))\n")
+    assert selinuxcontentscanner.check_module(MODULE_CONTENT["zebra"]) == (MODULE_CONTENT["zebra"], [])
+
+
+def test_get_selinux_modules(monkeypatch, tmpdir):
+    monkeypatch.setattr(version, "get_source_major_version", lambda: '8')
+    monkeypatch.setattr(api, "current_logger", logger_mocked())
+    monkeypatch.setattr(selinuxcontentscanner, "WORKING_DIRECTORY", os.path.join(tmpdir.strpath, "selinux"))
+    run = run_extract_mocked(broken=("broken",))
+    monkeypatch.setattr(selinuxcontentscanner, "run", run)
+    monkeypatch.setitem(MODULE_CONTENT, "broken", "")
+
+    modules, templates, rpms = selinuxcontentscanner.get_selinux_modules()
+
+    assert [(m.name, m.priority) for m in modules] == [("mock1", 400), ("mock2", 400), ("zebra", 300)]
+    assert modules[0].content == MODULE_CONTENT["mock1"]
+    assert modules[1].removed == ["(typeattributeset cil_gen_require cephfs_t)",
+                                  "(allow mock2_t cephfs_t (file (read)))"]
+    assert [(t.name, t.priority) for t in templates] == [("base_container", 100)]
+    assert rpms == ["container-selinux"]
+    assert "Module broken could not be extracted!" in api.current_logger.warnmsg
+    # one call per priority, modules are extracted one by one only when the call fails
+    assert sorted(cmd[3:] for cmd in run.commands if cmd[:2] == ['semodule', '-c']) == [
+        ['300', '-E', 'zebra'],
+        ['400', '-E', 'broken'],
+        ['400', '-E', 'mock1'],
+        ['400', '-E', 'mock1', '-E', 'mock2', '-E', 'broken'],
+        ['400', '-E', 'mock2'],
+    ]
+    assert not os.path.exists(selinuxcontentscanner.WORKING_DIRECTORY)
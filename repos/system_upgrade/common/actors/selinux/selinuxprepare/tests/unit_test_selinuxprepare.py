@@ -1,20 +1,25 @@
 from leapp.libraries.actor import selinuxprepare
+from leapp.libraries.common import semodule
+from leapp.libraries.common.testutils import logger_mocked
 from leapp.libraries.stdlib import api, CalledProcessError, run
 from leapp.models import SELinuxModule, SELinuxModules
 
 
 class run_mocked(object):
-    def __init__(self):
+    def __init__(self, failing=()):
         self.args = []
         self.called = 0
         self.removed_modules = set()
         self.non_semodule_calls = 0
+        self.failing = failing
 
     def __call__(self, args, split=True):
         self.called += 1
         self.args = args
 
         if self.args[0] == 'semodule':
+            if any(module in self.args for module in self.failing):
+                raise CalledProcessError('Mock error ;)', args, {'exit_code': 1, 'stderr': 'error'})
             stdout = [
                 'libsemanage.semanage_direct_remove_key: Removing last dummy module '
                 + '(no other dummy module exists at another priority).'
@@ -41,11 +46,27 @@ def test_remove_custom_modules(monkeypatch):
         yield SELinuxModules(modules=semodule_list, templates=template_list)
 
     monkeypatch.setattr(api, 'consume', consume_SELinuxModules_mocked)
-    monkeypatch.setattr(selinuxprepare, 'run', run_mocked())
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(semodule, 'run', run_mocked())
 
     selinuxprepare.remove_custom_modules()
-    # 1 call for udica templates and 1 for other custom modules
-    assert selinuxprepare.run.called == 2
-    assert selinuxprepare.run.non_semodule_calls == 0
+    # a single call for both udica templates and other custom modules
+    assert semodule.run.called == 1
+    assert semodule.run.non_semodule_calls == 0
     # verify that remove_custom_modules tried to remove all given modules
-    assert (set(mock_modules).union(set(mock_templates)) - selinuxprepare.run.removed_modules) == set()
+    assert (set(mock_modules).union(set(mock_templates)) - semodule.run.removed_modules) == set()
+
+
+def test_remove_custom_modules_failed(monkeypatch):
+    modules = [SELinuxModule(name=name, priority=400, content='', removed=[]) for name in 'abcdef']
+
+    monkeypatch.setattr(api, 'consume', lambda *models: iter([SELinuxModules(modules=modules, templates=[])]))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(semodule, 'run', run_mocked(failing=('e',)))
+
+    selinuxprepare.remove_custom_modules()
+
+    # abcdef fails -> abc, def fails -> d, ef fails -> e fails, f
+    assert semodule.run.called == 7
+    assert semodule.run.removed_modules == set('abcdf')
+    assert api.current_logger.warnmsg == ['Failed to remove module e on priority 400: error']
@@ -3,7 +3,7 @@ import os
 from leapp.exceptions import StopActorExecutionError
 from leapp.libraries.common import systemd
 from leapp.libraries.common.config.version import get_target_major_version
-from leapp.libraries.stdlib import api, CalledProcessError, run
+from leapp.libraries.stdlib import api, CalledProcessError
 from leapp.models import SystemdBrokenSymlinksSource, SystemdBrokenSymlinksTarget, SystemdServicesInfoSource
 
 _INSTALLATION_CHANGED_EL8 = ['rngd.service', 'sysstat.service']
@@ -25,22 +25,27 @@ def _service_enabled_source(service_info, name):
     return service_file and service_file.state == 'enabled'
 
 
-def _is_unit_enabled(unit):
+def _get_unit_file_states():
     try:
-        ret = run(['systemctl', 'is-enabled', unit], split=True)['stdout']
-        return ret and ret[0] == 'enabled'
-    except (OSError, CalledProcessError):
-        return False
+        return systemd.get_unit_file_states()
+    except (OSError, CalledProcessError) as err:
+        api.current_logger().warning('Cannot obtain states of systemd unit files: {}'.format(str(err)))
+        return {}
+
+
+def _is_unit_enabled(unit, unit_file_states):
+    return systemd.get_unit_file_state(unit, unit_file_states) == 'enabled'
 
 
 def _handle_newly_broken_symlinks(symlinks, service_info):
+    unit_file_states = _get_unit_file_states()
     for symlink in symlinks:
         unit = os.path.basename(symlink)
         try:
-            if not _is_unit_enabled(unit):
+            if not _is_unit_enabled(unit, unit_file_states):
                 # removes the broken symlink
                 systemd.disable_unit(unit)
-            elif _service_enabled_source(service_info, unit) and _is_unit_enabled(unit):
+            elif _service_enabled_source(service_info, unit):
                 # removes the old symlinks and creates the new ones
                 systemd.reenable_unit(unit)
         except CalledProcessError:
@@ -51,9 +56,13 @@ def _handle_newly_broken_symlinks(symlinks, service_info):
 def _handle_bad_symlinks(service_files):
     install_changed_units = _get_installation_changed_units()
     potentially_bad = [s for s in service_files if s.name in install_changed_units]
+    if not potentially_bad:
+        return
 
+    # NOTE: states are obtained after broken symlinks are handled as that could change them
+    unit_file_states = _get_unit_file_states()
     for unit_file in potentially_bad:
-        if unit_file.state == 'enabled' and _is_unit_enabled(unit_file.name):
+        if unit_file.state == 'enabled' and _is_unit_enabled(unit_file.name, unit_file_states):
             systemd.reenable_unit(unit_file.name)
 
 
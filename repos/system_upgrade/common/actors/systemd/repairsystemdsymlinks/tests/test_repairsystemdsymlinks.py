@@ -27,10 +27,11 @@ def test_bad_symslinks(monkeypatch):
         SystemdServiceFile(name='world.service', state='disabled'),
     ]
 
-    def is_unit_enabled_mocked(unit):
+    def is_unit_enabled_mocked(unit, unit_file_states):
         return True
 
     monkeypatch.setattr(repairsystemdsymlinks, '_is_unit_enabled', is_unit_enabled_mocked)
+    monkeypatch.setattr(systemd, 'get_unit_file_states', lambda: {})
 
     reenable_mocked = MockedSystemdCmd()
     monkeypatch.setattr(systemd, 'reenable_unit', reenable_mocked)
@@ -54,7 +55,7 @@ def test_handle_newly_broken_symlink(monkeypatch):
         '/etc/systemd/system/multi-user.target.wants/bar.service',
     ]
 
-    def is_unit_enabled_mocked(unit):
+    def is_unit_enabled_mocked(unit, unit_file_states):
         return unit in ('hello.service', 'foo.service')
 
     expect_disabled = [
@@ -69,6 +70,7 @@ def test_handle_newly_broken_symlink(monkeypatch):
     ]
 
     monkeypatch.setattr(repairsystemdsymlinks, '_is_unit_enabled', is_unit_enabled_mocked)
+    monkeypatch.setattr(systemd, 'get_unit_file_states', lambda: {})
 
     reenable_mocked = MockedSystemdCmd()
     monkeypatch.setattr(systemd, 'reenable_unit', reenable_mocked)
@@ -89,3 +91,19 @@ def test_handle_newly_broken_symlink(monkeypatch):
 
     assert reenable_mocked.units == expect_reenabled
     assert disable_mocked.units == expect_disabled
+
+
+def test_is_unit_enabled(monkeypatch):
+    unit_file_states = {'hello.service': 'enabled', 'world.service': 'disabled', 'foo.service': 'static'}
+
+    def run_mocked(cmd, *args, **kwargs):
+        assert cmd == ['systemctl', 'is-enabled', 'getty@tty1.service']
+        return {'stdout': ['enabled']}
+
+    monkeypatch.setattr(systemd, 'run', run_mocked)
+
+    assert repairsystemdsymlinks._is_unit_enabled('hello.service', unit_file_states)
+    assert not repairsystemdsymlinks._is_unit_enabled('world.service', unit_file_states)
+    assert not repairsystemdsymlinks._is_unit_enabled('foo.service', unit_file_states)
+    # instances of template units are not listed by systemctl list-unit-files
+    assert repairsystemdsymlinks._is_unit_enabled('getty@tty1.service', unit_file_states)
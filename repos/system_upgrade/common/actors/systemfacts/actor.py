@@ -1,6 +1,5 @@
 from leapp.actors import Actor
 from leapp.libraries.actor import systemfacts
-from leapp.libraries.common.config import architecture
 from leapp.models import (
     ActiveKernelModulesFacts,
     DefaultGrubInfo,
@@ -50,18 +49,4 @@ class SystemFactsActor(Actor):
     tags = (IPUWorkflowTag, FactsPhaseTag,)
 
     def process(self):
-        self.produce(systemfacts.get_sysctls_status())
-        self.produce(systemfacts.get_active_kernel_modules_status(self.log))
-        self.produce(systemfacts.get_system_users_status())
-        self.produce(systemfacts.get_system_groups_status())
-        self.produce(systemfacts.get_repositories_status())
-        self.produce(systemfacts.get_selinux_status())
-        self.produce(systemfacts.get_firewalls_status())
-        self.produce(systemfacts.get_firmware())
-
-        if not architecture.matches_architecture(architecture.ARCH_S390X):
-            self.produce(systemfacts.get_default_grub_conf())
-
-        bios_grubcfg_details = systemfacts.get_bios_grubcfg_details()
-        if bios_grubcfg_details:
-            self.produce(bios_grubcfg_details)
+        systemfacts.produce_facts(self.log)
@@ -1,16 +1,20 @@
 import errno
 import functools
-import grp
+import io
 import logging
 import os
-import pwd
 import re
+import stat
+import sys
+import time
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing.pool import ThreadPool
 
 import six
 
 from leapp import reporting
 from leapp.exceptions import StopActorExecutionError
-from leapp.libraries.common import repofileutils
+from leapp.libraries.common import factsnapshot, repofileutils
 from leapp.libraries.common.config import architecture
 from leapp.libraries.stdlib import api, CalledProcessError, run
 from leapp.models import (
@@ -33,6 +37,48 @@ from leapp.models import (
     UsersFacts
 )
 
+PROC_MODULES_PATH = '/proc/modules'
+SYS_MODULE_DIR = '/sys/module'
+PROC_SYS_DIR = '/proc/sys'
+
+SYSCTL_UNSTABLE = (
+    'fs.dentry-state', 'fs.file-nr', 'fs.inode-nr',
+    'fs.inode-state', 'kernel.random.uuid', 'kernel.random.entropy_avail',
+    'kernel.ns_last_pid', 'net.netfilter.nf_conntrack_count',
+    'net.netfilter.nf_conntrack_events', 'kernel.sched_domain.',
+    'dev.cdrom.info', 'kernel.pty.nr'
+)
+"""
+Prefixes of sysctl variables with values changing in time (see `get_sysctls_status`)
+"""
+
+SYSCTL_DEPRECATED = ('base_reachable_time', 'retrans_time')
+"""
+Names of deprecated sysctl variables, not listed by `sysctl -a`
+"""
+
+ETC_PASSWD = '/etc/passwd'
+ETC_GROUP = '/etc/group'
+
+USERS_INPUTS = [ETC_PASSWD]
+GROUPS_INPUTS = [ETC_GROUP]
+REPOSITORIES_CONF_INPUTS = ['/etc/yum.conf', '/etc/dnf/dnf.conf']
+"""
+Inputs of facts reused from the previous leapp execution when not changed (see factsnapshot)
+
+Repository directories are added to the inputs of repositories.
+"""
+
+MAX_COLLECTOR_WORKERS = 4
+"""
+Maximal number of collectors of facts running in parallel
+"""
+
+COLLECTORS_TIMEOUT = 600
+"""
+Time (in seconds) to wait for all collectors of facts to finish
+"""
+
 
 def aslist(f):
     """ Decorator used to convert generator to list """
@@ -58,28 +104,65 @@ def anyhasprefix(value, prefixes):
     return False
 
 
-@aslist
-def _get_system_users():
-    skipped_user_names = []
-    for p in pwd.getpwall():
+def _iter_db_rows(path, fields_count):
+    """
+    Yield rows of the local user database file (e.g. /etc/passwd) as lists of fields
+
+    The file is read line by line, so the whole database is never loaded into
+    memory. Empty lines and comments are ignored. Rows with less fields than
+    expected are padded by empty fields (e.g. special entries for NIS such
+    as `+@scanners`).
+    """
+    with io.open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            fields = line.split(':', fields_count - 1)
+            yield fields + [''] * (fields_count - len(fields))
+
+
+def _parse_id(value):
+    # The UID and GID fields are handled as 0 when not specified, as by pwd and grp
+    return int(value) if value else 0
+
+
+def _iter_system_users():
+    """
+    Yield (name, row) pairs for entries of /etc/passwd, row is None for skipped entries
+
+    The row is the compact (name, uid, gid, home) tuple.
+
+    Only the local database is read. Users from other NSS sources (e.g.
+    LDAP or sssd) are not enumerated.
+    """
+    for name, _passwd, uid, gid, _gecos, home, _shell in _iter_db_rows(ETC_PASSWD, 7):
         # The /etc/passwd can contain special entries from another service source such as NIS or LDAP. These entries
         # start with + or - sign and might not contain all the mandatory fields, thus are skipped along with other
-        # invalid entries for now. The UID and GID fields are always defined by pwd to 0 even when not specifiead in
-        # /etc/passwd.
-        if p.pw_name != '' and not p.pw_name.startswith(('+', '-')) and p.pw_dir:
-            yield User(
-                name=p.pw_name,
-                uid=p.pw_uid,
-                gid=p.pw_gid,
-                home=p.pw_dir
-            )
+        # invalid entries for now.
+        row = None
+        if name != '' and not name.startswith(('+', '-')) and home:
+            try:
+                row = (name, _parse_id(uid), _parse_id(gid), home)
+            except ValueError:
+                pass
+        yield name, row
+
+
+def _get_system_users():
+    users = []
+    skipped_user_names = []
+    for name, row in _iter_system_users():
+        if row:
+            users.append(row)
         else:
-            skipped_user_names.append(p.pw_name)
+            skipped_user_names.append(name)
 
     if skipped_user_names:
         api.current_logger().debug("These users from /etc/passwd that are special entries for service "
                                    "like NIS, or don't contain all mandatory fields won't be included "
                                    "in UsersFacts: {}".format(skipped_user_names))
+    return [User(name=name, uid=uid, gid=gid, home=home) for name, uid, gid, home in users]
 
 
 def get_system_users_status():
@@ -87,27 +170,42 @@ def get_system_users_status():
     return UsersFacts(users=_get_system_users())
 
 
-@aslist
-def _get_system_groups():
-    skipped_group_names = []
-    for g in grp.getgrall():
+def _iter_system_groups():
+    """
+    Yield (name, row) pairs for entries of /etc/group, row is None for skipped entries
+
+    The row is the compact (name, gid, members) tuple.
+
+    Only the local database is read. Groups from other NSS sources (e.g.
+    LDAP or sssd) are not enumerated.
+    """
+    for name, _passwd, gid, members in _iter_db_rows(ETC_GROUP, 4):
         # The /etc/group can contain special entries from another service source such as NIS or LDAP. These entries
         # start with + or - sign and might not contain all the mandatory fields, thus are skipped along with other
-        # invalid entries for now. The GID field is always defined by pwd to 0 even when not specifiead in
-        # /etc/group.
-        if g.gr_name != '' and not g.gr_name.startswith(('+', '-')):
-            yield Group(
-                name=g.gr_name,
-                gid=g.gr_gid,
-                members=g.gr_mem
-            )
+        # invalid entries for now.
+        row = None
+        if name != '' and not name.startswith(('+', '-')):
+            try:
+                row = (name, _parse_id(gid), [member for member in members.split(',') if member])
+            except ValueError:
+                pass
+        yield name, row
+
+
+def _get_system_groups():
+    groups = []
+    skipped_group_names = []
+    for name, row in _iter_system_groups():
+        if row:
+            groups.append(row)
         else:
-            skipped_group_names.append(g.gr_name)
+            skipped_group_names.append(name)
 
     if skipped_group_names:
         api.current_logger().debug("These groups from /etc/group that are special entries for service "
                                    "like NIS, or don't contain all mandatory fields won't be included "
                                    "in GroupsFacts: {}".format(skipped_group_names))
+    return [Group(name=name, gid=gid, members=members) for name, gid, members in groups]
 
 
 def get_system_groups_status():
@@ -115,59 +213,116 @@ def get_system_groups_status():
     return GroupsFacts(groups=_get_system_groups())
 
 
-@aslist
-def _get_active_kernel_modules(logger):
-    lines = run(['lsmod'], split=True)['stdout']
-    for l in lines[1:]:
-        name = l.split(' ')[0]
-
-        # Read parameters of the given module as exposed by the
-        # `/sys` VFS, if there are no parameters exposed we just
-        # take the name of the module
-        base_path = '/sys/module/{module}'.format(module=name)
-        parameters_path = os.path.join(base_path, 'parameters')
-        if not os.path.exists(parameters_path):
-            yield ActiveKernelModule(filename=name, parameters=[])
-            continue
+def _get_loaded_kernel_modules():
+    """
+    Return names of loaded kernel modules in the order as listed by `lsmod`
+    """
+    with open(PROC_MODULES_PATH) as f:
+        return [line.split(' ', 1)[0] for line in f if line.strip()]
+
+
+def _normalize_signature(signature):
+    if not signature:
+        return None
+    # Remove whitespace from the signature string
+    return re.sub(r"\s+", "", signature, flags=re.UNICODE) or None
+
+
+def _get_kernel_module_signature(name):
+    try:
+        signature = run(['modinfo', '-F', 'signature', name], split=False)['stdout']
+    except CalledProcessError:
+        signature = None
+    return _normalize_signature(signature)
 
-        # Use `modinfo` to probe for signature information
-        parameter_dict = {}
+
+def _parse_modinfo_signatures(lines):
+    """
+    Return the list of signatures of modules described in the `modinfo` output
+
+    Each module in the output starts with the `filename` field. The value of
+    the `signature` field continues on the following indented lines.
+    """
+    signatures = []
+    in_signature = False
+    for line in lines:
+        if line.startswith('filename:'):
+            signatures.append('')
+            in_signature = False
+        elif signatures and line.startswith('signature:'):
+            signatures[-1] = line[len('signature:'):]
+            in_signature = True
+        elif in_signature and line[:1].isspace():
+            signatures[-1] += line
+        else:
+            in_signature = False
+    return [_normalize_signature(signature) for signature in signatures]
+
+
+def _get_kernel_module_signatures(names):
+    """
+    Return the dict of signatures of given kernel modules
+
+    All modules are queried by a single `modinfo` call. In case the output
+    cannot be matched to the modules (e.g. a module file cannot be found),
+    `modinfo` is called for each module separately.
+    """
+    if not names:
+        return {}
+    try:
+        signatures = _parse_modinfo_signatures(run(['modinfo'] + list(names), split=True)['stdout'])
+    except CalledProcessError:
+        signatures = []
+    if len(signatures) != len(names):
+        api.current_logger().debug(
+            'Cannot get signatures of kernel modules by a single modinfo call. Querying modules one by one.'
+        )
+        return {name: _get_kernel_module_signature(name) for name in names}
+    return dict(zip(names, signatures))
+
+
+def _get_kernel_module_parameters(name, parameters_path, logger):
+    parameters = []
+    # Since we're using the `/sys` VFS we need to use `os.listdir()` to get
+    # all the property names and then just read from all the listed paths
+    for param in sorted(os.listdir(parameters_path)):
         try:
-            signature = run(['modinfo', '-F', 'signature', name], split=False)['stdout']
-        except CalledProcessError:
-            signature = None
+            with open(os.path.join(parameters_path, param), mode='r') as fp:
+                parameters.append(KernelModuleParameter(name=param, value=fp.read().strip()))
+        except IOError as exc:
+            # Some parameters are write-only, in that case we just log the name of parameter
+            # and the module and continue
+            if exc.errno in (errno.EACCES, errno.EPERM):
+                msg = 'Unable to read parameter "{param}" of kernel module "{name}"'
+                logger.warning(msg.format(param=param, name=name))
+            else:
+                raise exc
+    return parameters
 
-        signature_string = None
-        if signature:
-            # Remove whitespace from the signature string
-            signature_string = re.sub(r"\s+", "", signature, flags=re.UNICODE)
 
-        # Since we're using the `/sys` VFS we need to use `os.listdir()` to get
-        # all the property names and then just read from all the listed paths
-        parameters = sorted(os.listdir(parameters_path))
-        for param in parameters:
-            try:
-                with open(os.path.join(parameters_path, param), mode='r') as fp:
-                    parameter_dict[param] = fp.read().strip()
-            except IOError as exc:
-                # Some parameters are write-only, in that case we just log the name of parameter
-                # and the module and continue
-                if exc.errno in (errno.EACCES, errno.EPERM):
-                    msg = 'Unable to read parameter "{param}" of kernel module "{name}"'
-                    logger.warning(msg.format(param=param, name=name))
-                else:
-                    raise exc
-
-        # Project the dictionary as a list of key values
-        items = [
-            KernelModuleParameter(name=k, value=v)
-            for (k, v) in six.iteritems(parameter_dict)
-        ]
+@aslist
+def _get_active_kernel_modules(logger):
+    names = _get_loaded_kernel_modules()
+
+    # Read parameters of the given module as exposed by the
+    # `/sys` VFS, if there are no parameters exposed we just
+    # take the name of the module
+    parameters_paths = {
+        name: os.path.join(SYS_MODULE_DIR, name, 'parameters') for name in names
+    }
+    signatures = _get_kernel_module_signatures(
+        [name for name in names if os.path.exists(parameters_paths[name])]
+    )
+
+    for name in names:
+        if name not in signatures:
+            yield ActiveKernelModule(filename=name, parameters=[])
+            continue
 
         yield ActiveKernelModule(
             filename=name,
-            parameters=items,
-            signature=signature_string
+            parameters=_get_kernel_module_parameters(name, parameters_paths[name], logger),
+            signature=signatures[name]
         )
 
 
@@ -176,24 +331,59 @@ def get_active_kernel_modules_status(logger):
     return ActiveKernelModulesFacts(kernel_modules=_get_active_kernel_modules(logger))
 
 
-@aslist
-def _get_sysctls():
-    unstable = ('fs.dentry-state', 'fs.file-nr', 'fs.inode-nr',
-                'fs.inode-state', 'kernel.random.uuid', 'kernel.random.entropy_avail',
-                'kernel.ns_last_pid', 'net.netfilter.nf_conntrack_count',
-                'net.netfilter.nf_conntrack_events', 'kernel.sched_domain.',
-                'dev.cdrom.info', 'kernel.pty.nr')
-
-    variables = []
-    for sc in run(['sysctl', '-a'], split=True)['stdout']:
-        name = sc.split(' ', 1)[0]
-        # if the sysctl name has an unstable prefix, we skip
-        if anyhasprefix(name, unstable):
+def _read_sysctl(path, name):
+    """
+    Yield the sysctl variable in the `name = value` format, as printed by `sysctl -a`
+
+    Each line of a multi-line value is printed as a separate variable. Variables
+    that cannot be read or are empty are skipped.
+    """
+    try:
+        with io.open(path, encoding='utf-8', errors='replace') as f:
+            content = f.read()
+    except (IOError, OSError):
+        return
+    if not content:
+        return
+    lines = content.split('\n')
+    if content.endswith('\n'):
+        lines.pop()
+    for line in lines:
+        yield u'{} = {}'.format(name, line)
+
+
+def _walk_sysctls(path, prefix=''):
+    """
+    Yield stable sysctl variables from the /proc/sys directory
+
+    Equivalent of `sysctl -a`: dots in names of files are displayed as
+    slashes, deprecated and write-only variables are skipped. Directories
+    with unstable variables are not walked at all.
+    """
+    for entry in sorted(os.listdir(path)):
+        if entry.startswith('.') or entry in SYSCTL_DEPRECATED:
+            continue
+        entry_path = os.path.join(path, entry)
+        name = prefix + entry.replace('.', '/')
+        try:
+            mode = os.lstat(entry_path).st_mode
+        except OSError:
             continue
-        variables.append(sc)
+        if stat.S_ISDIR(mode):
+            # if all variables in the directory have an unstable prefix, we skip
+            if not anyhasprefix(name + '.', SYSCTL_UNSTABLE):
+                for var in _walk_sysctls(entry_path, name + '.'):
+                    yield var
+        # if the sysctl name has an unstable prefix, we skip
+        elif mode & stat.S_IRUSR and not anyhasprefix(name, SYSCTL_UNSTABLE):
+            for var in _read_sysctl(entry_path, name):
+                yield var
+
 
+@aslist
+def _get_sysctls():
     # sort our variables so they can be diffed directly when needed
-    for var in sorted(variables):
+    for var in sorted(_walk_sysctls(PROC_SYS_DIR)):
         name, value = tuple(map(type(var).strip, var.split('=', 1)))
         yield SysctlVariable(
             name=name,
@@ -354,3 +544,86 @@ def get_bios_grubcfg_details():
         insmod_bls = bool('insmod blscfg' in content)
         return GrubCfgBios(insmod_bls=insmod_bls)
     return None
+
+
+def _get_repositories_inputs():
+    return sorted(set(REPOSITORIES_CONF_INPUTS + repofileutils.get_repodirs()))
+
+
+def _get_collectors(logger):
+    """
+    Return the list of (name, collector) pairs, in the order of produced messages
+    """
+    collectors = [
+        ('sysctls', get_sysctls_status),
+        ('kernel modules', functools.partial(get_active_kernel_modules_status, logger)),
+        ('users', functools.partial(
+            factsnapshot.reuse_or_collect, 'users', USERS_INPUTS, UsersFacts, get_system_users_status
+        )),
+        ('groups', functools.partial(
+            factsnapshot.reuse_or_collect, 'groups', GROUPS_INPUTS, GroupsFacts, get_system_groups_status
+        )),
+        ('repositories', functools.partial(
+            factsnapshot.reuse_or_collect, 'repositories', _get_repositories_inputs(),
+            RepositoriesFacts, get_repositories_status
+        )),
+        ('selinux', get_selinux_status),
+        ('firewalls', get_firewalls_status),
+        ('firmware', get_firmware),
+    ]
+    if not architecture.matches_architecture(architecture.ARCH_S390X):
+        collectors.append(('default grub', get_default_grub_conf))
+    collectors.append(('bios grub.cfg', get_bios_grubcfg_details))
+    return collectors
+
+
+def _run_collector(name, collector):
+    """
+    Run the collector, returning its result and info about a raised exception (if any)
+    """
+    start = time.time()
+    try:
+        return collector(), None
+    except Exception:  # pylint: disable=broad-except
+        return None, sys.exc_info()
+    finally:
+        api.current_logger().debug('Collecting of {} facts took {:.2f} s.'.format(name, time.time() - start))
+
+
+def produce_facts(logger):
+    """
+    Collect and produce all system facts
+
+    The collectors are independent on each other, so they run in a pool
+    of workers. Messages are produced in the order of collectors (see
+    `_get_collectors`), regardless of the order the collectors finish in.
+    In case any collector fails, results of all other collectors are
+    produced first and then the error of the first failed collector is
+    raised - the same one that would be raised by the sequential collection.
+    """
+    collectors = _get_collectors(logger)
+    pool = ThreadPool(min(len(collectors), MAX_COLLECTOR_WORKERS))
+    try:
+        async_results = [(name, pool.apply_async(_run_collector, (name, collector))) for name, collector in collectors]
+        pool.close()
+        deadline = time.time() + COLLECTORS_TIMEOUT
+        failures = []
+        for name, async_result in async_results:
+            try:
+                result, exc_info = async_result.get(timeout=max(0, deadline - time.time()))
+            except PoolTimeoutError:
+                error = StopActorExecutionError(
+                    'Cannot collect system facts',
+                    details={'details': 'Collecting of {} facts did not finish in {} s.'.format(
+                        name, COLLECTORS_TIMEOUT)}
+                )
+                result, exc_info = None, (StopActorExecutionError, error, None)
+            if exc_info:
+                api.current_logger().error('Collecting of {} facts failed: {}'.format(name, exc_info[1]))
+                failures.append(exc_info)
+            elif result is not None:
+                api.produce(result)
+    finally:
+        pool.terminate()
+    if failures:
+        six.reraise(*failures[0])
@@ -1,11 +1,13 @@
-import grp
-import pwd
+import os
+import time
 
 import pytest
 
+from leapp.exceptions import StopActorExecutionError
+from leapp.libraries.actor import systemfacts
 from leapp.libraries.actor.systemfacts import _get_system_groups, _get_system_users, anyendswith, anyhasprefix, aslist
 from leapp.libraries.common.testutils import logger_mocked
-from leapp.libraries.stdlib import api
+from leapp.libraries.stdlib import api, CalledProcessError
 from leapp.snactor.fixture import current_actor_libraries
 
 
@@ -50,24 +52,18 @@ def test_aslist(current_actor_libraries):
         (['root', '+@scanners', 'dbus'], '', ['root', '+@scanners', 'dbus']),
     ]
 )
-def test_get_system_users(monkeypatch, etc_passwd_names, etc_passwd_directory, skipped_user_names):
+def test_get_system_users(monkeypatch, tmpdir, etc_passwd_names, etc_passwd_directory, skipped_user_names):
+    etc_passwd = os.path.join(tmpdir.strpath, 'passwd')
+    with open(etc_passwd, 'w') as f:
+        for etc_passwd_name in etc_passwd_names:
+            f.write('{}:x:0:0::{}:/bin/bash\n'.format(etc_passwd_name, etc_passwd_directory))
 
-    class MockedPwdEntry(object):
-        def __init__(self, pw_name, pw_uid, pw_gid, pw_dir):
-            self.pw_name = pw_name
-            self.pw_uid = pw_uid
-            self.pw_gid = pw_gid
-            self.pw_dir = pw_dir
-
-    etc_passwd_contents = []
-    for etc_passwd_name in etc_passwd_names:
-        etc_passwd_contents.append(MockedPwdEntry(etc_passwd_name, 0, 0, etc_passwd_directory))
-
-    monkeypatch.setattr(pwd, 'getpwall', lambda: etc_passwd_contents)
+    monkeypatch.setattr(systemfacts, 'ETC_PASSWD', etc_passwd)
     monkeypatch.setattr(api, 'current_logger', logger_mocked())
 
-    _get_system_users()
+    users = _get_system_users()
 
+    assert [user.name for user in users] == [name for name in etc_passwd_names if name not in skipped_user_names]
     if skipped_user_names:
         assert len(api.current_logger().dbgmsg) == 1
 
@@ -81,6 +77,25 @@ def test_get_system_users(monkeypatch, etc_passwd_names, etc_passwd_directory, s
         assert not api.current_logger().dbgmsg
 
 
+def test_get_system_users_fields(monkeypatch, tmpdir):
+    etc_passwd = os.path.join(tmpdir.strpath, 'passwd')
+    with open(etc_passwd, 'w') as f:
+        f.write('# comment\n\n')
+        f.write('root:x:0:0:root:/root:/bin/bash\n')
+        f.write('user:x:1000:1001:User Name:/home/user:/bin/bash\n')
+        f.write('nouid:x:::No ID:/home/nouid:/bin/bash\n')
+        f.write('invalid:x:abc:0::/home/invalid:/bin/bash\n')
+        f.write('+@scanners\n')
+
+    monkeypatch.setattr(systemfacts, 'ETC_PASSWD', etc_passwd)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    users = [(user.name, user.uid, user.gid, user.home) for user in _get_system_users()]
+
+    assert users == [('root', 0, 0, '/root'), ('user', 1000, 1001, '/home/user'), ('nouid', 0, 0, '/home/nouid')]
+    assert 'invalid' in api.current_logger().dbgmsg[0]
+
+
 @pytest.mark.parametrize(
     ('etc_group_names', 'skipped_group_names'),
     [
@@ -88,23 +103,18 @@ def test_get_system_users(monkeypatch, etc_passwd_names, etc_passwd_directory, s
         (['cdrom', '+@scanners', 'floppy', '-@usrc', ''], ['+@scanners', '-@usrc', '']),
     ]
 )
-def test_get_system_groups(monkeypatch, etc_group_names, skipped_group_names):
+def test_get_system_groups(monkeypatch, tmpdir, etc_group_names, skipped_group_names):
+    etc_group = os.path.join(tmpdir.strpath, 'group')
+    with open(etc_group, 'w') as f:
+        for etc_group_name in etc_group_names:
+            f.write('{}:x:0:\n'.format(etc_group_name))
 
-    class MockedGrpEntry(object):
-        def __init__(self, gr_name, gr_gid, gr_mem):
-            self.gr_name = gr_name
-            self.gr_gid = gr_gid
-            self.gr_mem = gr_mem
-
-    etc_group_contents = []
-    for etc_group_name in etc_group_names:
-        etc_group_contents.append(MockedGrpEntry(etc_group_name, 0, []))
-
-    monkeypatch.setattr(grp, 'getgrall', lambda: etc_group_contents)
+    monkeypatch.setattr(systemfacts, 'ETC_GROUP', etc_group)
     monkeypatch.setattr(api, 'current_logger', logger_mocked())
 
-    _get_system_groups()
+    groups = _get_system_groups()
 
+    assert [group.name for group in groups] == [name for name in etc_group_names if name not in skipped_group_names]
     if skipped_group_names:
         assert len(api.current_logger().dbgmsg) == 1
 
@@ -116,3 +126,173 @@ def test_get_system_groups(monkeypatch, etc_group_names, skipped_group_names):
                 assert group_name not in api.current_logger().dbgmsg[0]
     else:
         assert not api.current_logger().dbgmsg
+
+
+def test_get_system_groups_members(monkeypatch, tmpdir):
+    etc_group = os.path.join(tmpdir.strpath, 'group')
+    with open(etc_group, 'w') as f:
+        f.write('wheel:x:10:root,user\nusers:x:100:\n')
+
+    monkeypatch.setattr(systemfacts, 'ETC_GROUP', etc_group)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    groups = [(group.name, group.gid, group.members) for group in _get_system_groups()]
+
+    assert groups == [('wheel', 10, ['root', 'user']), ('users', 100, [])]
+
+
+MODINFO_OUTPUT = """filename:       /lib/modules/4.18.0/kernel/fs/xfs/xfs.ko.xz
+license:        GPL
+sig_hashalgo:   sha256
+signature:      30:2E:AB
+\t\tCD:EF
+parm:           enable:Enable the feature (bool)
+filename:       /lib/modules/4.18.0/kernel/net/bridge/bridge.ko.xz
+license:        GPL
+parm:           debug:Debug level (int)
+"""
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def kernel_modules(monkeypatch, tmpdir):
+    proc_modules = os.path.join(tmpdir.strpath, 'modules')
+    _write(proc_modules, 'xfs 1 0 - Live 0x0\nloop 1 0 - Live 0x0\nbridge 1 0 - Live 0x0\n')
+    sys_module = os.path.join(tmpdir.strpath, 'sys_module')
+    _write(os.path.join(sys_module, 'xfs', 'parameters', 'enable'), 'Y\n')
+    _write(os.path.join(sys_module, 'bridge', 'parameters', 'debug'), '0\n')
+    os.makedirs(os.path.join(sys_module, 'loop'))
+    monkeypatch.setattr(systemfacts, 'PROC_MODULES_PATH', proc_modules)
+    monkeypatch.setattr(systemfacts, 'SYS_MODULE_DIR', sys_module)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+
+def _get_modules_summary():
+    return [
+        (module.filename, [(param.name, param.value) for param in module.parameters], module.signature)
+        for module in systemfacts._get_active_kernel_modules(api.current_logger())
+    ]
+
+
+def test_get_active_kernel_modules(monkeypatch, kernel_modules):
+    commands = []
+
+    def mocked_run(cmd, split=False):
+        commands.append(cmd)
+        return {'stdout': MODINFO_OUTPUT.splitlines()}
+
+    monkeypatch.setattr(systemfacts, 'run', mocked_run)
+
+    assert _get_modules_summary() == [
+        ('xfs', [('enable', 'Y')], '30:2E:ABCD:EF'),
+        ('loop', [], None),
+        ('bridge', [('debug', '0')], None),
+    ]
+    assert commands == [['modinfo', 'xfs', 'bridge']]
+
+
+def test_get_active_kernel_modules_modinfo_fallback(monkeypatch, kernel_modules):
+    def mocked_run(cmd, split=False):
+        if cmd[1] != '-F':
+            raise CalledProcessError('modinfo: ERROR: Module bridge not found.', cmd, {'exit_code': 1})
+        return {'stdout': '30:2E:AB\n\t\tCD:EF\n' if cmd[-1] == 'xfs' else ''}
+
+    monkeypatch.setattr(systemfacts, 'run', mocked_run)
+
+    assert _get_modules_summary() == [
+        ('xfs', [('enable', 'Y')], '30:2E:ABCD:EF'),
+        ('loop', [], None),
+        ('bridge', [('debug', '0')], None),
+    ]
+
+
+def test_get_sysctls(monkeypatch, tmpdir):
+    proc_sys = tmpdir.mkdir('sys').strpath
+    _write(os.path.join(proc_sys, 'kernel', 'hostname'), 'localhost\n')
+    _write(os.path.join(proc_sys, 'kernel', 'random', 'uuid'), 'unstable\n')
+    _write(os.path.join(proc_sys, 'kernel', 'sched_domain', 'cpu0', 'name'), 'unstable\n')
+    _write(os.path.join(proc_sys, 'net', 'ipv4', 'tcp_rmem'), '4096\t131072\t6291456\n')
+    _write(os.path.join(proc_sys, 'net', 'ipv4', 'conf', 'eth0.100', 'forwarding'), '1\n')
+    _write(os.path.join(proc_sys, 'net', 'ipv4', 'neigh', 'eth0', 'retrans_time'), '100\n')
+    _write(os.path.join(proc_sys, 'net', 'ipv4', 'route', 'flush'), '')
+    os.chmod(os.path.join(proc_sys, 'net', 'ipv4', 'route', 'flush'), 0o200)
+    _write(os.path.join(proc_sys, 'fs', 'binfmt_misc', 'python'), 'enabled\ninterpreter /usr/bin/python\n')
+    _write(os.path.join(proc_sys, 'vm', 'stat_refresh'), '')
+    monkeypatch.setattr(systemfacts, 'PROC_SYS_DIR', proc_sys)
+
+    assert [(var.name, var.value) for var in systemfacts._get_sysctls()] == [
+        ('fs.binfmt_misc.python', 'enabled'),
+        ('fs.binfmt_misc.python', 'interpreter /usr/bin/python'),
+        ('kernel.hostname', 'localhost'),
+        ('net.ipv4.conf.eth0/100.forwarding', '1'),
+        ('net.ipv4.tcp_rmem', '4096\t131072\t6291456'),
+    ]
+
+
+def _collector(result, delay=0, error=None):
+    def collect():
+        time.sleep(delay)
+        if error:
+            raise error
+        return result
+    return collect
+
+
+def test_produce_facts_order(monkeypatch):
+    produced = []
+    collectors = [
+        ('slow', _collector('first', delay=0.2)),
+        ('none', _collector(None)),
+        ('fast', _collector('second')),
+    ]
+    monkeypatch.setattr(systemfacts, '_get_collectors', lambda logger: collectors)
+    monkeypatch.setattr(api, 'produce', produced.append)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    systemfacts.produce_facts(api.current_logger())
+
+    assert produced == ['first', 'second']
+    assert len(api.current_logger().dbgmsg) == 3
+
+
+def test_produce_facts_failure(monkeypatch):
+    produced = []
+    collectors = [
+        ('ok', _collector('first')),
+        ('failing', _collector(None, delay=0.1, error=StopActorExecutionError('first error'))),
+        ('failing too', _collector(None, error=ValueError('second error'))),
+        ('slow', _collector('second', delay=0.2)),
+    ]
+    monkeypatch.setattr(systemfacts, '_get_collectors', lambda logger: collectors)
+    monkeypatch.setattr(api, 'produce', produced.append)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    with pytest.raises(StopActorExecutionError) as err:
+        systemfacts.produce_facts(api.current_logger())
+
+    assert str(err.value) == 'first error'
+    assert produced == ['first', 'second']
+    assert len(api.current_logger().errmsg) == 2
+
+
+def test_produce_facts_timeout(monkeypatch):
+    produced = []
+    collectors = [
+        ('hanging', _collector('late', delay=1)),
+        ('ok', _collector('first')),
+    ]
+    monkeypatch.setattr(systemfacts, '_get_collectors', lambda logger: collectors)
+    monkeypatch.setattr(systemfacts, 'COLLECTORS_TIMEOUT', 0.1)
+    monkeypatch.setattr(api, 'produce', produced.append)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    with pytest.raises(StopActorExecutionError):
+        systemfacts.produce_facts(api.current_logger())
+
+    assert produced == ['first']
@@ -0,0 +1,21 @@
+from leapp.actors import Actor
+from leapp.libraries.actor import targetedselinuxrelabeling
+from leapp.reporting import Report
+from leapp.tags import FirstBootPhaseTag, IPUWorkflowTag
+
+
+class TargetedSeLinuxRelabeling(Actor):
+    """
+    Relabel files changed by the upgrade when the targeted SELinux relabeling has been scheduled.
+
+    The relabeling of the whole system is scheduled for the next boot in case
+    the targeted relabeling fails.
+    """
+
+    name = 'targeted_se_linux_relabelling'
+    consumes = ()
+    produces = (Report,)
+    tags = (FirstBootPhaseTag, IPUWorkflowTag)
+
+    def process(self):
+        targetedselinuxrelabeling.process()
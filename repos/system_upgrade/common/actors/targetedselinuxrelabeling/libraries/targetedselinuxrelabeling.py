@@ -0,0 +1,67 @@
+import os
+
+from leapp import reporting
+from leapp.libraries.common import selinuxrelabel
+from leapp.libraries.stdlib import api, CalledProcessError, run
+
+COMMON_REPORT_TAGS = [reporting.Groups.SELINUX]
+
+
+def _relabel():
+    run(['restorecon', '-i', '-f', selinuxrelabel.RELABEL_PATHS_PATH])
+    recursive_paths = [path for path in selinuxrelabel.RECURSIVE_PATHS if os.path.exists(path)]
+    if recursive_paths:
+        run(['restorecon', '-R', '-i'] + recursive_paths)
+
+
+def _schedule_full_relabel(error):
+    try:
+        with open('/.autorelabel', 'w'):
+            pass
+    except EnvironmentError as e:
+        api.current_logger().critical('Could not schedule SElinux for relabelling: %s.' % e)
+        reporting.create_report([
+            reporting.Title('Files changed by the upgrade could not be relabeled'),
+            reporting.Summary(
+                'The targeted SELinux relabeling failed: {}. The relabeling of the whole system could not be'
+                ' scheduled either: {}.'.format(error, e)
+            ),
+            reporting.Severity(reporting.Severity.HIGH),
+            reporting.Groups(COMMON_REPORT_TAGS),
+            reporting.Remediation(hint='Please set autorelabelling manually and reboot the system.'),
+            reporting.Groups([reporting.Groups.FAILURE]),
+            reporting.RelatedResource('file', '/.autorelabel'),
+        ])
+        return
+    reporting.create_report([
+        reporting.Title('Files changed by the upgrade could not be relabeled'),
+        reporting.Summary(
+            'The targeted SELinux relabeling failed: {}. The relabeling of the whole system is scheduled'
+            ' for the next boot instead.'.format(error)
+        ),
+        reporting.Severity(reporting.Severity.HIGH),
+        reporting.Groups(COMMON_REPORT_TAGS),
+        reporting.Remediation(hint='Please reboot the system to relabel it.'),
+        reporting.RelatedResource('file', '/.autorelabel'),
+    ])
+
+
+def process():
+    if not os.path.exists(selinuxrelabel.RELABEL_PATHS_PATH):
+        return
+    try:
+        _relabel()
+    except (CalledProcessError, OSError) as e:
+        api.current_logger().error('The targeted SELinux relabeling failed: {}'.format(str(e)))
+        _schedule_full_relabel(str(e))
+    else:
+        reporting.create_report([
+            reporting.Title('Files changed by the upgrade relabeled'),
+            reporting.Summary('SELinux labels of files changed by the upgrade have been restored.'),
+            reporting.Groups(COMMON_REPORT_TAGS),
+        ])
+    finally:
+        try:
+            os.unlink(selinuxrelabel.RELABEL_PATHS_PATH)
+        except OSError as e:
+            api.current_logger().warning('Failed removing {}: {}'.format(selinuxrelabel.RELABEL_PATHS_PATH, str(e)))
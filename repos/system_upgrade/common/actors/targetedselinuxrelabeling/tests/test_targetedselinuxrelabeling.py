@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from leapp import reporting
+from leapp.libraries.actor import targetedselinuxrelabeling
+from leapp.libraries.common import selinuxrelabel
+from leapp.libraries.common.testutils import create_report_mocked, logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
+
+
+class MockedRun(object):
+    def __init__(self, fail=False):
+        self.commands = []
+        self.fail = fail
+
+    def __call__(self, cmd, *args, **kwargs):
+        self.commands.append(cmd)
+        if self.fail:
+            raise CalledProcessError(message='failed', command=cmd, result={'exit_code': 1, 'stderr': 'failed'})
+        return {'exit_code': 0}
+
+
+@pytest.fixture
+def relabel_paths(monkeypatch, tmpdir):
+    monkeypatch.setattr(reporting, 'create_report', create_report_mocked())
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(selinuxrelabel, 'RELABEL_PATHS_PATH', os.path.join(tmpdir.strpath, 'relabel'))
+    monkeypatch.setattr(selinuxrelabel, 'RECURSIVE_PATHS', (tmpdir.strpath, os.path.join(tmpdir.strpath, 'missing')))
+    return tmpdir.join('relabel')
+
+
+def test_not_scheduled(monkeypatch, relabel_paths):
+    run_mocked = MockedRun()
+    monkeypatch.setattr(targetedselinuxrelabeling, 'run', run_mocked)
+    targetedselinuxrelabeling.process()
+    assert not run_mocked.commands
+    assert not reporting.create_report.called
+
+
+def test_relabel(monkeypatch, relabel_paths):
+    relabel_paths.write('/usr\n/usr/bin\n/usr/bin/bash\n')
+    run_mocked = MockedRun()
+    monkeypatch.setattr(targetedselinuxrelabeling, 'run', run_mocked)
+    targetedselinuxrelabeling.process()
+    assert run_mocked.commands == [
+        ['restorecon', '-i', '-f', relabel_paths.strpath],
+        ['restorecon', '-R', '-i', relabel_paths.dirname],
+    ]
+    assert reporting.create_report.called == 1
+    assert not relabel_paths.exists()
+
+
+def test_relabel_failed(monkeypatch, relabel_paths):
+    relabel_paths.write('/usr\n')
+    monkeypatch.setattr(targetedselinuxrelabeling, 'run', MockedRun(fail=True))
+    full_relabel = []
+    monkeypatch.setattr(targetedselinuxrelabeling, '_schedule_full_relabel', full_relabel.append)
+    targetedselinuxrelabeling.process()
+    assert full_relabel
+    assert api.current_logger.errmsg
+    assert not relabel_paths.exists()
@@ -0,0 +1,307 @@
+"""
+In-process copy of files preserving their metadata.
+
+Replaces the execution of `cp -a` for each copied file. The content of files
+is cloned (reflink) when the filesystem supports it, copied by
+copy_file_range(2) when available or read & written otherwise. Mode,
+ownership, timestamps and extended attributes (including SELinux labels) are
+preserved, similar to `cp -a`. As with `cp -a`, failures to preserve extended
+attributes are ignored.
+
+Files that are not regular files, directories or symlinks (e.g. sockets,
+device files) are still copied by `cp -a`.
+"""
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import multiprocessing
+import os
+import stat
+from multiprocessing.pool import ThreadPool
+
+from leapp.libraries.stdlib import run
+
+FICLONE = 0x40049409
+"""ioctl(2) request to clone (reflink) the content of a file."""
+
+_MAX_COPY_WORKERS = 8
+"""Upper limit of threads copying files in parallel."""
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+_XATTR_BUFFER_SIZE = 64 * 1024
+
+_NOT_SUPPORTED_ERRNOS = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF)
+
+_LIBC = []
+
+
+def _get_libc():
+    if not _LIBC:
+        libc = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.llistxattr.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t)
+            libc.llistxattr.restype = ctypes.c_ssize_t
+            libc.lgetxattr.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_size_t)
+            libc.lgetxattr.restype = ctypes.c_ssize_t
+            libc.lsetxattr.argtypes = (
+                ctypes.c_char_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int
+            )
+        except (OSError, AttributeError):
+            libc = None
+        _LIBC.append(libc)
+    return _LIBC[0]
+
+
+def _encode(value):
+    return value.encode('utf-8') if not isinstance(value, bytes) else value
+
+
+def _list_xattrs(path):
+    if hasattr(os, 'listxattr'):
+        return os.listxattr(path, follow_symlinks=False)
+    # Python 2 does not provide the xattr API
+    libc = _get_libc()
+    if not libc:
+        return []
+    buf = ctypes.create_string_buffer(_XATTR_BUFFER_SIZE)
+    size = libc.llistxattr(_encode(path), buf, _XATTR_BUFFER_SIZE)
+    if size < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+    return [name for name in buf.raw[:size].split(b'\0') if name]
+
+
+def _get_xattr(path, name):
+    if hasattr(os, 'getxattr'):
+        return os.getxattr(path, name, follow_symlinks=False)
+    libc = _get_libc()
+    buf = ctypes.create_string_buffer(_XATTR_BUFFER_SIZE)
+    size = libc.lgetxattr(_encode(path), _encode(name), buf, _XATTR_BUFFER_SIZE)
+    if size < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+    return buf.raw[:size]
+
+
+def _set_xattr(path, name, value):
+    if hasattr(os, 'setxattr'):
+        os.setxattr(path, name, value, follow_symlinks=False)
+        return
+    libc = _get_libc()
+    if libc.lsetxattr(_encode(path), _encode(name), value, len(value), 0) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+
+def _copy_xattrs(src, dst):
+    """
+    Copy extended attributes (including the SELinux label) of src to dst, ignoring failures.
+    """
+    try:
+        names = _list_xattrs(src)
+    except OSError:
+        return
+    for name in names:
+        try:
+            _set_xattr(dst, name, _get_xattr(src, name))
+        except OSError:
+            # e.g. not supported by the destination filesystem; ignored as by `cp -a`
+            pass
+
+
+def _copy_content(src_fd, dst_fd, size):
+    """
+    Copy the content of the src file to the dst file, using the fastest available method.
+    """
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return
+    except (IOError, OSError) as e:
+        if e.errno not in _NOT_SUPPORTED_ERRNOS:
+            raise
+    if hasattr(os, 'copy_file_range'):
+        try:
+            copied = 0
+            while copied < size:
+                count = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if not count:
+                    break
+                copied += count
+            # the file could grow in the meantime; copy the rest below
+            if copied >= size:
+                return
+        except OSError as e:
+            if e.errno not in _NOT_SUPPORTED_ERRNOS:
+                raise
+            os.lseek(src_fd, 0, os.SEEK_SET)
+            os.lseek(dst_fd, 0, os.SEEK_SET)
+            os.ftruncate(dst_fd, 0)
+    while True:
+        chunk = os.read(src_fd, _COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        while chunk:
+            written = os.write(dst_fd, chunk)
+            chunk = chunk[written:]
+
+
+def _copy_metadata(src, dst, src_stat):
+    """
+    Copy ownership, mode and timestamps of src to dst. dst must not be a symlink.
+    """
+    os.chown(dst, src_stat.st_uid, src_stat.st_gid)
+    # set the mode after the ownership, as chown resets the setuid/setgid bits
+    os.chmod(dst, stat.S_IMODE(src_stat.st_mode))
+    _copy_xattrs(src, dst)
+    os.utime(dst, (src_stat.st_atime, src_stat.st_mtime))
+
+
+def copy_file(src, dst):
+    """
+    Copy the regular file src to dst similar to `cp -a`.
+
+    Symlinks are copied as symlinks. Other kinds of files (except directories)
+    are copied by `cp -a`.
+
+    :param src: Path to the source file.
+    :type src: str
+    :param dst: Path to the destination file. Overwritten if it exists.
+    :type dst: str
+    """
+    src_stat = os.lstat(src)
+    if stat.S_ISLNK(src_stat.st_mode):
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        os.symlink(os.readlink(src), dst)
+        os.lchown(dst, src_stat.st_uid, src_stat.st_gid)
+        _copy_xattrs(src, dst)
+        return
+    if not stat.S_ISREG(src_stat.st_mode):
+        run(['cp', '-a', src, dst])
+        return
+    if os.path.islink(dst):
+        os.unlink(dst)
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        # create the file with restrictive permissions until the metadata are copied
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            _copy_content(src_fd, dst_fd, src_stat.st_size)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    _copy_metadata(src, dst, src_stat)
+
+
+def mkdir_with_copied_mode(path, mode_from):
+    """
+    Create the directory (including parents) and set the mode of the mode_from file on it.
+
+    The mode of mode_from is taken from the file the path points to (following
+    symlinks). Parent directories are created with default permissions.
+
+    :raises OSError: If the directory cannot be created or mode_from does not exist.
+    """
+    mode = stat.S_IMODE(os.stat(mode_from).st_mode)
+    parent = os.path.dirname(path.rstrip('/'))
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    if not os.path.isdir(path):
+        # create with maximally restrictive permissions
+        os.mkdir(path, 0)
+    os.chmod(path, mode)
+
+
+def copy_tree(src, dst):
+    """
+    Copy the directory tree src to dst similar to `cp -a` (symlinks are kept).
+
+    :param src: Path to the source directory.
+    :type src: str
+    :param dst: Path to the destination directory; must not exist.
+    :type dst: str
+    """
+    src_stat = os.stat(src)
+    os.mkdir(dst, 0o700)
+    for name in sorted(os.listdir(src)):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            copy_tree(src_path, dst_path)
+        else:
+            copy_file(src_path, dst_path)
+    _copy_metadata(src, dst, src_stat)
+
+
+def copy_any(src, dst):
+    """
+    Copy src (a file or a directory) to dst similar to `cp -a`.
+    """
+    if os.path.isdir(src) and not os.path.islink(src):
+        copy_tree(src, dst)
+    else:
+        copy_file(src, dst)
+
+
+def _get_workers():
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    return max(1, min(cpus, _MAX_COPY_WORKERS))
+
+
+class CopyPool(object):
+    """
+    Copy files in parallel.
+
+    Files are copied in threads as the copy is bounded by I/O and syscalls
+    that release the GIL. Errors are raised when the pool is finished, the
+    first submitted failed copy is raised.
+
+    Usage::
+
+        with CopyPool() as pool:
+            pool.copy(src, dst)
+    """
+
+    def __init__(self, workers=None):
+        self._workers = workers or _get_workers()
+        self._pool = None
+        self._results = []
+
+    def copy(self, src, dst):
+        if self._workers == 1:
+            copy_any(src, dst)
+            return
+        if not self._pool:
+            self._pool = ThreadPool(self._workers)
+        self._results.append(self._pool.apply_async(copy_any, (src, dst)))
+
+    def wait(self):
+        """
+        Wait until all submitted copies are finished. Raise the first error if any.
+        """
+        if not self._pool:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+        results, self._results = self._results, []
+        for result in results:
+            result.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.wait()
+        elif self._pool:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
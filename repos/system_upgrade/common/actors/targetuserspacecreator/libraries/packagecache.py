@@ -0,0 +1,232 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from leapp.libraries.common.config import get_env
+from leapp.libraries.stdlib import api
+
+PERSISTENT_PACKAGE_CACHE_DIR = '/var/lib/leapp/persistent_package_cache'
+
+INDEX_FILE = 'index.json'
+"""
+Name of the file describing cached packages.
+
+The index maps the path of each package relative to the DNF cache directory
+(e.g. baseos-0123456789abcdef/packages/bash-5.1.8-6.el9.x86_64.rpm) to:
+  * sha256 - checksum of the package, verified before the package is reused
+  * size - size of the package in bytes
+  * last_used - timestamp of the last store or reuse of the package
+"""
+
+DEFAULT_CACHE_SIZE = 4096
+"""
+Default size limit (in MiB) of the persistent package cache.
+
+Can be changed by the LEAPP_PERSISTENT_PACKAGE_CACHE_SIZE envar.
+"""
+
+
+def is_cache_enabled():
+    """
+    Return True if the persistent package cache should be used
+
+    The cache is enabled by (envar) `LEAPP_PERSISTENT_PACKAGE_CACHE=1`.
+    The `LEAPP_DEVEL_USE_PERSISTENT_PACKAGE_CACHE=1` envar is still respected.
+    """
+    return (
+        get_env('LEAPP_PERSISTENT_PACKAGE_CACHE', '0') == '1'
+        or get_env('LEAPP_DEVEL_USE_PERSISTENT_PACKAGE_CACHE', '0') == '1'
+    )
+
+
+def _get_cache_size_limit():
+    value = get_env('LEAPP_PERSISTENT_PACKAGE_CACHE_SIZE', None)
+    if value is None:
+        return DEFAULT_CACHE_SIZE
+    try:
+        limit = int(value)
+        if limit < 0:
+            raise ValueError('negative value')
+    except ValueError:
+        api.current_logger().warning(
+            'Invalid value of LEAPP_PERSISTENT_PACKAGE_CACHE_SIZE: {}. Using the default: {} MiB'
+            .format(value, DEFAULT_CACHE_SIZE)
+        )
+        return DEFAULT_CACHE_SIZE
+    return limit
+
+
+def _sha256(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """
+    Hardlink src to dst; copy it in case hardlinks cannot be used (e.g. another filesystem).
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dst)
+
+
+def _is_same_file(path1, path2):
+    try:
+        stat1 = os.stat(path1)
+        stat2 = os.stat(path2)
+    except OSError:
+        return False
+    return (stat1.st_dev, stat1.st_ino) == (stat2.st_dev, stat2.st_ino)
+
+
+def _load_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+
+
+def _store_index(cache_dir, index):
+    with open(os.path.join(cache_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f, sort_keys=True, indent=2)
+
+
+def _remove_entry(cache_dir, index, relpath):
+    index.pop(relpath, None)
+    try:
+        os.unlink(os.path.join(cache_dir, relpath))
+    except OSError:
+        pass
+
+
+def _get_cached_packages(dnf_cache_dir):
+    """
+    Return paths of packages in the DNF cache, relative to the DNF cache directory.
+    """
+    packages = []
+    if not os.path.isdir(dnf_cache_dir):
+        return packages
+    for repo_dir in sorted(os.listdir(dnf_cache_dir)):
+        packages_dir = os.path.join(dnf_cache_dir, repo_dir, 'packages')
+        if not os.path.isdir(packages_dir):
+            continue
+        for fname in sorted(os.listdir(packages_dir)):
+            if fname.endswith('.rpm') and os.path.isfile(os.path.join(packages_dir, fname)):
+                packages.append(os.path.join(repo_dir, 'packages', fname))
+    return packages
+
+
+def _evict(cache_dir, index, limit):
+    """
+    Remove the least recently used packages until the cache fits into the limit (in MiB).
+    """
+    total = sum(entry['size'] for entry in index.values())
+    for relpath in sorted(index, key=lambda path: index[path]['last_used']):
+        if total <= limit * 1024 * 1024:
+            break
+        total -= index[relpath]['size']
+        api.current_logger().debug('Evicting the package from the persistent cache: {}'.format(relpath))
+        _remove_entry(cache_dir, index, relpath)
+
+
+def remove_cache(cache_dir=PERSISTENT_PACKAGE_CACHE_DIR):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def store_packages(dnf_cache_dir, cache_dir=PERSISTENT_PACKAGE_CACHE_DIR):
+    """
+    Store packages downloaded into the DNF cache to the persistent cache.
+
+    Packages are hardlinked into the cache, so it is cheap to store them before
+    they are removed from the DNF cache. Packages already present in the cache are just
+    marked as used. The least recently used packages are evicted when the size
+    of the cache exceeds the limit.
+
+    :param dnf_cache_dir: Path to the DNF cache used for the target userspace container.
+    :type dnf_cache_dir: str
+    :param cache_dir: Path to the persistent package cache.
+    :type cache_dir: str
+    """
+    index = _load_index(cache_dir)
+    if index is None:
+        # missing, broken or created in the old format (the whole DNF cache)
+        remove_cache(cache_dir)
+        index = {}
+        os.makedirs(cache_dir)
+    now = time.time()
+    stored = 0
+    for relpath in _get_cached_packages(dnf_cache_dir):
+        src = os.path.join(dnf_cache_dir, relpath)
+        dst = os.path.join(cache_dir, relpath)
+        if relpath in index and _is_same_file(src, dst):
+            index[relpath]['last_used'] = now
+            continue
+        try:
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            _link_or_copy(src, dst)
+            index[relpath] = {'sha256': _sha256(dst), 'size': os.path.getsize(dst), 'last_used': now}
+            stored += 1
+        except (OSError, IOError) as e:
+            api.current_logger().warning('Cannot store {} into the persistent package cache: {}'.format(src, str(e)))
+            _remove_entry(cache_dir, index, relpath)
+    _evict(cache_dir, index, _get_cache_size_limit())
+    _store_index(cache_dir, index)
+    api.current_logger().debug(
+        'Stored {} new packages into the persistent package cache ({} packages in total).'
+        .format(stored, len(index))
+    )
+
+
+def restore_packages(dnf_cache_dir, cache_dir=PERSISTENT_PACKAGE_CACHE_DIR):
+    """
+    Hardlink packages from the persistent cache into the DNF cache used for the target userspace container.
+
+    The checksum of each package is verified first. Packages that do not match
+    their checksum are removed from the cache. DNF verifies packages against
+    repositories metadata in addition, so packages not matching the metadata
+    anymore are downloaded again.
+
+    :param dnf_cache_dir: Path to the DNF cache used for the target userspace container.
+    :type dnf_cache_dir: str
+    :param cache_dir: Path to the persistent package cache.
+    :type cache_dir: str
+    """
+    index = _load_index(cache_dir)
+    if not index:
+        return
+    now = time.time()
+    restored = 0
+    for relpath in sorted(index):
+        src = os.path.join(cache_dir, relpath)
+        try:
+            if _sha256(src) != index[relpath]['sha256']:
+                api.current_logger().warning(
+                    'The cached package {} does not match its checksum. Removing it from the cache.'.format(relpath)
+                )
+                _remove_entry(cache_dir, index, relpath)
+                continue
+            dst = os.path.join(dnf_cache_dir, relpath)
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            _link_or_copy(src, dst)
+        except (OSError, IOError) as e:
+            api.current_logger().warning('Cannot reuse the cached package {}: {}'.format(relpath, str(e)))
+            _remove_entry(cache_dir, index, relpath)
+            continue
+        index[relpath]['last_used'] = now
+        restored += 1
+    _store_index(cache_dir, index)
+    api.current_logger().info('Reused {} packages from the persistent package cache.'.format(restored))
@@ -1,12 +1,22 @@
+import contextlib
 import itertools
 import os
 import re
-import shutil
 
 from leapp import reporting
 from leapp.exceptions import StopActorExecution, StopActorExecutionError
-from leapp.libraries.actor import constants
-from leapp.libraries.common import dnfplugin, mounting, overlaygen, repofileutils, rhsm, utils
+from leapp.libraries.actor import constants, copyengine, packagecache
+from leapp.libraries.common import (
+    dnfplugin,
+    metadatacache,
+    mounting,
+    overlaygen,
+    repofileutils,
+    rhsm,
+    spaceplanner,
+    userspacecache,
+    utils
+)
 from leapp.libraries.common.config import get_env, get_product_type
 from leapp.libraries.common.config.version import get_target_major_version
 from leapp.libraries.common.gpg import get_path_to_gpg_certs, is_nogpgcheck_set
@@ -55,7 +65,6 @@ from leapp.utils.deprecation import suppress_deprecation
 # Issue: #486
 
 PROD_CERTS_FOLDER = 'prod-certs'
-PERSISTENT_PACKAGE_CACHE_DIR = '/var/lib/leapp/persistent_package_cache'
 DEDICATED_LEAPP_PART_URL = 'https://access.redhat.com/solutions/7011704'
 
 
@@ -126,25 +135,17 @@ class _InputData(object):
             raise StopActorExecutionError('No storage info available cannot proceed.')
 
 
-def _restore_persistent_package_cache(userspace_dir):
-    if get_env('LEAPP_DEVEL_USE_PERSISTENT_PACKAGE_CACHE', None) == '1':
-        if not os.path.exists(PERSISTENT_PACKAGE_CACHE_DIR):
-            return
-        dst_cache = os.path.join(userspace_dir, 'var', 'cache', 'dnf')
-        if os.path.exists(dst_cache):
-            run(['rm', '-rf', dst_cache])
-        shutil.move(PERSISTENT_PACKAGE_CACHE_DIR, dst_cache)
-    # We always want to remove the persistent cache here to unclutter the system
-    run(['rm', '-rf', PERSISTENT_PACKAGE_CACHE_DIR])
+def _restore_persistent_package_cache():
+    if packagecache.is_cache_enabled():
+        packagecache.restore_packages(metadatacache.METADATA_CACHE_DIR)
+        return
+    # We want to remove the persistent cache when it is not used to unclutter the system
+    packagecache.remove_cache()
 
 
-def _backup_to_persistent_package_cache(userspace_dir):
-    if get_env('LEAPP_DEVEL_USE_PERSISTENT_PACKAGE_CACHE', None) == '1':
-        # Clean up any dead bodies, just in case
-        run(['rm', '-rf', PERSISTENT_PACKAGE_CACHE_DIR])
-        src_cache = os.path.join(userspace_dir, 'var', 'cache', 'dnf')
-        if os.path.exists(src_cache):
-            shutil.move(src_cache, PERSISTENT_PACKAGE_CACHE_DIR)
+def _backup_to_persistent_package_cache():
+    if packagecache.is_cache_enabled():
+        packagecache.store_packages(metadatacache.METADATA_CACHE_DIR)
 
 
 def _import_gpg_keys(context, install_root_dir, target_major_version):
@@ -152,9 +153,10 @@ def _import_gpg_keys(context, install_root_dir, target_major_version):
     # Import the RHEL X+1 GPG key to be able to verify the installation of initial packages
     try:
         # Import also any other keys provided by the customer in the same directory
-        for certname in os.listdir(certs_path):
-            cmd = ['rpm', '--root', install_root_dir, '--import', os.path.join(certs_path, certname)]
-            context.call(cmd, callback_raw=utils.logging_handler)
+        with context.session():
+            for certname in os.listdir(certs_path):
+                cmd = ['rpm', '--root', install_root_dir, '--import', os.path.join(certs_path, certname)]
+                context.call(cmd, callback_raw=utils.logging_handler)
     except CalledProcessError as exc:
         raise StopActorExecutionError(
             message=(
@@ -212,19 +214,124 @@ def _handle_transaction_err_msg_size(err):
     raise StopActorExecutionError(message=message, details=details)
 
 
+@contextlib.contextmanager
+def _mount_target_userspace(context, userspace_dir, install_root_dir):
+    """
+    Mount the target userspace container as the installroot inside the given context.
+
+    The shared DNF cache (see the metadatacache library) is mounted into
+    the installroot as well, so DNF stores metadata of target repositories
+    and downloaded packages there.
+    """
+    installroot = os.path.join(context.base_dir, install_root_dir.lstrip('/'))
+    with mounting.BindMount(source=userspace_dir, target=installroot):
+        with metadatacache.bind_mount(installroot):
+            yield
+
+
+@contextlib.contextmanager
+def _mount_empty_installroot(context, install_root_dir):
+    """
+    Mount an empty installroot with the shared DNF cache inside the given context.
+
+    DNF reads the configuration, repository files and variables from
+    the installroot when they are present there. In the empty installroot,
+    DNF uses the current ones of the context instead, the same way as during
+    the creation of a new target userspace container.
+    """
+    installroot = os.path.join(context.base_dir, install_root_dir.lstrip('/'))
+    with mounting.TypedMount(fstype='tmpfs', source='tmpfs', target=installroot):
+        with metadatacache.bind_mount(installroot):
+            yield
+
+
+def _refresh_metadata(context, install_root_dir, enabled_repos):
+    """
+    Refresh metadata of target repositories and pin them for the current leapp execution.
+
+    The installroot is expected to be empty (see `_mount_empty_installroot`),
+    so the metadata are refreshed for the current configuration of repositories
+    and not for the one stored in a target userspace container created previously.
+
+    This is the only refresh of the metadata during the leapp execution. All
+    following DNF executions (including the DNF transaction stages) use the
+    pinned metadata, so all of them work with the same snapshot of target
+    repositories and none of them downloads the metadata again.
+
+    Return False if the metadata cannot be refreshed.
+    """
+    metadatacache.unpin_metadata()
+    repos_opt = [['--enablerepo', repo] for repo in enabled_repos]
+    repos_opt = list(itertools.chain(*repos_opt))
+    cmd = [
+        'dnf', 'makecache', '--refresh',
+        '--setopt=module_platform_id=platform:el{}'.format(get_target_major_version()),
+        '--releasever', api.current_actor().configuration.version.target,
+        '--installroot', install_root_dir,
+        '--disablerepo', '*'
+        ] + repos_opt
+    if rhsm.skip_rhsm():
+        cmd += ['--disableplugin', 'subscription-manager']
+    try:
+        context.call(cmd, callback_raw=utils.logging_handler)
+    except CalledProcessError as exc:
+        api.current_logger().debug('Cannot refresh metadata of target repositories: {}'.format(str(exc)))
+        return False
+    metadatacache.pin_metadata(enabled_repos)
+    return True
+
+
+def _reuse_target_userspace(userspace_dir, enabled_repos, cache_key, metadata_refreshed):
+    """
+    Return True if the existing target userspace container can be reused.
+
+    The container is reused when it has been created for the same target
+    system, packages and repositories, and metadata of the repositories
+    (refreshed by `_refresh_metadata` just before) did not change since then.
+    """
+    if not os.path.isdir(userspace_dir) or not userspacecache.is_cache_key_matching(userspace_dir, cache_key):
+        return False
+    if not metadata_refreshed:
+        userspacecache.invalidate_cache(userspace_dir, 'cannot refresh metadata of repositories')
+        return False
+    metadata_digest = userspacecache.get_metadata_digest(metadatacache.METADATA_CACHE_DIR, enabled_repos)
+    if not userspacecache.is_metadata_matching(userspace_dir, metadata_digest):
+        return False
+    # the space plan of the previous execution is not valid anymore
+    spaceplanner.remove_space_plan(userspace_dir)
+    api.current_logger().info('Reusing the target userspace container created previously: {}'.format(userspace_dir))
+    return True
+
+
 def prepare_target_userspace(context, userspace_dir, enabled_repos, packages):
     """
     Implement the creation of the target userspace.
+
+    Metadata of target repositories are refreshed in the shared DNF cache
+    first (see `_refresh_metadata`). The container created by a previous leapp
+    execution is reused when possible. See `_reuse_target_userspace` and
+    the userspacecache library for more details. Mutable parts of the container
+    (certificates, repository files, rhsm configuration, ...) are refreshed
+    afterwards in any case.
     """
-    _backup_to_persistent_package_cache(userspace_dir)
+    target_major_version = get_target_major_version()
+    install_root_dir = '/el{}target'.format(target_major_version)
+    cache_key = userspacecache.get_cache_key(enabled_repos, packages)
+    _create_target_userspace_directories(userspace_dir)
+    with _mount_empty_installroot(context, install_root_dir):
+        metadata_refreshed = _refresh_metadata(context, install_root_dir, enabled_repos)
+    if _reuse_target_userspace(userspace_dir, enabled_repos, cache_key, metadata_refreshed):
+        return
+
+    _backup_to_persistent_package_cache()
+    # downloaded packages belong to the removed container
+    metadatacache.remove_packages()
 
     run(['rm', '-rf', userspace_dir])
     _create_target_userspace_directories(userspace_dir)
 
-    target_major_version = get_target_major_version()
-    install_root_dir = '/el{}target'.format(target_major_version)
-    with mounting.BindMount(source=userspace_dir, target=os.path.join(context.base_dir, install_root_dir.lstrip('/'))):
-        _restore_persistent_package_cache(userspace_dir)
+    with _mount_target_userspace(context, userspace_dir, install_root_dir):
+        _restore_persistent_package_cache()
         if not is_nogpgcheck_set():
             _import_gpg_keys(context, install_root_dir, target_major_version)
 
@@ -239,13 +346,15 @@ def prepare_target_userspace(context, userspace_dir, enabled_repos, packages):
             '--releasever', api.current_actor().configuration.version.target,
             '--installroot', install_root_dir,
             '--disablerepo', '*'
-            ] + repos_opt + packages
+            ] + repos_opt + metadatacache.get_pinning_setopts(enabled_repos) + packages
         if config.is_verbose():
             cmd.append('-v')
         if rhsm.skip_rhsm():
             cmd += ['--disableplugin', 'subscription-manager']
         try:
-            context.call(cmd, callback_raw=utils.logging_handler)
+            # the source overlay is mounted from the scratch directory
+            with overlaygen.track_container_size(userspace_dir, excluded_dirs=[constants.SCRATCH_DIR]):
+                context.call(cmd, callback_raw=utils.logging_handler)
         except CalledProcessError as exc:
             message = 'Unable to install RHEL {} userspace packages.'.format(target_major_version)
             details = {'details': str(exc), 'stderr': exc.stderr}
@@ -281,6 +390,8 @@ def prepare_target_userspace(context, userspace_dir, enabled_repos, packages):
                         )
 
             raise StopActorExecutionError(message=message, details=details)
+        metadata_digest = userspacecache.get_metadata_digest(metadatacache.METADATA_CACHE_DIR, enabled_repos)
+        userspacecache.store_cache_record(userspace_dir, cache_key, metadata_digest)
 
 
 def _query_rpm_for_pkg_files(context, pkgs):
@@ -317,17 +428,18 @@ def _get_files_owned_by_rpms(context, dirpath, pkgs=None, recursive=False):
     else:
         file_list = os.listdir(searchdir)
 
-    for fname in file_list:
-        try:
-            result = context.call(['rpm', '-qf', os.path.join(dirpath, fname)])
-        except CalledProcessError:
-            api.current_logger().debug('SKIP the {} file: not owned by any rpm'.format(fname))
-            continue
-        if pkgs and not [pkg for pkg in pkgs if pkg in result['stdout']]:
-            api.current_logger().debug('SKIP the {} file: not owned by any searched rpm:'.format(fname))
-            continue
-        api.current_logger().debug('Found the file owned by an rpm: {}.'.format(fname))
-        files_owned_by_rpms.append(fname)
+    with context.session():
+        for fname in file_list:
+            try:
+                result = context.call(['rpm', '-qf', os.path.join(dirpath, fname)])
+            except CalledProcessError:
+                api.current_logger().debug('SKIP the {} file: not owned by any rpm'.format(fname))
+                continue
+            if pkgs and not [pkg for pkg in pkgs if pkg in result['stdout']]:
+                api.current_logger().debug('SKIP the {} file: not owned by any searched rpm:'.format(fname))
+                continue
+            api.current_logger().debug('Found the file owned by an rpm: {}.'.format(fname))
+            files_owned_by_rpms.append(fname)
 
     return files_owned_by_rpms
 
@@ -339,13 +451,10 @@ def _mkdir_with_copied_mode(path, mode_from):
     :param path: The directory path to create.
     :param mode_from: A file or directory whose mode we will copy to the
         newly created directory.
-    :raises subprocess.CalledProcessError: mkdir or chmod fails. For instance,
-        the directory already exists, the file to get permissions from does
-        not exist, a parent directory does not exist.
+    :raises OSError: the directory cannot be created or the file to get
+        permissions from does not exist.
     """
-    # Create with maximally restrictive permissions
-    run(['mkdir', '-m', '0', '-p', path])
-    run(['chmod', '--reference={}'.format(mode_from), path])
+    copyengine.mkdir_with_copied_mode(path, mode_from)
 
 
 def _choose_copy_or_link(symlink, srcdir):
@@ -454,7 +563,7 @@ def _choose_copy_or_link(symlink, srcdir):
     return ('copy', pointee_as_abspath)
 
 
-def _copy_symlinks(symlinks_to_process, srcdir):
+def _copy_symlinks(symlinks_to_process, srcdir, pool):
     """
     Copy file contents or create a symlink depending on where the pointee resides.
 
@@ -462,6 +571,8 @@ def _copy_symlinks(symlinks_to_process, srcdir):
         should be an absolute path to the symlink.  target_path is the path to where we
         need to create either a link or a copy.
     :param srcdir: The root directory that every piece of content must be present in.
+    :param pool: The pool copying the file contents.
+    :type pool: copyengine.CopyPool
     :raises ValueError: if the arguments are not correct
     """
     for source_linkpath, target_linkpath in symlinks_to_process:
@@ -473,11 +584,10 @@ def _copy_symlinks(symlinks_to_process, srcdir):
             continue
 
         if action == "copy":
-            # Note: source_path could be a directory, so '-a' or '-r' must be
-            # given to cp.
-            run(['cp', '-a', source_path, target_linkpath])
+            # Note: source_path could be a directory
+            pool.copy(source_path, target_linkpath)
         elif action == 'link':
-            run(["ln", "-s", source_path, target_linkpath])
+            os.symlink(source_path, target_linkpath)
         else:
             # This will not happen unless _copy_or_link() has a bug.
             raise RuntimeError("Programming error: _copy_or_link() returned an unknown action:{}".format(action))
@@ -493,49 +603,58 @@ def _copy_decouple(srcdir, dstdir):
     symlinks. Any symlink (or symlink chains) within the directory will be
     preserved.
 
+    Directories are created in-process in advance, contents of files are
+    copied in parallel by the copy engine (preserving the metadata as
+    `cp -a`). See the copyengine library for more details.
+
     .. warning::
         `dstdir` must already exist.
     """
-    for root, directories, files in os.walk(srcdir):
-        # relative path from srcdir because srcdir is replaced with dstdir for
-        # the copy.
-        relpath = os.path.relpath(root, srcdir)
-
-        # Create all directories with proper permissions for security
-        # reasons (Putting private data into directories that haven't had their
-        # permissions set appropriately may leak the private information.)
-        symlinks_to_process = []
-        for directory in directories:
-            source_dirpath = os.path.join(root, directory)
-            target_dirpath = os.path.join(dstdir, relpath, directory)
-
-            # Defer symlinks until later because we may end up having to copy
-            # the file contents and the directory may not exist yet.
-            if os.path.islink(source_dirpath):
-                symlinks_to_process.append((source_dirpath, target_dirpath))
-                continue
+    with copyengine.CopyPool() as pool:
+        for root, directories, files in os.walk(srcdir):
+            _copy_decouple_dir(srcdir, dstdir, root, directories, files, pool)
+
+
+def _copy_decouple_dir(srcdir, dstdir, root, directories, files, pool):
+    # relative path from srcdir because srcdir is replaced with dstdir for
+    # the copy.
+    relpath = os.path.relpath(root, srcdir)
+
+    # Create all directories with proper permissions for security
+    # reasons (Putting private data into directories that haven't had their
+    # permissions set appropriately may leak the private information.)
+    symlinks_to_process = []
+    for directory in directories:
+        source_dirpath = os.path.join(root, directory)
+        target_dirpath = os.path.join(dstdir, relpath, directory)
+
+        # Defer symlinks until later because we may end up having to copy
+        # the file contents and the directory may not exist yet.
+        if os.path.islink(source_dirpath):
+            symlinks_to_process.append((source_dirpath, target_dirpath))
+            continue
 
-            _mkdir_with_copied_mode(target_dirpath, source_dirpath)
+        _mkdir_with_copied_mode(target_dirpath, source_dirpath)
 
-        # Link or create all directories that were pointed to by symlinks and
-        # then reset symlinks_to_process for use by files.
-        _copy_symlinks(symlinks_to_process, srcdir)
-        symlinks_to_process = []
+    # Link or create all directories that were pointed to by symlinks and
+    # then reset symlinks_to_process for use by files.
+    _copy_symlinks(symlinks_to_process, srcdir, pool)
+    symlinks_to_process = []
 
-        for filename in files:
-            source_filepath = os.path.join(root, filename)
-            target_filepath = os.path.join(dstdir, relpath, filename)
+    for filename in files:
+        source_filepath = os.path.join(root, filename)
+        target_filepath = os.path.join(dstdir, relpath, filename)
 
-            # Defer symlinks until later because we may end up having to copy
-            # the file contents and the directory may not exist yet.
-            if os.path.islink(source_filepath):
-                symlinks_to_process.append((source_filepath, target_filepath))
-                continue
+        # Defer symlinks until later because we may end up having to copy
+        # the file contents and the directory may not exist yet.
+        if os.path.islink(source_filepath):
+            symlinks_to_process.append((source_filepath, target_filepath))
+            continue
 
-            # Not a symlink so we can copy it now too
-            run(['cp', '-a', source_filepath, target_filepath])
+        # Not a symlink so we can copy it now too
+        pool.copy(source_filepath, target_filepath)
 
-        _copy_symlinks(symlinks_to_process, srcdir)
+    _copy_symlinks(symlinks_to_process, srcdir, pool)
 
 
 def _copy_certificates(context, target_userspace):
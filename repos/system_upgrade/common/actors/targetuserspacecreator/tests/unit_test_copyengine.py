@@ -0,0 +1,133 @@
+import errno
+import os
+import stat
+
+import pytest
+
+from leapp.libraries.actor import copyengine
+
+
+def _write(path, content=b'data', mode=0o640):
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.chmod(path, mode)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_copy_file_preserves_content_and_metadata(tmpdir):
+    src = _write(os.path.join(tmpdir.strpath, 'src'), b'x' * 3000000, mode=0o751)
+    os.utime(src, (1000000000, 1000000000))
+    dst = os.path.join(tmpdir.strpath, 'dst')
+
+    copyengine.copy_file(src, dst)
+
+    assert _read(dst) == _read(src)
+    assert stat.S_IMODE(os.stat(dst).st_mode) == 0o751
+    assert os.stat(dst).st_mtime == 1000000000
+
+
+def test_copy_file_overwrites(tmpdir):
+    src = _write(os.path.join(tmpdir.strpath, 'src'), b'new')
+    dst = _write(os.path.join(tmpdir.strpath, 'dst'), b'old content')
+
+    copyengine.copy_file(src, dst)
+
+    assert _read(dst) == b'new'
+
+
+@pytest.mark.parametrize('errno_', (errno.EOPNOTSUPP, errno.EXDEV))
+def test_copy_content_fallback(monkeypatch, tmpdir, errno_):
+    def ioctl_unsupported(*args):
+        raise IOError(errno_, 'not supported')
+
+    def copy_file_range_unsupported(*args):
+        raise OSError(errno_, 'not supported')
+
+    monkeypatch.setattr(copyengine.fcntl, 'ioctl', ioctl_unsupported)
+    monkeypatch.setattr(copyengine.os, 'copy_file_range', copy_file_range_unsupported, raising=False)
+    src = _write(os.path.join(tmpdir.strpath, 'src'), b'abc' * 1000)
+    dst = os.path.join(tmpdir.strpath, 'dst')
+
+    copyengine.copy_file(src, dst)
+
+    assert _read(dst) == b'abc' * 1000
+
+
+def test_copy_file_symlink(tmpdir):
+    src = os.path.join(tmpdir.strpath, 'link')
+    os.symlink('../somewhere/file', src)
+    dst = os.path.join(tmpdir.strpath, 'dst')
+
+    copyengine.copy_file(src, dst)
+
+    assert os.path.islink(dst)
+    assert os.readlink(dst) == '../somewhere/file'
+
+
+def test_copy_file_special(monkeypatch, tmpdir):
+    commands = []
+    monkeypatch.setattr(copyengine, 'run', commands.append)
+    src = os.path.join(tmpdir.strpath, 'fifo')
+    os.mkfifo(src)
+    dst = os.path.join(tmpdir.strpath, 'dst')
+
+    copyengine.copy_file(src, dst)
+
+    assert commands == [['cp', '-a', src, dst]]
+
+
+def test_copy_tree(tmpdir):
+    src = tmpdir.mkdir('src')
+    src.mkdir('sub')
+    _write(os.path.join(src.strpath, 'sub', 'file'), b'content', mode=0o600)
+    os.symlink('sub/file', os.path.join(src.strpath, 'link'))
+    os.chmod(os.path.join(src.strpath, 'sub'), 0o710)
+    dst = os.path.join(tmpdir.strpath, 'dst')
+
+    copyengine.copy_any(src.strpath, dst)
+
+    assert _read(os.path.join(dst, 'sub', 'file')) == b'content'
+    assert stat.S_IMODE(os.stat(os.path.join(dst, 'sub', 'file')).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.join(dst, 'sub')).st_mode) == 0o710
+    assert os.readlink(os.path.join(dst, 'link')) == 'sub/file'
+
+
+def test_mkdir_with_copied_mode(tmpdir):
+    mode_from = tmpdir.mkdir('mode_from')
+    os.chmod(mode_from.strpath, 0o705)
+    path = os.path.join(tmpdir.strpath, 'parent', 'dir')
+
+    copyengine.mkdir_with_copied_mode(path, mode_from.strpath)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o705
+
+
+@pytest.mark.parametrize('workers', (1, 4))
+def test_copy_pool(tmpdir, workers):
+    src = tmpdir.mkdir('src')
+    dst = tmpdir.mkdir('dst')
+    for i in range(20):
+        _write(os.path.join(src.strpath, str(i)), str(i).encode('utf-8'))
+
+    with copyengine.CopyPool(workers) as pool:
+        for i in range(20):
+            pool.copy(os.path.join(src.strpath, str(i)), os.path.join(dst.strpath, str(i)))
+
+    assert sorted(os.listdir(dst.strpath), key=int) == [str(i) for i in range(20)]
+    assert _read(os.path.join(dst.strpath, '7')) == b'7'
+
+
+def test_copy_pool_raises_error(tmpdir):
+    src = _write(os.path.join(tmpdir.strpath, 'src'))
+
+    with pytest.raises(OSError):
+        with copyengine.CopyPool(4) as pool:
+            pool.copy(src, os.path.join(tmpdir.strpath, 'dst'))
+            pool.copy(os.path.join(tmpdir.strpath, 'missing'), os.path.join(tmpdir.strpath, 'dst2'))
+
+    assert _read(os.path.join(tmpdir.strpath, 'dst')) == b'data'
@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+
+from leapp.libraries.actor import packagecache
+from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def cache_env(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_PERSISTENT_PACKAGE_CACHE_SIZE': '3'}))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    dnf_cache_dir = tmpdir.mkdir('dnf-metadata-cache').strpath
+    cache_dir = os.path.join(tmpdir.strpath, 'persistent_package_cache')
+    return dnf_cache_dir, cache_dir
+
+
+def _download(dnf_cache_dir, relpath, size=MiB, content=b'x'):
+    path = os.path.join(dnf_cache_dir, relpath)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content * size)
+    return path
+
+
+def _load_index(cache_dir):
+    with open(os.path.join(cache_dir, packagecache.INDEX_FILE)) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('envars,expected', [
+    ({}, False),
+    ({'LEAPP_PERSISTENT_PACKAGE_CACHE': '1'}, True),
+    ({'LEAPP_DEVEL_USE_PERSISTENT_PACKAGE_CACHE': '1'}, True),
+])
+def test_is_cache_enabled(monkeypatch, envars, expected):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars=envars))
+    assert packagecache.is_cache_enabled() == expected
+
+
+def test_store_and_restore(cache_env):
+    dnf_cache_dir, cache_dir = cache_env
+    src = _download(dnf_cache_dir, 'baseos-0123456789abcdef/packages/bash.rpm')
+    _download(dnf_cache_dir, 'baseos-0123456789abcdef/repodata/repomd.xml', size=10)
+
+    packagecache.store_packages(dnf_cache_dir, cache_dir)
+    assert list(_load_index(cache_dir).keys()) == ['baseos-0123456789abcdef/packages/bash.rpm']
+
+    # the container is created again
+    os.unlink(src)
+    packagecache.restore_packages(dnf_cache_dir, cache_dir)
+    cached = os.path.join(cache_dir, 'baseos-0123456789abcdef/packages/bash.rpm')
+    assert os.path.samefile(src, cached)
+
+
+def test_restore_corrupted(cache_env):
+    dnf_cache_dir, cache_dir = cache_env
+    src = _download(dnf_cache_dir, 'baseos-0123456789abcdef/packages/bash.rpm')
+    packagecache.store_packages(dnf_cache_dir, cache_dir)
+    os.unlink(src)
+    with open(os.path.join(cache_dir, 'baseos-0123456789abcdef/packages/bash.rpm'), 'wb') as f:
+        f.write(b'corrupted')
+
+    packagecache.restore_packages(dnf_cache_dir, cache_dir)
+    assert not os.path.exists(src)
+    assert not _load_index(cache_dir)
+    assert api.current_logger.warnmsg
+
+
+def test_lru_eviction(cache_env):
+    dnf_cache_dir, cache_dir = cache_env
+    for name in ('a', 'b'):
+        _download(dnf_cache_dir, 'baseos-0123456789abcdef/packages/{}.rpm'.format(name), content=name.encode())
+    packagecache.store_packages(dnf_cache_dir, cache_dir)
+    index = _load_index(cache_dir)
+    # make the 'b' package the least recently used one, not needed anymore
+    index['baseos-0123456789abcdef/packages/b.rpm']['last_used'] = 0
+    with open(os.path.join(cache_dir, packagecache.INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+    os.unlink(os.path.join(dnf_cache_dir, 'baseos-0123456789abcdef/packages/b.rpm'))
+
+    # the limit is 3 MiB
+    for name in ('c', 'd'):
+        _download(dnf_cache_dir, 'appstream-0123456789abcdef/packages/{}.rpm'.format(name), content=name.encode())
+    packagecache.store_packages(dnf_cache_dir, cache_dir)
+
+    index = _load_index(cache_dir)
+    assert len(index) == 3
+    assert 'baseos-0123456789abcdef/packages/b.rpm' not in index
+    assert not os.path.exists(os.path.join(cache_dir, 'baseos-0123456789abcdef/packages/b.rpm'))
+
+
+def test_store_old_format(cache_env):
+    dnf_cache_dir, cache_dir = cache_env
+    # the whole DNF cache has been moved here by previous versions
+    os.makedirs(os.path.join(cache_dir, 'baseos-0123456789abcdef', 'repodata'))
+    _download(dnf_cache_dir, 'baseos-0123456789abcdef/packages/bash.rpm')
+    packagecache.store_packages(dnf_cache_dir, cache_dir)
+    assert not os.path.exists(os.path.join(cache_dir, 'baseos-0123456789abcdef', 'repodata'))
+    assert len(_load_index(cache_dir)) == 1
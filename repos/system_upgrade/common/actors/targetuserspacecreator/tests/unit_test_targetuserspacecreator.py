@@ -10,9 +10,10 @@ import pytest
 from leapp import models, reporting
 from leapp.exceptions import StopActorExecution, StopActorExecutionError
 from leapp.libraries.actor import userspacegen
-from leapp.libraries.common import overlaygen, repofileutils, rhsm
+from leapp.libraries.common import metadatacache, overlaygen, repofileutils, rhsm, spaceplanner, userspacecache
 from leapp.libraries.common.config import architecture
 from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked, produce_mocked
+from leapp.libraries.stdlib import CalledProcessError
 from leapp.utils.deprecation import suppress_deprecation
 
 if sys.version_info < (2, 8):
@@ -1211,6 +1212,9 @@ def test_perform_ok(monkeypatch):
     monkeypatch.setattr(userspacegen, '_InputData', mocked_consume_data)
     monkeypatch.setattr(userspacegen, '_get_product_certificate_path', lambda: _DEFAULT_CERT_PATH)
     monkeypatch.setattr(overlaygen, 'create_source_overlay', MockedMountingBase)
+    # do not touch the real container path on the host
+    monkeypatch.setattr(overlaygen, 'get_recommended_leapp_free_space', lambda *x: 3200)
+    monkeypatch.setattr(userspacegen, '_create_target_userspace_directories', lambda *x: None)
     monkeypatch.setattr(userspacegen, '_gather_target_repositories', lambda *x: repoids)
     monkeypatch.setattr(userspacegen, '_create_target_userspace', lambda *x: None)
     monkeypatch.setattr(userspacegen.api, 'current_actor', CurrentActorMocked())
@@ -1224,3 +1228,71 @@ def test_perform_ok(monkeypatch):
     assert userspacegen.api.produce.model_instances[1] == msg_target_repos
     # this one is full of constants, so it's safe to check just the instance
     assert isinstance(userspacegen.api.produce.model_instances[2], models.TargetUserSpaceInfo)
+
+
+class MockedContextCall(object):
+    def __init__(self, base_dir, raise_err=False):
+        self.base_dir = base_dir
+        self.raise_err = raise_err
+        self.called = []
+
+    def call(self, cmd, **dummy_kwargs):
+        self.called.append(cmd)
+        if self.raise_err:
+            raise CalledProcessError(message='A Leapp Command Error occurred.', command=cmd, result={'exit_code': 1})
+        return {'stdout': ''}
+
+
+@pytest.mark.parametrize('refresh_fails', (True, False))
+def test_refresh_metadata(monkeypatch, tmpdir, refresh_fails):
+    context = MockedContextCall(tmpdir.mkdir('scratch').strpath, raise_err=refresh_fails)
+    pinned = []
+    monkeypatch.setattr(userspacegen.api, 'current_actor', CurrentActorMocked(dst_ver='8.8'))
+    monkeypatch.setattr(userspacegen.api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(metadatacache, 'unpin_metadata', lambda: pinned.append(None))
+    monkeypatch.setattr(metadatacache, 'pin_metadata', pinned.append)
+
+    refreshed = userspacegen._refresh_metadata(context, '/el8target', ['baseos'])
+
+    assert refreshed is not refresh_fails
+    assert context.called[0][:3] == ['dnf', 'makecache', '--refresh']
+    assert ['--enablerepo', 'baseos'] == context.called[0][-2:]
+    assert pinned == ([None] if refresh_fails else [None, ['baseos']])
+
+
+@pytest.mark.parametrize('key_matching,metadata_refreshed,metadata_matching,expected', [
+    (True, True, True, True),
+    (False, True, True, False),
+    (True, False, True, False),
+    (True, True, False, False),
+])
+def test_reuse_target_userspace(monkeypatch, tmpdir, key_matching, metadata_refreshed, metadata_matching, expected):
+    userspace_dir = tmpdir.mkdir('el8userspace').strpath
+    invalidated = []
+    removed_plans = []
+    monkeypatch.setattr(userspacegen.api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(userspacecache, 'is_cache_key_matching', lambda *args: key_matching)
+    monkeypatch.setattr(userspacecache, 'is_metadata_matching', lambda *args: metadata_matching)
+    monkeypatch.setattr(userspacecache, 'get_metadata_digest', lambda *args: 'digest')
+    monkeypatch.setattr(userspacecache, 'invalidate_cache', lambda path, reason: invalidated.append(reason))
+    monkeypatch.setattr(spaceplanner, 'remove_space_plan', removed_plans.append)
+
+    reused = userspacegen._reuse_target_userspace(userspace_dir, ['baseos'], {}, metadata_refreshed)
+
+    assert reused == expected
+    assert removed_plans == ([userspace_dir] if expected else [])
+    assert bool(invalidated) == (key_matching and not metadata_refreshed)
+
+
+def test_prepare_target_userspace_reused(monkeypatch):
+    monkeypatch.setattr(userspacegen.api, 'current_actor', CurrentActorMocked(dst_ver='8.8'))
+    monkeypatch.setattr(userspacecache, 'get_cache_key', lambda *args: {})
+    monkeypatch.setattr(userspacegen, '_reuse_target_userspace', lambda *args: True)
+    monkeypatch.setattr(userspacegen, '_create_target_userspace_directories', lambda *args: None)
+    monkeypatch.setattr(userspacegen, '_mount_empty_installroot', lambda *args: MockedMountingBase())
+    monkeypatch.setattr(
+        userspacegen, '_mount_target_userspace', lambda *args: pytest.fail('The container must not be mounted'))
+    monkeypatch.setattr(userspacegen, '_refresh_metadata', lambda *args: True)
+    monkeypatch.setattr(userspacegen, 'run', lambda *args: pytest.fail('The container must not be removed'))
+    monkeypatch.setattr(userspacegen, '_backup_to_persistent_package_cache', lambda *args: None)
+    userspacegen.prepare_target_userspace(MockedMountingBase(), '/var/lib/leapp/el8userspace', ['baseos'], ['dnf'])
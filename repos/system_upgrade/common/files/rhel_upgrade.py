@@ -3,11 +3,18 @@ from __future__ import print_function
 
 import json
 import logging
+import os
+import re
 import sys
+import time
 
 import dnf
+import dnf.callback
 import dnf.cli
 import dnf.module.module_base
+import dnf.selector
+import dnf.transaction
+import rpm
 
 CMDS = ['check', 'download', 'dry-run', 'upgrade']
 """
@@ -27,6 +34,24 @@ Basic subcommands for the plugin.
 """
 
 
+SPACE_PLAN_DIR_DEPTH = 3
+"""
+Depth of directories the installed sizes are aggregated by in the space plan.
+
+Installed sizes of packages are aggregated per directories to keep the size
+of the space plan reasonable. E.g. the size of /var/lib/pgsql/data/file is
+accounted to /var/lib/pgsql.
+"""
+
+
+PKG_NAME_REGEX = re.compile(r'^[a-zA-Z0-9_.+-]+$')
+"""
+Specs matching the regex are handled as plain package names when marked in batches.
+
+Other specs (globs, provides, files, ...) are marked one by one by DNF.
+"""
+
+
 class DoNotDownload(Exception):
     pass
 
@@ -35,6 +60,121 @@ def _do_not_download_packages(packages, progress=None, total=None):
     raise DoNotDownload()
 
 
+class DownloadStats(dnf.callback.DownloadProgress):
+    """
+    Collect statistics of the download of packages per repository
+
+    Callbacks are passed to the original download progress (if any).
+    """
+
+    def __init__(self, progress=None):
+        super(DownloadStats, self).__init__()
+        self._progress = progress
+        self.start_time = time.time()
+        self.repos = {}
+
+    def _get_repo_stats(self, payload):
+        repoid = getattr(getattr(payload, 'pkg', None), 'reponame', None) or 'unknown'
+        if repoid not in self.repos:
+            self.repos[repoid] = {'bytes': 0, 'packages': 0, 'elapsed': 0.0, 'retries': 0, 'failed': 0}
+        return self.repos[repoid]
+
+    def start(self, total_files, total_size, total_drpms=0):
+        self.start_time = time.time()
+        if self._progress:
+            self._progress.start(total_files, total_size, total_drpms)
+
+    def progress(self, payload, done):
+        if self._progress:
+            self._progress.progress(payload, done)
+
+    def end(self, payload, status, msg):
+        stats = self._get_repo_stats(payload)
+        if status == dnf.callback.STATUS_MIRROR:
+            # the download from a mirror failed, another one is tried
+            stats['retries'] += 1
+        elif status == dnf.callback.STATUS_FAILED:
+            stats['failed'] += 1
+        elif status != dnf.callback.STATUS_ALREADY_EXISTS:
+            stats['packages'] += 1
+            stats['bytes'] += getattr(payload, 'download_size', 0)
+            # time until the last package from the repository has been downloaded
+            stats['elapsed'] = time.time() - self.start_time
+        if self._progress:
+            self._progress.end(payload, status, msg)
+
+
+class ScriptletStats(dnf.callback.TransactionProgress):
+    """
+    Measure the time spent in scriptlets and triggers of packages during the transaction
+
+    DNF reports just the start of a scriptlet, so the scriptlet is considered
+    to be finished with the next reported event (or with the end of the
+    transaction).
+    """
+
+    def __init__(self):
+        super(ScriptletStats, self).__init__()
+        self.start_time = time.time()
+        self.scriptlets = {}
+        self._current = None
+        self._current_start = None
+
+    def _finish_scriptlet(self, now):
+        if self._current is not None:
+            self.scriptlets[self._current] = self.scriptlets.get(self._current, 0.0) + now - self._current_start
+            self._current = None
+
+    def progress(self, package, action, ti_done, ti_total, ts_done, ts_total):
+        now = time.time()
+        self._finish_scriptlet(now)
+        if action == dnf.transaction.PKG_SCRIPTLET:
+            # file triggers are not related to any package
+            self._current = str(package) if package else 'None'
+            self._current_start = now
+
+    def finish(self):
+        self._finish_scriptlet(time.time())
+
+
+def _to_str(value):
+    # RPM headers contain bytes with older versions of the rpm python bindings
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('utf-8', 'surrogateescape')
+    return value
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8', 'surrogateescape')
+
+
+def _get_plan_dir(path):
+    dirs = os.path.dirname(path).strip('/').split('/')[:SPACE_PLAN_DIR_DEPTH]
+    return '/' + '/'.join(dirs)
+
+
+def _add_package_sizes(sizes, pkg, sign=1, files=None):
+    """
+    Add the installed size of the package to the given directories
+
+    Sizes of particular files are not present in repositories metadata, so
+    the installed size is split evenly between files of the package. Files
+    of the package are used unless other files are given.
+    """
+    if files is None:
+        files = pkg.files
+    if not files:
+        # filelists are not available; the most of the content lives in /usr
+        sizes['/usr'] = sizes.get('/usr', 0) + sign * pkg.installsize
+        return
+    share = sign * pkg.installsize / float(len(files))
+    for path in files:
+        plan_dir = _get_plan_dir(path)
+        sizes[plan_dir] = sizes.get(plan_dir, 0) + share
+
+
 class RhelUpgradeCommand(dnf.cli.Command):
     aliases = ('rhel-upgrade',)
     summary = 'Plugin for upgrading to the next RHEL major release'
@@ -68,6 +208,48 @@ class RhelUpgradeCommand(dnf.cli.Command):
                        'in repositories metadata: '.format(entity_name, op.__name__) + ' '.join(entities_notfound))
             print('Warning: ' + err_str, file=sys.stderr)
 
+    def _split_names(self, specs, query):
+        """
+        Return names of packages from the query matching plain name specs and the rest of specs
+        """
+        names = [spec for spec in specs if PKG_NAME_REGEX.match(spec)]
+        matching = query.filter(name=names)
+        matched_names = {pkg.name for pkg in matching}
+        return matching, [spec for spec in specs if spec not in matched_names]
+
+    def _remove_packages(self, specs):
+        """
+        Mark packages to remove
+
+        Installed packages matching given names are marked at once. Other
+        specs are marked one by one (as they could be provides, files, ...).
+        """
+        installed, other_specs = self._split_names(specs, self.base.sack.query().installed())
+        clean_deps = self.base.conf.clean_requirements_on_remove
+        for pkg in installed:
+            self.base._goal.erase(pkg, clean_deps=clean_deps)
+        self._process_entities(entities=other_specs, op=self.base.remove, entity_name='Package')
+
+    def _upgrade_packages(self, specs):
+        """
+        Mark packages to upgrade
+
+        Installed packages matching given names are upgraded by one selector,
+        including obsoleting packages, the same way as `dnf upgrade <names>`
+        does. Other specs are marked one by one, so specs of packages that
+        are not installed are reported accurately.
+        """
+        sack = self.base.sack
+        installed, other_specs = self._split_names(specs, sack.query().installed())
+        if installed:
+            query = sack.query().available().filterm(name=list({pkg.name for pkg in installed}))
+            if self.base.conf.obsoletes:
+                query = query.union(sack.query().available().filterm(obsoletes=installed))
+            sltr = dnf.selector.Selector(sack)
+            sltr.set(pkg=query.union(installed.latest()))
+            self.base._goal.upgrade(select=sltr)
+        self._process_entities(entities=other_specs, op=self.base.upgrade, entity_name='Package')
+
     def _save_aws_region(self, region):
         self.plugin_data['rhui']['aws']['region'] = region
         with open(self.opts.filename, 'w+') as fo:
@@ -97,6 +279,172 @@ class RhelUpgradeCommand(dnf.cli.Command):
             raise dnf.exceptions.RepoError("RHUI repository %s does not have an url" % repo.name)
         return repo
 
+    def _store_space_plan(self):
+        """
+        Store sizes of the resolved transaction for the planning of the required disk space
+
+        When filelists of repositories are not loaded, incoming packages know
+        only files listed in the primary metadata (if any). Their installed
+        sizes are split between files of the installed package with the same
+        name instead, read from the rpmdb. Sizes of new packages are accounted
+        to /usr. Such a plan is marked as approximate.
+        """
+        path = self.plugin_data.get('space_plan', {}).get('path')
+        if not path:
+            return
+        approximate = not self.plugin_data['dnf_conf'].get('load_filelists', True)
+        installed = self.base.sack.query().installed()
+        download_size = 0
+        net_sizes = {}
+        for pkg in self.base.transaction.install_set:
+            if pkg.reponame != '@commandline' and not os.path.exists(pkg.localPkg()):
+                download_size += pkg.downloadsize
+            files = None
+            if approximate and pkg.reponame != '@commandline':
+                installed_pkgs = installed.filter(name=pkg.name).run()
+                files = installed_pkgs[0].files if installed_pkgs else []
+            _add_package_sizes(net_sizes, pkg, files=files)
+        for pkg in self.base.transaction.remove_set:
+            _add_package_sizes(net_sizes, pkg, sign=-1)
+        if approximate:
+            print('Filelists of repositories are not loaded; the space plan of the transaction is approximate.')
+        plan = {
+            'download_size': download_size,
+            'net_sizes': {key: int(value) for key, value in net_sizes.items()},
+            'approximate': approximate,
+        }
+        with open(path, 'w') as fo:
+            json.dump(plan, fo, sort_keys=True, indent=2)
+
+    def _trim_metadata(self):
+        """
+        Do not load filelists metadata of repositories
+
+        Newer DNF loads filelists only when listed in optional_metadata_types.
+        Older DNF loads them always, so the loading of repositories into
+        the sack is wrapped to skip them.
+        """
+        if 'filelists' in self.base.conf.optional_metadata_types:
+            self.base.conf.optional_metadata_types = [
+                md_type for md_type in self.base.conf.optional_metadata_types if md_type != 'filelists'
+            ]
+        add_repo_to_sack = getattr(self.base, '_add_repo_to_sack', None)
+        if not add_repo_to_sack:
+            return
+        base = self.base
+
+        def _add_repo_to_sack(repo):
+            load_repo = base.sack.load_repo
+
+            def _load_repo(*args, **kwargs):
+                kwargs['load_filelists'] = False
+                return load_repo(*args, **kwargs)
+
+            base.sack.load_repo = _load_repo
+            try:
+                return add_repo_to_sack(repo)
+            finally:
+                del base.sack.load_repo
+
+        self.base._add_repo_to_sack = _add_repo_to_sack
+
+    def _store_download_stats(self, stats):
+        path = self.plugin_data.get('download', {}).get('stats_path')
+        data = {
+            'elapsed': time.time() - stats.start_time,
+            'max_parallel_downloads': self.base.conf.max_parallel_downloads,
+            'fastestmirror': self.base.conf.fastestmirror,
+            'repos': stats.repos,
+        }
+        with open(path, 'w') as fo:
+            json.dump(data, fo, sort_keys=True, indent=2)
+
+    def _store_transaction_stats(self, stats):
+        path = self.plugin_data.get('upgrade', {}).get('stats_path')
+        stats.finish()
+        data = {
+            'elapsed': time.time() - stats.start_time,
+            'scriptlets_elapsed': sum(stats.scriptlets.values()),
+            'scriptlets': stats.scriptlets,
+        }
+        with open(path, 'w') as fo:
+            json.dump(data, fo, sort_keys=True, indent=2)
+
+    def _store_changed_files(self):
+        """
+        Store paths of files owned by packages installed by the transaction into the file specified in the plugin data
+
+        The paths are read from the RPM database, as filelists of packages in
+        repositories metadata could be trimmed (see _trim_metadata).
+        """
+        path = self.plugin_data.get('upgrade', {}).get('changed_files_path')
+        installed = {(pkg.name, pkg.version, pkg.release, pkg.arch) for pkg in self.base.transaction.install_set}
+        ts = rpm.TransactionSet(self.base.conf.installroot)
+        with open(path, 'wb') as fo:
+            for name in sorted({nvra[0] for nvra in installed}):
+                for hdr in ts.dbMatch('name', name):
+                    nvra = tuple(_to_str(hdr[tag]) for tag in (
+                        rpm.RPMTAG_NAME, rpm.RPMTAG_VERSION, rpm.RPMTAG_RELEASE, rpm.RPMTAG_ARCH))
+                    if nvra in installed:
+                        fo.write(b''.join(_to_bytes(filename) + b'\n' for filename in hdr[rpm.RPMTAG_FILENAMES]))
+
+    def _instrument_transaction(self):
+        """
+        Record the time spent in the transaction and its scriptlets into the file specified in the plugin data
+
+        When requested by the plugin data, files installed by the transaction
+        are recorded as well (for the targeted SELinux relabeling).
+        """
+        path = self.plugin_data.get('upgrade', {}).get('stats_path')
+        changed_files_path = self.plugin_data.get('upgrade', {}).get('changed_files_path')
+        if not path and not changed_files_path:
+            return
+        for stale_path in (path, changed_files_path):
+            if stale_path and os.path.exists(stale_path):
+                os.unlink(stale_path)
+        do_transaction = self.base.do_transaction
+
+        def _do_transaction(display=()):
+            if not isinstance(display, (list, tuple)):
+                display = [display]
+            stats = ScriptletStats()
+            try:
+                result = do_transaction(display=list(display) + [stats])
+            finally:
+                if path:
+                    self._store_transaction_stats(stats)
+            if changed_files_path:
+                try:
+                    self._store_changed_files()
+                except Exception as e:  # pylint: disable=broad-except
+                    # the whole system is relabeled without the list, the transaction must not fail because of it
+                    logging.getLogger('dnf.plugin').warning('Failed to store the list of installed files: %s', e)
+                    if os.path.exists(changed_files_path):
+                        os.unlink(changed_files_path)
+            return result
+
+        self.base.do_transaction = _do_transaction
+
+    def _instrument_download(self):
+        """
+        Record statistics of the download of packages into the file specified in the plugin data
+        """
+        path = self.plugin_data.get('download', {}).get('stats_path')
+        if not path:
+            return
+        if os.path.exists(path):
+            os.unlink(path)
+        download_packages = self.base.download_packages
+
+        def _download_packages(pkglist, progress=None, callback_total=None):
+            stats = DownloadStats(progress)
+            try:
+                return download_packages(pkglist, stats, callback_total)
+            finally:
+                self._store_download_stats(stats)
+
+        self.base.download_packages = _download_packages
+
     def pre_configure(self):
         with open(self.opts.filename) as fo:
             self.plugin_data = json.load(fo)
@@ -123,8 +471,18 @@ class RhelUpgradeCommand(dnf.cli.Command):
             self.base.conf.installroot = installroot
         if self.plugin_data['dnf_conf']['test_flag'] and self.opts.tid[0] in ['download', 'dry-run']:
             self.base.conf.tsflags.append("test")
+        if not self.plugin_data['dnf_conf'].get('load_filelists', True):
+            self._trim_metadata()
+        # keep the DNF configuration of the container for options not set by leapp
+        download_conf = self.plugin_data.get('download', {})
+        if download_conf.get('max_parallel_downloads'):
+            self.base.conf.max_parallel_downloads = download_conf['max_parallel_downloads']
+        if download_conf.get('fastestmirror') is not None:
+            self.base.conf.fastestmirror = download_conf['fastestmirror']
 
         enabled_repos = self.plugin_data['dnf_conf']['enable_repos']
+        # metadata refreshed by leapp for the whole leapp execution, see the metadatacache library
+        pinned_repos = self.plugin_data['dnf_conf'].get('pinned_repos', [])
         self.base.repos.all().disable()
 
         aws_region = None
@@ -134,6 +492,8 @@ class RhelUpgradeCommand(dnf.cli.Command):
                 repo.skip_if_unavailable = False
                 if not self.base.conf.gpgcheck:
                     repo.gpgcheck = False
+                if repo.id in pinned_repos:
+                    repo.metadata_expire = -1
                 repo.enable()
                 if self.opts.tid[0] == 'download' and on_aws:
                     # during the upgrade phase we has to disable "Amazon-id" plugin as we do not have networking
@@ -157,6 +517,11 @@ class RhelUpgradeCommand(dnf.cli.Command):
             self._save_aws_region(aws_region)
 
     def run(self):
+        if self.opts.tid[0] == 'download':
+            self._instrument_download()
+        elif self.opts.tid[0] == 'upgrade':
+            self._instrument_transaction()
+
         # takes local rpms, creates Package objects from them, and then adds them to the sack as virtual repository
         local_rpm_objects = self.base.add_remote_rpms(self.plugin_data['pkgs_info']['local_rpms'])
 
@@ -191,11 +556,11 @@ class RhelUpgradeCommand(dnf.cli.Command):
                                entity_name='Module stream')
 
         # Packages to be removed
-        self._process_entities(entities=to_remove, op=self.base.remove, entity_name='Package')
-        # Packages to be installed
+        self._remove_packages(to_remove)
+        # Packages to be installed; just a few usually, the best candidates are selected by DNF one by one
         self._process_entities(entities=to_install, op=self.base.install, entity_name='Package')
         # Packages to be upgraded
-        self._process_entities(entities=to_upgrade, op=self.base.upgrade, entity_name='Package')
+        self._upgrade_packages(to_upgrade)
         self.base.distro_sync()
 
         if self.opts.tid[0] == 'check':
@@ -205,6 +570,7 @@ class RhelUpgradeCommand(dnf.cli.Command):
                 print('Transaction check: ', file=sys.stderr)
                 print(str(e), file=sys.stderr)
                 raise
+            self._store_space_plan()
 
             # We are doing this to avoid downloading the packages in the check phase
             self.base.download_packages = _do_not_download_packages
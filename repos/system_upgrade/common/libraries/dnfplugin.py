@@ -6,7 +6,18 @@ import re
 import shutil
 
 from leapp.exceptions import StopActorExecutionError
-from leapp.libraries.common import dnfconfig, guards, mounting, overlaygen, rhsm, utils
+from leapp.libraries.common import (
+    dnfconfig,
+    guards,
+    metadatacache,
+    mounting,
+    overlaygen,
+    rhsm,
+    selinuxrelabel,
+    spaceplanner,
+    userspacecache,
+    utils
+)
 from leapp.libraries.common.config import get_env
 from leapp.libraries.common.config.version import get_target_major_version, get_target_version
 from leapp.libraries.common.gpg import is_nogpgcheck_set
@@ -51,6 +62,18 @@ DNF_PLUGIN_PATH = _DnfPluginPathStr()
 DNF_PLUGIN_DATA_NAME = 'dnf-plugin-data.txt'
 DNF_PLUGIN_DATA_PATH = os.path.join('/var/lib/leapp', DNF_PLUGIN_DATA_NAME)
 DNF_PLUGIN_DATA_LOG_PATH = os.path.join('/var/log/leapp', DNF_PLUGIN_DATA_NAME)
+DNF_DOWNLOAD_STATS_NAME = 'dnf-download-stats.json'
+DNF_DOWNLOAD_STATS_PATH = os.path.join('/var/lib/leapp', DNF_DOWNLOAD_STATS_NAME)
+DNF_DOWNLOAD_STATS_LOG_PATH = os.path.join('/var/log/leapp', DNF_DOWNLOAD_STATS_NAME)
+DNF_TRANSACTION_STATS_NAME = 'dnf-transaction-stats.json'
+DNF_TRANSACTION_STATS_PATH = os.path.join('/var/lib/leapp', DNF_TRANSACTION_STATS_NAME)
+DNF_TRANSACTION_STATS_LOG_PATH = os.path.join('/var/log/leapp', DNF_TRANSACTION_STATS_NAME)
+DNF_CHANGED_FILES_PATH = '/var/lib/leapp/dnf-changed-files'
+_MAX_PARALLEL_DOWNLOADS = 20
+""" The maximal value of the max_parallel_downloads DNF option """
+_SLOWEST_SCRIPTLETS_LOGGED = 10
+_FILE_DEPENDENCY_ERROR_REGEX = re.compile(r'(nothing provides|requires) /')
+""" Matches depsolver errors about an unresolved file dependency (e.g. "nothing provides /usr/bin/foo") """
 DNF_DEBUG_DATA_PATH = '/var/log/leapp/dnf-debugdata/'
 
 
@@ -78,6 +101,69 @@ def _rebuild_rpm_db(context, root=None):
     context.call(cmd)
 
 
+def is_metadata_trimmed():
+    """
+    Return True if DNF should not load filelists metadata of repositories
+
+    Loading of filelists (hundreds of MiB for RHEL repositories) is skipped
+    when (envar) `LEAPP_DNF_TRIM_METADATA=1`. File dependencies are resolved
+    from the primary metadata then, which contains the commonly required
+    files (e.g. binaries, files in /etc). When a file dependency cannot be
+    resolved, the transaction is resolved again with filelists.
+    """
+    return get_env('LEAPP_DNF_TRIM_METADATA', '0') == '1'
+
+
+def _get_download_conf():
+    """
+    Return the configuration of the download of packages for the DNF plugin.
+
+    The configuration can be changed by the following envars:
+        LEAPP_DNF_MAX_PARALLEL_DOWNLOADS - the maximal number of packages downloaded in parallel (1-20)
+        LEAPP_DNF_FASTESTMIRROR - set to 1 (0) to enable (disable) the selection of the fastest mirror
+
+    When an envar is not set (or it is invalid), the value from the DNF
+    configuration of the target userspace container is used (None).
+    """
+    max_parallel_downloads = get_env('LEAPP_DNF_MAX_PARALLEL_DOWNLOADS', None)
+    if max_parallel_downloads is not None:
+        try:
+            max_parallel_downloads = int(max_parallel_downloads)
+        except ValueError:
+            max_parallel_downloads = 0
+        if not 1 <= max_parallel_downloads <= _MAX_PARALLEL_DOWNLOADS:
+            api.current_logger().warning(
+                'Invalid "LEAPP_DNF_MAX_PARALLEL_DOWNLOADS" environment variable "%s". Expected a number 1-%d.'
+                ' Using the DNF configuration.', get_env('LEAPP_DNF_MAX_PARALLEL_DOWNLOADS'), _MAX_PARALLEL_DOWNLOADS
+            )
+            max_parallel_downloads = None
+    fastestmirror = get_env('LEAPP_DNF_FASTESTMIRROR', None)
+    if fastestmirror is not None:
+        if fastestmirror not in ('0', '1'):
+            api.current_logger().warning(
+                'Invalid "LEAPP_DNF_FASTESTMIRROR" environment variable "%s". Expected 0 or 1.'
+                ' Using the DNF configuration.', fastestmirror
+            )
+            fastestmirror = None
+        else:
+            fastestmirror = fastestmirror == '1'
+    return {
+        'max_parallel_downloads': max_parallel_downloads,
+        'fastestmirror': fastestmirror,
+        'stats_path': DNF_DOWNLOAD_STATS_PATH,
+    }
+
+
+def _get_upgrade_conf():
+    """
+    Return the configuration of the upgrade transaction for the DNF plugin.
+    """
+    return {
+        'stats_path': DNF_TRANSACTION_STATS_PATH,
+        'changed_files_path': DNF_CHANGED_FILES_PATH if selinuxrelabel.is_targeted_relabel_enabled() else None,
+    }
+
+
 def build_plugin_data(target_repoids, debug, test, tasks, on_aws):
     """
     Generates a dictionary with the DNF plugin data.
@@ -101,6 +187,8 @@ def build_plugin_data(target_repoids, debug, test, tasks, on_aws):
             'platform_id': 'platform:el{}'.format(get_target_major_version()),
             'releasever': get_target_version(),
             'installroot': '/installroot',
+            'load_filelists': not is_metadata_trimmed(),
+            'pinned_repos': metadatacache.get_pinned_repoids(target_repoids),
             'test_flag': test
         },
         'rhui': {
@@ -108,7 +196,12 @@ def build_plugin_data(target_repoids, debug, test, tasks, on_aws):
               'on_aws': on_aws,
               'region': None,
             }
-        }
+        },
+        'space_plan': {
+            'path': spaceplanner.SPACE_PLAN_PATH,
+        },
+        'download': _get_download_conf(),
+        'upgrade': _get_upgrade_conf(),
     }
     return data
 
@@ -132,6 +225,124 @@ def backup_config(context):
     context.copy_from(DNF_PLUGIN_DATA_PATH, DNF_PLUGIN_DATA_LOG_PATH)
 
 
+def _are_filelists_enabled(context):
+    """
+    Return True if the existing plugin data enable loading of filelists.
+    """
+    try:
+        with context.open(DNF_PLUGIN_DATA_PATH) as f:
+            return json.load(f)['dnf_conf'].get('load_filelists', True)
+    except (OSError, IOError, ValueError, KeyError):
+        return False
+
+
+def _enable_filelists(context):
+    with context.open(DNF_PLUGIN_DATA_PATH) as f:
+        plugin_data = json.load(f)
+    plugin_data['dnf_conf']['load_filelists'] = True
+    with context.open(DNF_PLUGIN_DATA_PATH, 'w+') as f:
+        json.dump(plugin_data, f, sort_keys=True, indent=2)
+    backup_config(context=context)
+
+
+def _retry_with_filelists(context, stage, err):
+    """
+    Enable filelists in the plugin data when the stage failed on an unresolved file dependency without them.
+
+    Return True if the stage should be executed again. The upgrade stage is
+    never executed again, as the failure does not have to come from
+    the depsolver in that stage. The stage is not executed again either when
+    the plugin data cannot be updated, so the original error is reported.
+    """
+    if stage == 'upgrade' or not _FILE_DEPENDENCY_ERROR_REGEX.search(err.stderr or ''):
+        return False
+    if _are_filelists_enabled(context):
+        return False
+    try:
+        _enable_filelists(context)
+    except (OSError, IOError, ValueError, KeyError, TypeError) as e:
+        api.current_logger().warning('Cannot enable filelists in the DNF plugin data: {}'.format(str(e)))
+        return False
+    api.current_logger().info(
+        'The {} stage failed on an unresolved file dependency without filelists metadata.'
+        ' Retrying with filelists.'.format(stage)
+    )
+    return True
+
+
+def backup_download_stats(context):
+    """
+    Backs up statistics of the download of packages and logs the throughput per repository.
+    """
+    if not os.path.exists(context.full_path(DNF_DOWNLOAD_STATS_PATH)):
+        return
+    try:
+        context.copy_from(DNF_DOWNLOAD_STATS_PATH, DNF_DOWNLOAD_STATS_LOG_PATH)
+        with context.open(DNF_DOWNLOAD_STATS_PATH) as f:
+            stats = json.load(f)
+    except (OSError, IOError, ValueError) as e:
+        api.current_logger().warning('Failed to process the download statistics. Message: {}'.format(str(e)))
+        return
+    for repoid, repo_stats in sorted(stats.get('repos', {}).items()):
+        mibs = repo_stats['bytes'] / (1024.0 * 1024.0)
+        elapsed = repo_stats['elapsed']
+        api.current_logger().info(
+            'Downloaded {} packages ({:.1f} MiB) from {} in {:.1f} s ({:.1f} MiB/s), {} retries, {} failures.'.format(
+                repo_stats['packages'], mibs, repoid, elapsed, mibs / elapsed if elapsed else 0.0,
+                repo_stats['retries'], repo_stats['failed'])
+        )
+
+
+def backup_transaction_stats(context):
+    """
+    Backs up statistics of the upgrade transaction and logs the time spent in scriptlets.
+    """
+    if not os.path.exists(context.full_path(DNF_TRANSACTION_STATS_PATH)):
+        return
+    try:
+        context.copy_from(DNF_TRANSACTION_STATS_PATH, DNF_TRANSACTION_STATS_LOG_PATH)
+        with context.open(DNF_TRANSACTION_STATS_PATH) as f:
+            stats = json.load(f)
+    except (OSError, IOError, ValueError) as e:
+        api.current_logger().warning('Failed to process the transaction statistics. Message: {}'.format(str(e)))
+        return
+    api.current_logger().info(
+        'The upgrade transaction took {:.1f} s, {:.1f} s of that in scriptlets and triggers.'.format(
+            stats.get('elapsed', 0.0), stats.get('scriptlets_elapsed', 0.0))
+    )
+    slowest = sorted(stats.get('scriptlets', {}).items(), key=lambda item: item[1], reverse=True)
+    for package, elapsed in slowest[:_SLOWEST_SCRIPTLETS_LOGGED]:
+        api.current_logger().debug('Scriptlets of {} took {:.1f} s.'.format(package, elapsed))
+
+
+def reset_changed_files(context):
+    """
+    Removes lists of files changed by a previous attempt of the upgrade transaction.
+
+    The start of the upgrade transaction is marked for the targeted SELinux
+    relabeling as well, see `selinuxrelabel.mark_upgrade_start`.
+    """
+    try:
+        os.unlink(context.full_path(DNF_CHANGED_FILES_PATH))
+    except OSError:
+        pass
+    selinuxrelabel.mark_upgrade_start()
+
+
+def backup_changed_files(context):
+    """
+    Stores the list of files installed by the upgrade transaction for the targeted SELinux relabeling.
+    """
+    if not os.path.exists(context.full_path(DNF_CHANGED_FILES_PATH)):
+        return
+    try:
+        context.copy_from(DNF_CHANGED_FILES_PATH, selinuxrelabel.CHANGED_FILES_PATH)
+    except (OSError, IOError) as e:
+        api.current_logger().warning(
+            'Failed to store the list of files changed by the upgrade transaction. Message: {}'.format(str(e))
+        )
+
+
 def backup_debug_data(context):
     """
     Performs the backup of DNF debug data
@@ -244,6 +455,8 @@ def _transaction(context, stage, target_repoids, tasks, plugin_info, xfs_info,
 
     # we do not want
     if stage not in ['dry-run', 'upgrade']:
+        # filelists needed by the check stage are needed by the download stage too
+        filelists_needed = stage == 'download' and _are_filelists_enabled(context)
         create_config(
             context=context,
             target_repoids=target_repoids,
@@ -251,6 +464,8 @@ def _transaction(context, stage, target_repoids, tasks, plugin_info, xfs_info,
             test=test, tasks=tasks,
             on_aws=on_aws
         )
+        if filelists_needed and not _are_filelists_enabled(context):
+            _enable_filelists(context)
     backup_config(context=context)
 
     # FIXME: rhsm
@@ -298,11 +513,20 @@ def _transaction(context, stage, target_repoids, tasks, plugin_info, xfs_info,
             DNF_PLUGIN_DATA_PATH
         ]
         try:
-            context.call(
-                cmd=cmd_prefix + cmd + common_params,
-                callback_raw=utils.logging_handler,
-                env=env
-            )
+            try:
+                context.call(
+                    cmd=cmd_prefix + cmd + common_params,
+                    callback_raw=utils.logging_handler,
+                    env=env
+                )
+            except CalledProcessError as e:
+                if not _retry_with_filelists(context, stage, e):
+                    raise
+                context.call(
+                    cmd=cmd_prefix + cmd + common_params,
+                    callback_raw=utils.logging_handler,
+                    env=env
+                )
         except OSError as e:
             api.current_logger().error('Could not call dnf command: Message: %s', str(e), exc_info=True)
             raise StopActorExecutionError(
@@ -314,6 +538,11 @@ def _transaction(context, stage, target_repoids, tasks, plugin_info, xfs_info,
         finally:
             if stage == 'check':
                 backup_debug_data(context=context)
+            elif stage == 'download':
+                backup_download_stats(context=context)
+            elif stage == 'upgrade':
+                backup_transaction_stats(context=context)
+                backup_changed_files(context=context)
 
 
 @contextlib.contextmanager
@@ -322,6 +551,8 @@ def _prepare_transaction(used_repos, target_userspace_info, binds=()):
     target_repoids = set()
     for message in used_repos:
         target_repoids.update([repo.repoid for repo in message.repos])
+    # all DNF executions share the DNF cache (see the metadatacache library)
+    binds = [metadatacache.get_bind()] + list(binds)
     with mounting.NspawnActions(base_dir=target_userspace_info.path, binds=binds) as context:
         yield context, list(target_repoids), target_userspace_info
 
@@ -371,7 +602,7 @@ def install_initramdisk_requirements(packages, target_userspace_info, used_repos
             '--setopt=keepcache=1',
             '--releasever', api.current_actor().configuration.version.target,
             '--disablerepo', '*'
-        ] + repos_opt + list(packages)
+        ] + repos_opt + metadatacache.get_pinning_setopts(target_repoids) + list(packages)
         if config.is_verbose():
             cmd.append('-v')
         if rhsm.skip_rhsm():
@@ -380,8 +611,11 @@ def install_initramdisk_requirements(packages, target_userspace_info, used_repos
         if get_target_major_version() == '9':
             # allow handling new RHEL 9 syscalls by systemd-nspawn
             env = {'SYSTEMD_SECCOMP': '0'}
+        # the installed packages are not part of a newly created container
+        userspacecache.invalidate_cache(target_userspace_info.path, 'packages for the upgrade initramfs installed')
         try:
-            context.call(cmd, env=env)
+            with overlaygen.track_container_size(target_userspace_info.path):
+                context.call(cmd, env=env)
         except CalledProcessError as e:
             api.current_logger().error(
                 'Cannot install packages in the target container required to build the upgrade initramfs.'
@@ -447,6 +681,7 @@ def perform_transaction_install(target_userspace_info, storage_info, used_repos,
 
         if get_target_major_version() == '9':
             _rebuild_rpm_db(context, root='/installroot')
+        reset_changed_files(context)
         _transaction(
             context=context, stage='upgrade', target_repoids=target_repoids, plugin_info=plugin_info,
             xfs_info=xfs_info, tasks=tasks, cmd_prefix=cmd_prefix
@@ -469,7 +704,10 @@ def _prepare_perform(used_repos, target_userspace_info, xfs_info, storage_info,
                                               mount_target=os.path.join(context.base_dir, 'installroot'),
                                               scratch_reserve=reserve_space) as overlay:
             with mounting.mount_upgrade_iso_to_root_dir(target_userspace_info.path, target_iso):
-                yield context, overlay, target_repoids
+                # e.g. downloaded packages are stored inside the container
+                with overlaygen.track_container_size(target_userspace_info.path,
+                                                     excluded_dirs=[userspace_info.scratch]):
+                    yield context, overlay, target_repoids
 
 
 def perform_transaction_check(target_userspace_info,
@@ -500,6 +738,8 @@ def perform_transaction_check(target_userspace_info,
             context=context, stage='check', target_repoids=target_repoids, plugin_info=plugin_info, xfs_info=xfs_info,
             tasks=tasks
         )
+    # detect missing space before the download of packages
+    overlaygen.ensure_enough_transaction_space(target_userspace_info.path, storage_info)
 
 
 def perform_rpm_download(target_userspace_info,
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+
+from leapp.libraries.common import rpms
+from leapp.libraries.common.config import get_env
+from leapp.libraries.stdlib import api, CalledProcessError, run
+
+SNAPSHOT_DIR = '/var/lib/leapp/facts-snapshot'
+"""
+Directory with facts collected by previous leapp executions.
+
+Each snapshot is stored in the <name>.json file and contains:
+  * format - version of the snapshot format (see SNAPSHOT_FORMAT)
+  * repository_version - version of leapp-repository packages which collected the fact
+  * fingerprint - digest of inputs the fact has been collected from
+  * message - the produced message (as dumped by Model.dump())
+"""
+
+SNAPSHOT_FORMAT = 1
+
+_repository_version = {}
+
+
+def is_rescan_forced():
+    """
+    Return True if all facts must be collected again, ignoring snapshots of previous executions
+
+    The full rescan is requested by `leapp preupgrade|upgrade --full-rescan`
+    or by (envar) `LEAPP_FULL_FACTS_RESCAN=1`.
+    """
+    return get_env('LEAPP_FULL_FACTS_RESCAN', '0') == '1'
+
+
+def _get_repository_version():
+    """
+    Return the version of installed leapp-repository packages, None when they are not installed
+
+    Collectors of facts (and models) can change with an update of
+    leapp-repository, so snapshots created by another version are not reused.
+    When leapp-repository is not installed from packages (e.g. during
+    development), use the full rescan after the code is changed.
+    """
+    if 'version' not in _repository_version:
+        cmd = ['rpm', '-q'] + rpms.get_leapp_packages(component=[rpms.LeappComponents.REPOSITORY])
+        try:
+            _repository_version['version'] = run(cmd, split=False)['stdout'].strip()
+        except (CalledProcessError, OSError, ValueError) as e:
+            api.current_logger().debug('Cannot get the version of leapp-repository: {}'.format(str(e)))
+            _repository_version['version'] = None
+    return _repository_version['version']
+
+
+def _stat_entry(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None]
+    return [path, st.st_ino, st.st_size, st.st_mtime]
+
+
+def get_fingerprint(paths):
+    """
+    Return the digest of the current state of given input files and directories
+
+    Files are described by their inode, size and mtime. The same is used for
+    directories and for each of their direct entries, so adding, removing
+    or modifying a file inside the directory changes the fingerprint.
+    Missing paths are part of the fingerprint as well.
+
+    :param paths: Paths to files or directories the fact is collected from.
+    :type paths: List[str]
+    :rtype: str
+    """
+    entries = []
+    for path in paths:
+        entries.append(_stat_entry(path))
+        if os.path.isdir(path):
+            entries.extend(_stat_entry(os.path.join(path, name)) for name in sorted(os.listdir(path)))
+    return hashlib.sha256(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _get_snapshot_path(name, snapshot_dir):
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, '{}.json'.format(name))
+
+
+def load_snapshot(name, fingerprint, model, snapshot_dir=None):
+    """
+    Return the message stored by a previous execution if it has been collected from the same inputs
+
+    Return None when there is no usable snapshot (missing, broken, created
+    from different inputs, by another version of leapp-repository or not
+    matching the current definition of the model).
+    """
+    try:
+        with open(_get_snapshot_path(name, snapshot_dir)) as f:
+            snapshot = json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+    if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('fingerprint') != fingerprint:
+        return None
+    if snapshot.get('repository_version') != _get_repository_version():
+        return None
+    try:
+        return model.create(snapshot['message'])
+    except Exception as e:  # pylint: disable=broad-except
+        # e.g. the model has been changed by an update of leapp-repository
+        api.current_logger().debug('Cannot reuse the snapshot of {} facts: {}'.format(name, str(e)))
+        return None
+
+
+def store_snapshot(name, fingerprint, message, snapshot_dir=None):
+    """
+    Store the message collected from inputs with the given fingerprint for next executions
+    """
+    path = _get_snapshot_path(name, snapshot_dir)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                'format': SNAPSHOT_FORMAT,
+                'repository_version': _get_repository_version(),
+                'fingerprint': fingerprint,
+                'message': message.dump(),
+            }, f)
+        os.rename(path + '.tmp', path)
+    except (OSError, IOError) as e:
+        api.current_logger().warning('Cannot store the snapshot of {} facts: {}'.format(name, str(e)))
+
+
+def reuse_or_collect(name, paths, model, collector, snapshot_dir=None):
+    """
+    Return the fact collected by a previous execution if its inputs have not changed, collect it otherwise
+
+    Intended for facts that are expensive to collect while they rarely change
+    between repeated executions of leapp (e.g. when inhibitors are being
+    resolved). The fact must be fully determined by the given input paths
+    and the collector must not have side effects (e.g. must not produce
+    reports), as they are not replayed when the snapshot is reused.
+
+    :param name: Name of the snapshot.
+    :type name: str
+    :param paths: Paths to files or directories the fact is collected from (see `get_fingerprint`).
+    :type paths: List[str]
+    :param model: The model of the collected message.
+    :param collector: Function with no arguments returning the message of the given model.
+    :return: The message of the given model.
+    """
+    fingerprint = get_fingerprint(paths)
+    if not is_rescan_forced():
+        message = load_snapshot(name, fingerprint, model, snapshot_dir)
+        if message is not None:
+            api.current_logger().debug('Inputs of {} facts have not changed. Reusing the previous snapshot.'.format(
+                name))
+            return message
+    message = collector()
+    store_snapshot(name, fingerprint, message, snapshot_dir)
+    return message
@@ -0,0 +1,139 @@
+import errno
+import json
+import os
+import shutil
+
+from leapp.libraries.common import mounting
+from leapp.libraries.stdlib import api
+
+METADATA_CACHE_DIR = '/var/lib/leapp/dnf-metadata-cache'
+"""
+DNF cache directory shared by all DNF executions working with target repositories.
+
+The directory is owned by leapp and it is bind-mounted as /var/cache/dnf into
+the target userspace container (and under the installroot when the container
+is created), so all DNF executions see the same snapshot of metadata of target
+repositories. Metadata are refreshed once per leapp execution (see
+`pin_metadata`). Packages downloaded for the upgrade are stored here as well
+and they are removed together with the target userspace container.
+"""
+
+CONTAINER_CACHE_DIR = '/var/cache/dnf'
+"""Path to the DNF cache inside the target userspace container."""
+
+PIN_RECORD_FILE = '.leapp_metadata_pin.json'
+"""
+Name of the file describing metadata pinned for the current leapp execution.
+
+The record contains:
+  * execution_id - the leapp execution the metadata have been refreshed by
+  * repoids - repositories with refreshed metadata
+"""
+
+
+def _get_execution_id():
+    return os.environ.get('LEAPP_EXECUTION_ID', None)
+
+
+def _get_record_path(cache_dir):
+    return os.path.join(cache_dir, PIN_RECORD_FILE)
+
+
+def create_cache_dir(cache_dir=METADATA_CACHE_DIR):
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def get_bind(cache_dir=METADATA_CACHE_DIR):
+    """
+    Return the systemd-nspawn bind of the cache into the target userspace container.
+
+    :rtype: str
+    """
+    create_cache_dir(cache_dir)
+    return '{}:{}'.format(cache_dir, CONTAINER_CACHE_DIR)
+
+
+def bind_mount(installroot, cache_dir=METADATA_CACHE_DIR):
+    """
+    Return the bind mount of the cache into the given (host) path of an installroot.
+
+    :param installroot: Path to the installroot (e.g. the target userspace
+                        container mounted inside the scratch container).
+    :type installroot: str
+    :rtype: mounting.BindMount
+    """
+    create_cache_dir(cache_dir)
+    return mounting.BindMount(source=cache_dir, target=os.path.join(installroot, CONTAINER_CACHE_DIR.lstrip('/')))
+
+
+def pin_metadata(repoids, cache_dir=METADATA_CACHE_DIR):
+    """
+    Pin the just refreshed metadata of given repositories for the current leapp execution.
+
+    DNF executions during the current leapp execution do not refresh pinned
+    metadata anymore (see `get_pinned_repoids`), so all of them work with
+    the same snapshot of repositories. Next leapp execution refreshes
+    the metadata again.
+    """
+    if not _get_execution_id():
+        api.current_logger().debug('Unknown leapp execution. Metadata of repositories are not pinned.')
+        return
+    with open(_get_record_path(cache_dir), 'w') as f:
+        json.dump({'execution_id': _get_execution_id(), 'repoids': sorted(set(repoids))}, f, sort_keys=True, indent=2)
+
+
+def unpin_metadata(cache_dir=METADATA_CACHE_DIR):
+    try:
+        os.unlink(_get_record_path(cache_dir))
+    except OSError:
+        pass
+
+
+def get_pinned_repoids(repoids, cache_dir=METADATA_CACHE_DIR):
+    """
+    Return repoids (from the given ones) with metadata pinned for the current leapp execution.
+
+    :param repoids: Repoids of repositories to be used by DNF.
+    :type repoids: List[str]
+    :rtype: List[str]
+    """
+    try:
+        with open(_get_record_path(cache_dir)) as f:
+            record = json.load(f)
+    except (OSError, IOError, ValueError):
+        return []
+    if not _get_execution_id() or record.get('execution_id') != _get_execution_id():
+        return []
+    return sorted(set(repoids) & set(record.get('repoids', [])))
+
+
+def get_pinning_setopts(repoids, cache_dir=METADATA_CACHE_DIR):
+    """
+    Return DNF options preventing the refresh of pinned metadata of given repositories.
+
+    The option is set per repository, as the expiration set in repository
+    files takes precedence over the main configuration.
+
+    :rtype: List[str]
+    """
+    return ['--setopt={}.metadata_expire=-1'.format(repoid) for repoid in get_pinned_repoids(repoids, cache_dir)]
+
+
+def remove_packages(cache_dir=METADATA_CACHE_DIR):
+    """
+    Remove downloaded packages from the cache, keeping metadata of repositories.
+    """
+    try:
+        entries = os.listdir(cache_dir)
+    except OSError:
+        return
+    for entry in entries:
+        shutil.rmtree(os.path.join(cache_dir, entry, 'packages'), ignore_errors=True)
+
+
+def remove_cache(cache_dir=METADATA_CACHE_DIR):
+    shutil.rmtree(cache_dir, ignore_errors=True)
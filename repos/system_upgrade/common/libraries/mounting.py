@@ -1,7 +1,15 @@
+import contextlib
+import ctypes
+import ctypes.util
 import errno
+import fcntl
 import itertools
 import os
 import shutil
+import signal
+import struct
+import subprocess
+import time
 from collections import namedtuple
 
 from leapp.libraries.common.config import get_all_envs
@@ -15,6 +23,31 @@ ALWAYS_BIND = []
 
 ErrorData = namedtuple('ErrorData', ['summary', 'details'])
 
+# flags for the mount(2) and umount2(2) syscalls
+MS_BIND = 4096
+MNT_FORCE = 1
+MNT_DETACH = 2
+
+# ioctls & flags to set up loop devices (linux/loop.h)
+LOOP_SET_FD = 0x4C00
+LOOP_CLR_FD = 0x4C01
+LOOP_SET_STATUS64 = 0x4C04
+LOOP_CTL_GET_FREE = 0x4C82
+LO_FLAGS_AUTOCLEAR = 4
+_LOOP_INFO64_FMT = '=QQQQQIIII64s64s32sQQ'
+""" struct loop_info64 """
+_LOOP_ATTACH_ATTEMPTS = 16
+
+_LIBC = []
+""" Cache for the loaded libc library - empty list means it has not been loaded yet """
+
+_SESSION_LEADER_CMD = ['sleep', 'infinity']
+""" Command executed as the PID 1 of a systemd-nspawn session container """
+_SESSION_TIMEOUT = 30
+""" Time (in seconds) to wait for the start or the stop of a systemd-nspawn session container """
+_NSPAWN_PATH = '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin'
+""" PATH set by systemd-nspawn inside the container """
+
 
 class MountingMode(object):
     """
@@ -41,6 +74,160 @@ def _makedirs(path, mode=0o777, exists_ok=True):
             raise
 
 
+def _get_libc():
+    """
+    Return the libc library to perform mount syscalls directly or None if it is not available.
+    """
+    if not _LIBC:
+        libc = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.mount.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p)
+            libc.umount2.argtypes = (ctypes.c_char_p, ctypes.c_int)
+        except (OSError, AttributeError):
+            api.current_logger().debug('Cannot load libc, mount binaries will be used instead.', exc_info=True)
+            libc = None
+        _LIBC.append(libc)
+    return _LIBC[0]
+
+
+def _encode(value):
+    if value is None:
+        return None
+    return value.encode('utf-8') if not isinstance(value, bytes) else value
+
+
+def _syscall_mount(source, target, fstype, flags, data):
+    """
+    Call mount(2) directly. Raise OSError on failure or when libc is not available.
+    """
+    libc = _get_libc()
+    if not libc:
+        raise OSError(errno.ENOSYS, 'libc is not available')
+    if libc.mount(_encode(source), _encode(target), _encode(fstype), flags, _encode(data)) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _syscall_umount(target, flags):
+    """
+    Call umount2(2) directly. Raise OSError on failure or when libc is not available.
+    """
+    libc = _get_libc()
+    if not libc:
+        raise OSError(errno.ENOSYS, 'libc is not available')
+    if libc.umount2(_encode(target), flags) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _attach_loop_device(image):
+    """
+    Attach the image to a free loop device with the autoclear flag set.
+
+    Return the path to the loop device and its open file descriptor. The loop
+    device is released automatically once the descriptor is closed and the
+    device is not used anymore (e.g. by a mount). So the descriptor must stay
+    open until the device is mounted.
+
+    :raises: OSError or IOError when the loop device cannot be set up.
+    """
+    ctl_fd = os.open('/dev/loop-control', os.O_RDWR)
+    try:
+        image_fd = os.open(image, os.O_RDWR)
+        try:
+            for dummy_attempt in range(_LOOP_ATTACH_ATTEMPTS):
+                device = '/dev/loop{}'.format(fcntl.ioctl(ctl_fd, LOOP_CTL_GET_FREE))
+                device_fd = os.open(device, os.O_RDWR)
+                try:
+                    fcntl.ioctl(device_fd, LOOP_SET_FD, image_fd)
+                except (OSError, IOError) as e:
+                    os.close(device_fd)
+                    if e.errno == errno.EBUSY:
+                        # the free device has been taken by someone else meanwhile
+                        continue
+                    raise
+                info = struct.pack(
+                    _LOOP_INFO64_FMT, 0, 0, 0, 0, 0, 0, 0, 0, LO_FLAGS_AUTOCLEAR,
+                    _encode(image)[:63], b'', b'', 0, 0)
+                try:
+                    fcntl.ioctl(device_fd, LOOP_SET_STATUS64, info)
+                except (OSError, IOError):
+                    fcntl.ioctl(device_fd, LOOP_CLR_FD, 0)
+                    os.close(device_fd)
+                    raise
+                return device, device_fd
+            raise OSError(errno.EBUSY, 'Cannot find a free loop device')
+        finally:
+            os.close(image_fd)
+    finally:
+        os.close(ctl_fd)
+
+
+def _remove_path(path):
+    """ Remove the path (recursively for directories) in-process, ignoring the non-existing path """
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+    except EnvironmentError as e:
+        if e.errno != errno.ENOENT:
+            api.current_logger().warning('Removing mount directory %s failed with: %s', path, str(e))
+
+
+def umount_lazy(target):
+    """
+    Perform the forced lazy unmount of the target including all mounts below it.
+
+    The umount2(2) syscall is called directly if possible, otherwise
+    the umount binary is executed. Errors are logged and ignored.
+
+    :param target: Path to the mountpoint
+    :type target: str
+    """
+    if not os.path.ismount(target):
+        return
+    try:
+        _syscall_umount(target, MNT_FORCE | MNT_DETACH)
+        return
+    except OSError as e:
+        api.current_logger().debug('umount2 syscall for %s failed with: %s. Calling umount.', target, str(e))
+    try:
+        run(['umount', '-fl', target], split=False)
+    except (OSError, CalledProcessError) as e:
+        api.current_logger().warning('Unmounting %s failed with: %s', target, str(e))
+
+
+def get_topmost_targets(targets):
+    """
+    Return targets that are not placed inside any other of given targets, keeping the order.
+
+    :param targets: Paths to mountpoints
+    :type targets: list(str)
+    :rtype: list(str)
+    """
+    return [
+        target for target in targets
+        if not any(target.startswith(os.path.join(other, '')) for other in targets if other != target)
+    ]
+
+
+def umount_all_lazy(targets):
+    """
+    Unmount all given mount targets by forced lazy unmounts of the topmost targets only.
+
+    As the lazy unmount detaches also all mounts below the target, there is
+    no need to unmount the nested targets one by one. Targets are unmounted
+    in the reversed order.
+
+    :param targets: Paths to mountpoints in the order they have been mounted
+    :type targets: list(str)
+    """
+    for target in reversed(get_topmost_targets(targets)):
+        umount_lazy(target)
+
+
 class MountError(Exception):
     """ Exception that is thrown when a mount related operation failed """
 
@@ -49,6 +236,108 @@ class MountError(Exception):
         self.details = details
 
 
+def _get_ppid(pid):
+    """ Return the parent PID of the given process """
+    with open('/proc/{}/stat'.format(pid)) as f:
+        # the command name (2nd field) is in parentheses and can contain spaces
+        return int(f.read().rsplit(')', 1)[1].split()[1])
+
+
+class NspawnSession(object):
+    """
+    A long-lived systemd-nspawn container executing commands via nsenter
+
+    Booting a container for every executed command is expensive. The session
+    starts the container once (executing just `sleep infinity` as its PID 1)
+    and subsequent commands are executed inside namespaces of the container
+    by nsenter, with the same environment as systemd-nspawn sets.
+
+    Mounts are set up when the container is started. So mounts performed on
+    the host under the container root directory after the start of the
+    session do not have to be visible inside the container.
+    """
+
+    def __init__(self, nspawn_cmd, env_vars):
+        self.nspawn_cmd = nspawn_cmd
+        self.env_vars = env_vars
+        self.leader_pid = None
+        self._process = None
+
+    def _find_leader(self):
+        """ Return the host PID of the container PID 1 once it executes the leader command, None otherwise """
+        expected_cmdline = [_encode(arg) for arg in _SESSION_LEADER_CMD]
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                if _get_ppid(entry) != self._process.pid:
+                    continue
+                with open('/proc/{}/cmdline'.format(entry), 'rb') as f:
+                    cmdline = f.read().split(b'\0')[:-1]
+            except (OSError, IOError, IndexError, ValueError):
+                # the process has finished meanwhile
+                continue
+            if cmdline == expected_cmdline:
+                return int(entry)
+        return None
+
+    def _wait(self, timeout):
+        """ Wait for the systemd-nspawn process to finish. Return True if it finished in time. """
+        deadline = time.time() + timeout
+        while self._process.poll() is None:
+            if time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def start(self):
+        """
+        Start the container and wait until it is ready to execute commands
+
+        :raises: OSError when the container cannot be started.
+        """
+        with open(os.devnull, 'r+') as devnull:
+            self._process = subprocess.Popen(
+                self.nspawn_cmd + _SESSION_LEADER_CMD, stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True)
+        deadline = time.time() + _SESSION_TIMEOUT
+        while time.time() < deadline:
+            if self._process.poll() is not None:
+                exit_code = self._process.returncode
+                self._process = None
+                raise OSError(errno.ECHILD, 'systemd-nspawn exited with {}'.format(exit_code))
+            self.leader_pid = self._find_leader()
+            if self.leader_pid:
+                return
+            time.sleep(0.05)
+        self.stop()
+        raise OSError(errno.ETIMEDOUT, 'The systemd-nspawn container has not been started in time')
+
+    def stop(self):
+        """ Kill all processes inside the container and wait for systemd-nspawn to finish """
+        if not self._process:
+            return
+        if self.leader_pid:
+            try:
+                # killing PID 1 of the container kills all processes inside its PID namespace
+                os.kill(self.leader_pid, signal.SIGKILL)
+            except OSError:
+                pass
+        if not self._wait(_SESSION_TIMEOUT):
+            api.current_logger().warning('The systemd-nspawn session has not finished in time. Killing it.')
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+        self.leader_pid = None
+
+    def make_command(self, cmd):
+        """ Transform the command to be executed inside the running container """
+        setenvs = ['{}={}'.format(env.name, env.value) for env in self.env_vars]
+        return [
+            'nsenter', '--target', str(self.leader_pid), '--mount', '--uts', '--ipc', '--pid', '--root', '--wd', '--',
+            'env', '-i', 'PATH={}'.format(_NSPAWN_PATH), 'container=systemd-nspawn', 'HOME=/root',
+        ] + setenvs + cmd
+
+
 class IsolationType(object):
     """ Implementations for the different isolated actions types """
     class _Implementation(object):
@@ -69,6 +358,18 @@ class IsolationType(object):
             """ Transform the given command to the isolated environment """
             return cmd
 
+        def start_session(self):
+            """
+            Start executing commands in one long-lived isolated environment, if supported
+
+            Return True if a new session has been started.
+            """
+            return False
+
+        def stop_session(self):
+            """ Stop the session started by start_session """
+            pass
+
     class NSPAWN(_Implementation):
         """ systemd-nspawn implementation """
 
@@ -76,8 +377,40 @@ class IsolationType(object):
             super(IsolationType.NSPAWN, self).__init__(target=target)
             self.binds = list(binds) + ALWAYS_BIND
             self.env_vars = env_vars or get_all_envs()
+            self.session = None
+
+        def start_session(self):
+            """ Start the systemd-nspawn container once; commands are executed inside it via nsenter """
+            if self.session:
+                return False
+            session = NspawnSession(self._make_nspawn_command([]), self.env_vars)
+            try:
+                session.start()
+            except OSError as e:
+                api.current_logger().warning(
+                    'Cannot start the systemd-nspawn session for %s: %s. Booting a container for each command.',
+                    self.target, str(e))
+                return False
+            self.session = session
+            return True
+
+        def stop_session(self):
+            """ Stop the running systemd-nspawn container """
+            if self.session:
+                self.session.stop()
+            self.session = None
+
+        def close(self):
+            """ Stop the session if running """
+            self.stop_session()
 
         def make_command(self, cmd):
+            """ Transform the command to be executed with systemd-nspawn or inside the running session """
+            if self.session:
+                return self.session.make_command(cmd)
+            return self._make_nspawn_command(cmd)
+
+        def _make_nspawn_command(self, cmd):
             """ Transform the command to be executed with systemd-nspawn """
             binds = ['--bind={}'.format(bind) for bind in self.binds]
             setenvs = ['--setenv={}={}'.format(env.name, env.value) for env in self.env_vars]
@@ -167,6 +500,35 @@ class IsolatedActions(object):
         """ Running the given command using the leapp.libraries.stdlib.run function in a isolated manner. """
         return run(self.type.make_command(cmd), *args, **kwargs)
 
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Execute all commands called within the context in one long-lived isolated environment.
+
+        Used to speed up series of (short) commands. For systemd-nspawn,
+        the container is started just once instead of booting it for each
+        command. The behaviour of the call method is not changed otherwise.
+        In case the session cannot be started, each command is executed
+        in a new isolated environment as usual.
+
+        .. warning::
+            Mounts under the base_dir performed on the host within the
+            context do not have to be visible to executed commands. Perform
+            all mounts before entering the context.
+
+        Usage::
+
+            with context.session():
+                for path in paths:
+                    context.call(['rpm', '-qf', path])
+        """
+        started = self.type.start_session()
+        try:
+            yield self
+        finally:
+            if started:
+                self.type.stop_session()
+
     def remove(self, path):
         """
         Removes the given file as it would be on the real system.
@@ -306,6 +668,28 @@ class MountingBase(object):
         """
         return ['-o', self._mode, self.source]
 
+    def _syscall_options(self):
+        """
+        Arguments (source, fstype, flags, data) for the mount(2) syscall
+
+        Return None in case the mount cannot be done by the syscall directly
+        (e.g. loop mounts) and the mount binary has to be used instead.
+        Individual implementations may override this function.
+        """
+        return None
+
+    def _do_mount(self):
+        """ Mount the source to the target. Use the mount(2) syscall if possible, the mount binary otherwise. """
+        syscall_options = self._syscall_options()
+        if syscall_options:
+            try:
+                _syscall_mount(syscall_options[0], self.target, *syscall_options[1:])
+                return
+            except OSError as e:
+                api.current_logger().debug(
+                    'mount syscall for %s failed with: %s. Calling mount.', self.target, str(e))
+        run(['mount'] + self._mount_options() + [self.target], split=False)
+
     def chroot(self):
         """ Create a ChrootActions instance for this mount """
         return ChrootActions(self.target)
@@ -320,11 +704,8 @@ class MountingBase(object):
 
     def _cleanup(self):
         """ Cleanup operations """
-        if os.path.exists(self.target) and os.path.ismount(self.target):
-            try:
-                run(['umount', '-fl', self.target], split=False)
-            except (OSError, CalledProcessError) as e:
-                api.current_logger().warning('Unmounting %s failed with: %s', self.target, str(e))
+        if os.path.exists(self.target):
+            umount_lazy(self.target)
         for directory in itertools.chain(self.additional_directories, (self.target,)):
             try:
                 run(['rm', '-rf', directory], split=False)
@@ -344,7 +725,7 @@ class MountingBase(object):
             except (OSError) as e:
                 raise MountError('Failed to create mount target directory {}'.format(directory), str(e))
         try:
-            run(['mount'] + self._mount_options() + [self.target], split=False)
+            self._do_mount()
         except (OSError, CalledProcessError) as e:
             api.current_logger().warning('Mounting %s failed with: %s', self.target, str(e), exc_info=True)
             raise MountError(
@@ -380,10 +761,33 @@ class NullMount(MountingBase):
 
 
 class LoopMount(MountingBase):
-    """ Performs loop mounts """
+    """
+    Performs loop mounts
 
-    def __init__(self, source, target, config=MountConfig.Mount):
+    When the file system type is known, the loop device is set up and
+    mounted directly by syscalls. Otherwise the mount binary is used
+    to detect the file system type.
+    """
+
+    def __init__(self, source, target, config=MountConfig.Mount, fstype=None):
         super(LoopMount, self).__init__(source=source, target=target, mode=MountingMode.LOOP, config=config)
+        self.fstype = fstype
+
+    def _do_mount(self):
+        if self.fstype:
+            try:
+                device, device_fd = _attach_loop_device(self.source)
+                try:
+                    _syscall_mount(device, self.target, self.fstype, 0, None)
+                    return
+                finally:
+                    # the loop device is released automatically when it is
+                    # not used anymore (e.g. after unmount or failed mount)
+                    os.close(device_fd)
+            except (OSError, IOError) as e:
+                api.current_logger().debug(
+                    'Direct loop mount of %s failed with: %s. Calling mount.', self.target, str(e))
+        run(['mount'] + self._mount_options() + [self.target], split=False)
 
 
 class BindMount(MountingBase):
@@ -392,6 +796,9 @@ class BindMount(MountingBase):
     def __init__(self, source, target, config=MountConfig.Mount):
         super(BindMount, self).__init__(source=source, target=target, mode=MountingMode.BIND, config=config)
 
+    def _syscall_options(self):
+        return (self.source, None, MS_BIND, None)
+
 
 class TypedMount(MountingBase):
     """ Performs a typed mounts """
@@ -406,6 +813,9 @@ class TypedMount(MountingBase):
             self.source
         ]
 
+    def _syscall_options(self):
+        return (self.source, self.fstype, 0, None)
+
 
 class OverlayMount(MountingBase):
     """ Performs an overlayfs mount """
@@ -417,12 +827,102 @@ class OverlayMount(MountingBase):
         self._work_dir = os.path.join(workdir, 'work')
         self.additional_directories = (self._upper_dir, self._work_dir)
 
+    def _overlay_data(self):
+        return 'lowerdir={},upperdir={},workdir={}'.format(self.source, self._upper_dir, self._work_dir)
+
     def _mount_options(self):
         return [
             '-t', 'overlay', 'overlay2',
-            '-o', 'lowerdir={},upperdir={},workdir={}'.format(self.source, self._upper_dir, self._work_dir)
+            '-o', self._overlay_data()
         ]
 
+    def _syscall_options(self):
+        return ('overlay2', 'overlay', 0, self._overlay_data())
+
+
+class MountOrchestrator(object):
+    """
+    Performs a flat list of mount operations and unmounts them all at once
+
+    Instead of nesting one context manager per mount, all mounts are passed
+    as a flat list and mounted in the given order (mounts placed inside
+    targets of previous mounts have to follow them in the list). Each mount
+    is performed by the mount(2) syscall when possible, falling back to
+    the mount binary.
+
+    Performed mounts are tracked on a stack. On teardown (or when any mount
+    fails) the stack is unwound by forced lazy unmounts of the topmost mount
+    targets only, as the lazy unmount detaches also all mounts below
+    the target. When the `root` directory is specified, a tmpfs is mounted
+    there first, so all mounts placed inside the root are detached by one
+    lazy unmount. Finally, directories of unmounted targets are removed,
+    in the same way as `MountingBase` does.
+
+    Configuration of individual mounts is ignored, the orchestrator performs
+    all operations.
+    """
+
+    def __init__(self, mounts, root=None):
+        self.root = root
+        self.mounts = list(mounts)
+        if root:
+            self.mounts.insert(0, TypedMount(fstype='tmpfs', source='tmpfs', target=root))
+        self._stack = []
+
+    @property
+    def targets(self):
+        """ Targets of performed mounts in the order they have been mounted """
+        return [mount.target for mount in self._stack]
+
+    def _remove_directories(self, mount):
+        for directory in itertools.chain(mount.additional_directories, (mount.target,)):
+            _remove_path(directory)
+
+    def _mount(self, mount):
+        umount_lazy(mount.target)
+        self._remove_directories(mount)
+        for directory in itertools.chain(mount.additional_directories, (mount.target,)):
+            try:
+                _makedirs(directory, exists_ok=True)
+            except OSError as e:
+                raise MountError('Failed to create mount target directory {}'.format(directory), str(e))
+        try:
+            mount._do_mount()
+        except (OSError, CalledProcessError) as e:
+            api.current_logger().warning('Mounting %s failed with: %s', mount.target, str(e), exc_info=True)
+            raise MountError(
+                message='Mount operation with mode {} from {} to {} failed: {}'.format(
+                    mount._mode, mount.source, mount.target, str(e)),
+                details=None)
+
+    def mount(self):
+        """ Perform all mounts in the given order. Unmount everything in case of an error. """
+        for mount in self.mounts:
+            if isinstance(mount, NullMount):
+                continue
+            try:
+                self._mount(mount)
+            except MountError:
+                self.umount()
+                raise
+            self._stack.append(mount)
+        return self
+
+    def umount(self):
+        """ Unmount all performed mounts by lazy unmounts of the topmost targets """
+        topmost = get_topmost_targets(self.targets)
+        umount_all_lazy(topmost)
+        for mount in reversed(self._stack):
+            if mount.target in topmost:
+                self._remove_directories(mount)
+        self._stack = []
+
+    def __enter__(self):
+        return self.mount()
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.umount()
+
 
 def mount_upgrade_iso_to_root_dir(root_dir, target_iso):
     """
@@ -1,10 +1,13 @@
 import contextlib
+import json
+import multiprocessing
 import os
 import shutil
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 from leapp.exceptions import StopActorExecutionError
-from leapp.libraries.common import mounting, utils
+from leapp.libraries.common import metadatacache, mounting, spaceplanner, utils
 from leapp.libraries.common.config import get_env
 from leapp.libraries.common.config.version import get_target_major_version
 from leapp.libraries.stdlib import api, CalledProcessError, run
@@ -68,6 +71,25 @@ this constant.
 """
 
 
+_MAX_DEFAULT_IMG_WORKERS = 8
+"""
+Upper limit of workers creating disk images in parallel when not set explicitly.
+
+Creation of a disk image is bounded mainly by the formatting of the image,
+which is I/O heavy. So the default number of workers is derived from the
+number of CPUs but kept reasonably low to not overload the storage.
+The number can be set explicitly by the LEAPP_OVL_IMG_WORKERS envar.
+"""
+
+
+CONTAINER_SIZE_FILE = '.leapp_container_size.json'
+"""
+Name of the file (stored inside the target userspace container) with the recorded size of the container.
+
+See `track_container_size` for more details.
+"""
+
+
 MountPoints = namedtuple('MountPoints', ['fs_file', 'fs_vfstype'])
 
 
@@ -90,9 +112,15 @@ def get_recommended_leapp_free_space(userspace_path=None):
     by OAMG group in github.com/oamg/leapp-repository. This function can be
     changed in future, ignoring the deprecation process.
 
-    TODO(pstodulk): this is so far the best trade off between stay safe and do
-    do not consume too much space. But need to figure out cost of the time
-    consumption.
+    The size of the container is walked just once and then it is tracked
+    by actions wrapped in `track_container_size`. See the function for
+    more details.
+
+    When the upgrade transaction has been resolved already, the space plan
+    of the transaction is used instead of the minimal container size. In
+    such a case, the returned value is the remaining expected growth of the
+    container (download of packages, upgrade initramfs). See the
+    `spaceplanner` library for more details.
 
     TODO(pstodulk): check we are not negatively affected in case of downloaded
     rpms. We want to prevent situations when we say that customer has enough
@@ -109,11 +137,7 @@ def get_recommended_leapp_free_space(userspace_path=None):
     if not userspace_path or not os.path.exists(userspace_path):
         return min_cont_size
     try:
-        # ignore symlinks and other partitions to be sure we calculate the space
-        # in reasonable time
-        cont_size = run(['du', '-sPmx', userspace_path])['stdout'].split()[0]
-        # the obtained number is in KiB. But we want to work with MiBs rather.
-        cont_size = int(cont_size)
+        cont_size = _get_container_size(userspace_path)
     except (OSError, CalledProcessError):
         # do not care about failed cmd, in such a case, just act like userspace_path
         # has not been set
@@ -130,7 +154,12 @@ def get_recommended_leapp_free_space(userspace_path=None):
             .format(cont_size, min_cont_size)
         )
         return min_cont_size
-    prot_size = min_cont_size - cont_size
+    plan = spaceplanner.load_space_plan(userspace_path)
+    if plan and plan.container_size is not None:
+        grown = max(0, cont_size - plan.container_size)
+        prot_size = spaceplanner.get_container_growth(plan) - grown
+    else:
+        prot_size = min_cont_size - cont_size
     if prot_size < _MAGICAL_CONSTANT_MIN_PROTECTED_SIZE:
         api.current_logger().debug(
             'The size of the container is higher than the expected default.'
@@ -141,6 +170,167 @@ def get_recommended_leapp_free_space(userspace_path=None):
     return prot_size
 
 
+def _container_size_file(userspace_path):
+    return os.path.join(userspace_path, CONTAINER_SIZE_FILE)
+
+
+def _get_container_id(userspace_path):
+    # the record is valid only for the container it has been created for;
+    # identify the container by the device and inode of its root directory
+    stat = os.stat(userspace_path)
+    return [stat.st_dev, stat.st_ino]
+
+
+def _get_used_space(path):
+    """
+    Return the space (in bytes) consumed on the filesystem hosting the given path.
+    """
+    stat = os.statvfs(path)
+    return (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+
+
+def _get_tree_used_space(path, device):
+    """
+    Return the space (in bytes) consumed by the directory tree on the given device.
+
+    Other filesystems mounted inside the tree are skipped and hardlinked files
+    are counted just once.
+    """
+    seen = set()
+    used = 0
+    for root, dirs, files in os.walk(path):
+        entries = [os.path.join(root, name) for name in dirs + files]
+        if root == path:
+            entries.append(root)
+        other_devices = set()
+        for entry in entries:
+            try:
+                stat = os.lstat(entry)
+            except OSError:
+                # removed in the meanwhile
+                continue
+            if stat.st_dev != device:
+                other_devices.add(os.path.basename(entry))
+            elif stat.st_ino not in seen:
+                seen.add(stat.st_ino)
+                used += stat.st_blocks * 512
+        dirs[:] = [name for name in dirs if name not in other_devices]
+    return used
+
+
+def _get_excluded_used_space(userspace_path, excluded_dirs):
+    """
+    Return the space (in bytes) consumed by leapp data stored outside of the container on the same filesystem.
+    """
+    device = os.stat(userspace_path).st_dev
+    return sum(_get_tree_used_space(path, device) for path in excluded_dirs if os.path.isdir(path))
+
+
+def _load_container_size(userspace_path):
+    try:
+        with open(_container_size_file(userspace_path)) as f:
+            record = json.load(f)
+        if record.get('container_id') != _get_container_id(userspace_path):
+            return None
+        return int(record['size'])
+    except (OSError, IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _store_container_size(userspace_path, size):
+    record = {'container_id': _get_container_id(userspace_path), 'size': size}
+    try:
+        with open(_container_size_file(userspace_path), 'w') as f:
+            json.dump(record, f)
+    except (OSError, IOError) as e:
+        # not critical; the size is calculated again next time
+        api.current_logger().debug(
+            'Cannot store the size of the container {}: {}'.format(userspace_path, str(e))
+        )
+
+
+def invalidate_container_size(userspace_path):
+    """
+    Drop the recorded size of the container so it is calculated again when needed.
+
+    Call it when the container is modified outside of `track_container_size`.
+    """
+    try:
+        os.unlink(_container_size_file(userspace_path))
+    except OSError:
+        pass
+
+
+def _get_container_size(userspace_path):
+    """
+    Return the size of the container in MiB.
+
+    The recorded size is used when available. Otherwise the container is walked
+    and the result is recorded for next calls.
+
+    Raises OSError or CalledProcessError if the size cannot be obtained.
+    """
+    cont_size = _load_container_size(userspace_path)
+    if cont_size is not None:
+        return cont_size
+    # ignore symlinks and other partitions to be sure we calculate the space
+    # in reasonable time
+    cont_size = run(['du', '-sPmx', userspace_path])['stdout'].split()[0]
+    # the obtained number is in KiB. But we want to work with MiBs rather.
+    cont_size = int(cont_size)
+    if cont_size >= 0:
+        _store_container_size(userspace_path, cont_size)
+    return cont_size
+
+
+@contextlib.contextmanager
+def track_container_size(userspace_path, excluded_dirs=()):
+    """
+    Keep the recorded size of the container up to date with the wrapped action.
+
+    The space consumed on the filesystem hosting the container is measured
+    before and after the action and the difference is added to the recorded
+    size of the container. So the container does not need to be walked again
+    by `get_recommended_leapp_free_space` after e.g. download of packages.
+
+    Leapp data stored outside of the container are written during the action
+    as well: the shared DNF cache with downloaded packages (see the
+    metadatacache library) and the `excluded_dirs` (e.g. the scratch
+    directory with disk images of the source overlay). These directories
+    are walked (they contain just a few files) and their growth is not
+    counted. Other processes writing to the same filesystem (e.g. logs,
+    the leapp database) can still affect the measured size slightly.
+
+    In case the wrapped action fails, the record is invalidated.
+
+    :param userspace_path: Path to the userspace container.
+    :type userspace_path: str
+    :param excluded_dirs: Directories outside of the container written during the action.
+    :type excluded_dirs: Iterable[str]
+    """
+    excluded_dirs = [metadatacache.METADATA_CACHE_DIR] + list(excluded_dirs)
+    try:
+        cont_size = _get_container_size(userspace_path)
+        used_before = _get_used_space(userspace_path) - _get_excluded_used_space(userspace_path, excluded_dirs)
+    except (OSError, CalledProcessError):
+        # the size is calculated from scratch when needed
+        invalidate_container_size(userspace_path)
+        yield
+        return
+    try:
+        yield
+    except BaseException:
+        invalidate_container_size(userspace_path)
+        raise
+    try:
+        used_after = _get_used_space(userspace_path) - _get_excluded_used_space(userspace_path, excluded_dirs)
+        delta = max(0, used_after - used_before) // (1024 * 1024)
+    except OSError:
+        invalidate_container_size(userspace_path)
+        return
+    _store_container_size(userspace_path, cont_size + delta)
+
+
 def _get_fspace(path, convert_to_mibs=False, coefficient=1):
     """
     Return the free disk space on given path.
@@ -196,6 +386,76 @@ def _ensure_enough_diskimage_space(space_needed, directory):
         raise StopActorExecutionError(message, details=details)
 
 
+def ensure_enough_transaction_space(userspace_path, storage_info):
+    """
+    Ensure the free space on each mountpoint is enough for the resolved upgrade transaction.
+
+    Use the space plan created when the upgrade transaction has been resolved,
+    so the missing space is detected before the download of packages. The
+    required space is compared with the free space of each mountpoint reduced
+    by 5% (as for disk images). The mountpoint hosting the target userspace
+    container needs to cover the expected growth of the container as well.
+
+    The size of the container is stored into the space plan, so the
+    remaining growth of the container can be estimated in next stages.
+    See `get_recommended_leapp_free_space`.
+
+    Do nothing when the space plan is not available. When the plan is
+    approximate (filelists of repositories were not loaded), the missing space
+    is only logged, as the split of sizes between mountpoints is not reliable.
+    The disk space check of RPM in later stages applies in such a case.
+
+    :param userspace_path: Path to the userspace container.
+    :type userspace_path: str
+    :param storage_info: The StorageInfo message.
+    :type storage_info: leapp.models.StorageInfo
+    :raises StopActorExecutionError: If any mountpoint does not have enough free space.
+    """
+    plan = spaceplanner.load_space_plan(userspace_path)
+    if not plan:
+        api.current_logger().debug('The space plan of the upgrade transaction is not available.')
+        return
+    try:
+        spaceplanner.anchor_space_plan(userspace_path, plan, _get_container_size(userspace_path))
+    except (OSError, IOError, CalledProcessError) as e:
+        api.current_logger().warning('Cannot store the container size into the space plan: {}'.format(str(e)))
+
+    mount_points = sorted([mp.fs_file for mp in _get_mountpoints(storage_info)])
+    container_mp = _get_scratch_mountpoint(mount_points, userspace_path)
+    required = spaceplanner.get_required_space(plan, mount_points, container_mp)
+    missing = []
+    for mountpoint in mount_points:
+        if not required[mountpoint]:
+            continue
+        available = _get_fspace(mountpoint, convert_to_mibs=True, coefficient=0.95)
+        api.current_logger().debug(
+            'Space required by the upgrade transaction on {}: {} MiB (available: {} MiB)'
+            .format(mountpoint, required[mountpoint], available)
+        )
+        if available < required[mountpoint]:
+            missing.append((mountpoint, required[mountpoint], available))
+    if missing and plan.approximate:
+        api.current_logger().warning(
+            'The approximate space plan of the upgrade transaction reports missing space: {}'
+            .format(', '.join('{}: needed {} MiB, available {} MiB'.format(*entry) for entry in missing))
+        )
+        return
+    if missing:
+        message = 'Not enough space available for the upgrade transaction.'
+        details = {
+            'detail': '\n'.join(
+                '{}: needed {} MiB, available {} MiB'.format(*entry) for entry in missing
+            ),
+            'hint': (
+                'Free the space on the listed mountpoints. The needed space on {} includes'
+                ' the space for the download of packages and for the upgrade initramfs.'
+                .format(container_mp)
+            ),
+        }
+        api.current_logger().error(message)
+        raise StopActorExecutionError(message, details=details)
+
+
 def _get_mountpoints(storage_info):
     mount_points = set()
     for entry in storage_info.fstab:
@@ -248,7 +508,9 @@ def _prepare_required_mounts(scratch_dir, mounts_dir, storage_info, scratch_rese
     partition that is hosting the target userspace container, but it does not
     have to be true if the code changes. Right now, let's live with that.
 
-    See `_create_mount_disk_image` docstring for additional more details.
+    Disk images are created and formatted in parallel. See
+    `_create_mount_disk_images` and `_create_mount_disk_image` docstrings
+    for additional more details.
 
     :param scratch_dir: Path to the scratch directory.
     :type scratch_dir: str
@@ -280,36 +542,61 @@ def _prepare_required_mounts(scratch_dir, mounts_dir, storage_info, scratch_rese
     # but we want to reserve some space in advance.
     scratch_disk_size = _get_fspace(scratch_dir, convert_to_mibs=True) - scratch_reserve
 
-    result = {}
+    disk_sizes = {}
     for mountpoint in mount_points:
         # keep the info about the free space rather 5% lower than the real value
-        disk_size = _get_fspace(mountpoint, convert_to_mibs=True, coefficient=0.95)
+        disk_sizes[mountpoint] = _get_fspace(mountpoint, convert_to_mibs=True, coefficient=0.95)
         if mountpoint == scratch_mp:
-            disk_size = scratch_disk_size
-        image = _create_mount_disk_image(disk_images_directory, mountpoint, disk_size)
+            disk_sizes[mountpoint] = scratch_disk_size
+
+    images = _create_mount_disk_images(disk_images_directory, disk_sizes)
+    result = {}
+    for mountpoint in mount_points:
         result[mountpoint] = mounting.LoopMount(
-            source=image,
-            target=_mount_dir(mounts_dir, mountpoint)
+            source=images[mountpoint],
+            target=_mount_dir(mounts_dir, mountpoint),
+            fstype=_get_disk_image_fstype()
         )
     return result
 
 
-@contextlib.contextmanager
-def _build_overlay_mount(root_mount, mounts):
-    if not root_mount:
+def _get_overlay_mounts(mounts, mount_target=None):
+    """
+    Return the root overlay mount and the flat list of all mounts composing the source overlay.
+
+    The list contains mounts in the order they have to be mounted:
+      * disk image & overlay for the root mountpoint
+      * bind mount of the root overlay to the `mount_target` (if set)
+      * disk image & overlay for each other mountpoint, bind mounted into
+        the root overlay (parent mountpoints go before their children)
+      * bind mount of the host /var/cache/dnf
+
+    :param mounts: Mapping of mountpoints to mounts of related disk images (see `_prepare_required_mounts`)
+    :type mounts: dict
+    :param mount_target: Directory to which whole source OVL layer should be bind mounted.
+    :type mount_target: Optional[str]
+    :rtype: (mounting.OverlayMount, list)
+    """
+    if not mounts.get('/'):
         raise StopActorExecutionError('Root mount point has not been prepared for overlayfs.')
-    if not mounts:
-        yield root_mount
-    else:
-        current = list(mounts.keys())[0]
-        current_mount = mounts.pop(current)
-        name = _mount_name(current)
-        with current_mount:
-            with mounting.OverlayMount(name=name, source=current, workdir=current_mount.target) as overlay:
-                with mounting.BindMount(source=overlay.target,
-                                        target=os.path.join(root_mount.target, current.lstrip('/'))):
-                    with _build_overlay_mount(root_mount, mounts) as mount:
-                        yield mount
+    mounts = dict(mounts)
+    root_mount = mounts.pop('/')
+    root_overlay = mounting.OverlayMount(name='system_overlay', source='/', workdir=root_mount.target)
+    result = [root_mount, root_overlay]
+    if mount_target:
+        result.append(mounting.BindMount(source=root_overlay.target, target=mount_target))
+    for mountpoint in sorted(mounts.keys()):
+        overlay = mounting.OverlayMount(
+            name=_mount_name(mountpoint), source=mountpoint, workdir=mounts[mountpoint].target)
+        result += [
+            mounts[mountpoint],
+            overlay,
+            mounting.BindMount(source=overlay.target, target=os.path.join(root_overlay.target, mountpoint.lstrip('/')))
+        ]
+    result.append(mounting.BindMount(
+        source='/var/cache/dnf',
+        target=os.path.join(root_overlay.target, 'var', 'cache', 'dnf')))
+    return root_overlay, result
 
 
 def cleanup_scratch(scratch_dir, mounts_dir):
@@ -325,17 +612,12 @@ def cleanup_scratch(scratch_dir, mounts_dir):
     """
     api.current_logger().debug('Cleaning up mounts')
     if os.path.ismount(mounts_dir):
-        # TODO(pstodulk): this is actually obsoleted for years. mounts dir
-        # is not mountpoit anymore, it contains mountpoints. But in time of
-        # this call all MPs should be already umounted as the solution has been
-        # changed also (all MPs are handled by context managers). This code
-        # is basically dead, so keeping it as it does not hurt us now.
-        api.current_logger().debug('Mounts directory is a mounted disk image - Unmounting.')
-        try:
-            run(['/bin/umount', '-fl', mounts_dir])
-            api.current_logger().debug('Unmounted mounted disk image.')
-        except (OSError, CalledProcessError) as e:
-            api.current_logger().warning('Failed to umount %s - message: %s', mounts_dir, str(e))
+        # NOTE: mounts dir is a tmpfs containing all mountpoints
+        # (see mounting.MountOrchestrator). In time of this call it should be
+        # already umounted, but in case it's not, the lazy umount detaches
+        # also all mountpoints inside.
+        api.current_logger().debug('Mounts directory is mounted - Unmounting.')
+        mounting.umount_lazy(mounts_dir)
     if get_env('LEAPP_DEVEL_KEEP_DISK_IMGS', None) == '1':
         # NOTE(pstodulk): From time to time, it helps me with some experiments
         return
@@ -344,6 +626,15 @@ def cleanup_scratch(scratch_dir, mounts_dir):
     api.current_logger().debug('Recursively removed scratch directory %s.', scratch_dir)
 
 
+def _get_disk_image_fstype():
+    """
+    Return the file system type used for disk images: 'xfs' (default) or 'ext4'.
+    """
+    if get_env('LEAPP_OVL_IMG_FS_EXT4', '0') == '1':
+        return 'ext4'
+    return 'xfs'
+
+
 def _format_disk_image_ext4(diskimage_path):
     """
     Format the specified disk image with Ext4 filesystem.
@@ -449,21 +740,16 @@ def _create_mount_disk_image(disk_images_directory, path, disk_size):
         )
         disk_size = 130
     diskimage_path = os.path.join(disk_images_directory, _mount_name(path))
-    cmd = [
-        '/bin/dd',
-        'if=/dev/zero', 'of={}'.format(diskimage_path),
-        'bs=1M', 'count=0', 'seek={}'.format(disk_size)
-    ]
     hint = (
         'Please ensure that there is enough diskspace on the partition hosting'
-        'the {} directory.'
+        ' the {} directory.'
         .format(disk_images_directory)
     )
 
     api.current_logger().debug('Attempting to create disk image at %s', diskimage_path)
-    utils.call_with_failure_hint(cmd=cmd, hint=hint)
+    _create_sparse_file(diskimage_path, disk_size, hint)
 
-    if get_env('LEAPP_OVL_IMG_FS_EXT4', '0') == '1':
+    if _get_disk_image_fstype() == 'ext4':
         # This is alternative to XFS in case we find some issues, to be able
         # to switch simply to Ext4, so we will be able to simple investigate
         # possible issues between overlay <-> XFS if any happens.
@@ -474,6 +760,101 @@ def _create_mount_disk_image(disk_images_directory, path, disk_size):
     return diskimage_path
 
 
+def _create_sparse_file(path, size, hint):
+    """
+    Create a sparse file with the apparent size `size` (in MiBs).
+
+    The file is created in-process by truncating it to the required size,
+    which is an equivalent of `dd if=/dev/zero bs=1M count=0 seek=<size>`
+    without the need to spawn a new process.
+    """
+    try:
+        with open(path, 'wb') as f:
+            f.truncate(size * 1024 * 1024)
+    except EnvironmentError as e:
+        api.current_logger().error('Failed to create disk image at %s', path, exc_info=True)
+        raise StopActorExecutionError(
+            message='Failed to create disk image {}. Error: {}'.format(path, str(e)),
+            details={'hint': hint}
+        )
+
+
+def _get_img_creation_workers(images_count):
+    """
+    Return the number of workers that should create disk images in parallel.
+
+    The number can be set by the LEAPP_OVL_IMG_WORKERS envar. By default
+    the number of CPUs is used, limited by `_MAX_DEFAULT_IMG_WORKERS`.
+    The returned value is never higher than the number of images to create.
+    Set LEAPP_OVL_IMG_WORKERS=1 to create disk images sequentially.
+
+    :param images_count: Number of disk images that are going to be created.
+    :type images_count: int
+    :rtype: int
+    """
+    try:
+        default_workers = min(multiprocessing.cpu_count(), _MAX_DEFAULT_IMG_WORKERS)
+    except NotImplementedError:
+        default_workers = 1
+    env_workers = get_env('LEAPP_OVL_IMG_WORKERS', None)
+    workers = default_workers
+    if env_workers is not None:
+        try:
+            workers = int(env_workers)
+        except ValueError:
+            workers = 0
+        if workers < 1:
+            api.current_logger().warning(
+                'Invalid "LEAPP_OVL_IMG_WORKERS" environment variable "%s". Setting default "%d" value',
+                env_workers, default_workers
+            )
+            workers = default_workers
+    return max(1, min(workers, images_count))
+
+
+def _create_mount_disk_images(disk_images_directory, disk_sizes):
+    """
+    Create disk images for all given mountpoints, in parallel if possible.
+
+    Each disk image is created and formatted by `_create_mount_disk_image`.
+    The images are independent on each other, so they are created by a pool
+    of workers (see `_get_img_creation_workers`). In case the creation of any
+    disk image fails, all already started workers are waited for and
+    the error of the first failed disk image (in order of mountpoints) is
+    raised - the same one that would be raised by the sequential creation.
+
+    :param disk_images_directory: Path to the directory where disk images should be stored.
+    :type disk_images_directory: str
+    :param disk_sizes: Mapping of mountpoints to apparent sizes of disk images in MiBs
+    :type disk_sizes: dict
+    :return: Mapping of mountpoints to paths of created disk images
+    :rtype: dict
+    """
+    mountpoints = sorted(disk_sizes.keys())
+    workers = _get_img_creation_workers(len(mountpoints))
+    api.current_logger().debug(
+        'Creating {} disk images using {} worker(s).'.format(len(mountpoints), workers)
+    )
+    if workers == 1:
+        return {
+            mp: _create_mount_disk_image(disk_images_directory, mp, disk_sizes[mp]) for mp in mountpoints
+        }
+
+    pool = ThreadPool(workers)
+    try:
+        async_results = [
+            (mp, pool.apply_async(_create_mount_disk_image, (disk_images_directory, mp, disk_sizes[mp])))
+            for mp in mountpoints
+        ]
+        # wait for all workers first, so nothing is running in the background
+        # when the error is raised and cleanup of the scratch dir is started
+        pool.close()
+        pool.join()
+        return {mp: async_result.get() for mp, async_result in async_results}
+    finally:
+        pool.terminate()
+
+
 def _create_diskimages_dir(scratch_dir, diskimages_dir):
     """
     Prepares directories for disk images
@@ -514,17 +895,6 @@ def _create_mounts_dir(scratch_dir, mounts_dir):
         )
 
 
-@contextlib.contextmanager
-def _mount_dnf_cache(overlay_target):
-    """
-    Convenience context manager to ensure bind mounted /var/cache/dnf and removal of the mount.
-    """
-    with mounting.BindMount(
-            source='/var/cache/dnf',
-            target=os.path.join(overlay_target, 'var', 'cache', 'dnf')) as cache_mount:
-        yield cache_mount
-
-
 @contextlib.contextmanager
 def create_source_overlay(mounts_dir, scratch_dir, xfs_info, storage_info, mount_target=None, scratch_reserve=0):
     """
@@ -574,21 +944,19 @@ def create_source_overlay(mounts_dir, scratch_dir, xfs_info, storage_info, mount
         scratch_dir=scratch_dir, mounts_dir=mounts_dir))
     try:
         _create_mounts_dir(scratch_dir, mounts_dir)
+        # all mounts are placed inside a tmpfs mounted on the mounts_dir, so
+        # they can be detached at once; except the legacy solution, which
+        # keeps upper dirs directly inside the mounts_dir
+        mounts_root = mounts_dir
         if get_env('LEAPP_OVL_LEGACY', '0') != '1':
             mounts = _prepare_required_mounts(scratch_dir, mounts_dir, storage_info, scratch_reserve)
         else:
             # fallback to the deprecated OVL solution
             mounts = _prepare_required_mounts_old(scratch_dir, mounts_dir, _get_mountpoints(storage_info), xfs_info)
-        with mounts.pop('/') as root_mount:
-            with mounting.OverlayMount(name='system_overlay', source='/', workdir=root_mount.target) as root_overlay:
-                if mount_target:
-                    target = mounting.BindMount(source=root_overlay.target, target=mount_target)
-                else:
-                    target = mounting.NullMount(target=root_overlay.target)
-                with target:
-                    with _build_overlay_mount(root_overlay, mounts) as overlay:
-                        with _mount_dnf_cache(overlay.target):
-                            yield overlay
+            mounts_root = None
+        root_overlay, overlay_mounts = _get_overlay_mounts(mounts, mount_target)
+        with mounting.MountOrchestrator(overlay_mounts, root=mounts_root):
+            yield root_overlay
     except Exception:
         cleanup_scratch(scratch_dir, mounts_dir)
         raise
@@ -0,0 +1,197 @@
+import errno
+import fnmatch
+import os
+
+from leapp.libraries.common.config import get_env
+from leapp.libraries.stdlib import api
+
+CHANGED_FILES_PATH = '/var/lib/leapp/selinux-changed-files'
+"""
+Paths of files owned by packages installed or upgraded by the upgrade transaction (one path per line).
+"""
+
+UPGRADE_START_PATH = '/var/lib/leapp/selinux-upgrade-start'
+"""
+Marker created when the upgrade transaction stage starts (see `mark_upgrade_start`).
+
+Files with the change time (ctime) newer than the modification time of
+the marker have been created or modified by the upgrade.
+"""
+
+RELABEL_PATHS_PATH = '/var/lib/leapp/selinux-relabel-paths'
+"""
+Paths to be relabeled during the first boot of the upgraded system when the targeted relabeling is scheduled.
+"""
+
+RECURSIVE_PATHS = (
+    '/boot',
+    '/etc',
+    '/usr/lib/sysimage',
+    '/var/cache',
+    '/var/lib/alternatives',
+    '/var/lib/rpm',
+    '/var/lib/selinux',
+)
+"""
+Directories relabeled recursively by the targeted relabeling.
+
+Files changed by the upgrade are found by their change time (see
+`get_relabel_paths`), which does not cover files written by actors after
+the list of paths is created (the FinalizationPhase) and before SELinux is
+enabled again. Such files (configuration files, initramfs, ...) are expected
+to live in the listed directories.
+"""
+
+SCAN_PATHS = ('/boot', '/etc', '/opt', '/usr', '/var')
+"""
+Directory trees searched for files changed by the upgrade.
+
+The upgrade changes just the system part of the file system. Data of users
+and applications (/home, /srv, databases, ...) are not searched, as they can
+contain millions of files and their labels are kept by the upgrade.
+"""
+
+SCAN_NESTED_MOUNTS = ('/var/log',)
+"""
+Mountpoints inside `SCAN_PATHS` that are searched for files changed by the upgrade.
+
+Other file systems mounted inside `SCAN_PATHS` (e.g. /var/lib/pgsql,
+/var/lib/containers, /opt/data) are expected to contain data of applications
+and they are not searched.
+"""
+
+SCAN_EXCLUDED_PATHS = ('/var/lib/leapp',)
+"""
+Paths (fnmatch patterns) not searched for files changed by the upgrade.
+
+/var/lib/leapp contains the target userspace container and other working
+data of leapp, which do not need valid labels.
+"""
+
+SCAN_FSTYPES = ('btrfs', 'ext2', 'ext3', 'ext4', 'xfs')
+"""
+Types of mounted file systems searched for files changed by the upgrade.
+
+Other file systems (network, pseudo, ...) are not searched, same as they are
+not relabeled by the relabeling of the whole system.
+"""
+
+
+def is_targeted_relabel_enabled():
+    """
+    Return True if only files changed by the upgrade should be relabeled instead of the whole system
+
+    It is enabled by (envar) `LEAPP_SELINUX_TARGETED_RELABEL=1`. The whole
+    system is still relabeled when the targeted relabeling cannot be used
+    (see the scheduleselinuxrelabeling actor).
+    """
+    return get_env('LEAPP_SELINUX_TARGETED_RELABEL', '0') == '1'
+
+
+def mark_upgrade_start():
+    """
+    Mark the start of the upgrade transaction stage for the targeted SELinux relabeling
+
+    Data of a previous attempt of the upgrade are removed first, so they are
+    never used for the current one. The marker is not created when
+    the targeted relabeling is not enabled.
+    """
+    for path in (CHANGED_FILES_PATH, UPGRADE_START_PATH):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                api.current_logger().warning('Cannot remove {}: {}'.format(path, str(e)))
+    if not is_targeted_relabel_enabled():
+        return
+    try:
+        with open(UPGRADE_START_PATH, 'w'):
+            pass
+    except (OSError, IOError) as e:
+        api.current_logger().warning('Cannot mark the start of the upgrade transaction: {}'.format(str(e)))
+
+
+def _unescape_mount_path(path):
+    # spaces, tabs, ... are escaped as octal numbers in /proc/mounts
+    return path.replace('\\040', ' ').replace('\\011', '\t').replace('\\012', '\n').replace('\\134', '\\')
+
+
+def _get_mounts(mounts_path='/proc/mounts'):
+    """
+    Return types of mounted file systems by their mountpoints, empty when they cannot be read
+    """
+    mounts = {}
+    try:
+        with open(mounts_path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2:
+                    mounts[_unescape_mount_path(fields[1])] = fields[2]
+    except (OSError, IOError) as e:
+        api.current_logger().debug('Cannot read {}: {}'.format(mounts_path, str(e)))
+    return mounts
+
+
+def _is_searched(path, mounts, nested=True):
+    if any(fnmatch.fnmatch(path, pattern) for pattern in SCAN_EXCLUDED_PATHS):
+        return False
+    if path not in mounts:
+        return True
+    if nested and path not in SCAN_NESTED_MOUNTS:
+        return False
+    return mounts[path] in SCAN_FSTYPES
+
+
+def _find_changed_files(since, tops=SCAN_PATHS):
+    """
+    Return paths under the top directories with the change time not older than the given time
+
+    Only metadata of files are read, so the search is much cheaper than
+    the relabeling (reading and setting labels) of all files. The top
+    directories can be mountpoints, other file systems mounted inside them
+    are searched only when listed in `SCAN_NESTED_MOUNTS`.
+    """
+    mounts = _get_mounts()
+    changed = []
+    for top in tops:
+        if not os.path.isdir(top) or not _is_searched(top, mounts, nested=False):
+            continue
+        for root, dirs, files in os.walk(top):
+            dirs[:] = [name for name in dirs if _is_searched(os.path.join(root, name), mounts)]
+            for name in dirs + files:
+                path = os.path.join(root, name)
+                try:
+                    if os.lstat(path).st_ctime >= since:
+                        changed.append(path)
+                except OSError:
+                    # removed in the meanwhile
+                    continue
+    return changed
+
+
+def get_relabel_paths():
+    """
+    Return paths changed by the upgrade together with their parent directories
+
+    The paths cover files owned by packages installed by the upgrade
+    transaction and files in system directories (see `SCAN_PATHS`) created
+    or modified since the start of the upgrade transaction stage. The latter
+    covers files not owned by any package that are created by scriptlets
+    (e.g. /usr/lib/modules/*/modules.*, /usr/lib/locale/locale-archive,
+    caches under /usr/share and /usr/lib, data under /var/lib and logs) and
+    files written by leapp actors. These are created while SELinux is
+    disabled, so they are not labeled at all.
+
+    :raises: OSError/IOError/ValueError when the list of files changed by the upgrade transaction
+             or the marker of the upgrade start cannot be read
+    :rtype: List[str]
+    """
+    with open(CHANGED_FILES_PATH) as f:
+        changed = [line.rstrip('\n') for line in f if line.strip()]
+    changed.extend(_find_changed_files(os.stat(UPGRADE_START_PATH).st_mtime))
+    paths = set()
+    for path in changed:
+        while path not in paths and path != '/':
+            paths.add(path)
+            path = os.path.dirname(path)
+    return sorted(paths)
@@ -0,0 +1,33 @@
+from leapp.libraries.stdlib import api, CalledProcessError, run
+
+
+def run_operations(operations):
+    """
+    Execute given semodule operations (installation or removal of policy modules) in a single transaction
+
+    Each semodule call rebuilds and reloads the whole policy, which takes
+    seconds. So all operations are executed by a single semodule call first.
+    In case it fails, the operations are split in halves which are executed
+    again (the first half first), until the failing operations are
+    identified. Successful operations are applied, failing operations are
+    skipped.
+
+    :param operations: List of semodule arguments of single operations, e.g. ['-X', '400', '-i', 'module.cil']
+    :type operations: list[list[str]]
+    :return: List of tuples (operation, error) describing failed operations
+    :rtype: list[tuple[list[str], str]]
+    """
+    if not operations:
+        return []
+    try:
+        run(['semodule'] + [arg for operation in operations for arg in operation])
+        return []
+    except CalledProcessError as e:
+        if len(operations) == 1:
+            return [(operations[0], e.stderr)]
+        api.current_logger().debug(
+            'Failed to execute {} semodule operations in a single transaction: {}\n'
+            'Retrying to identify the failing operations.'.format(len(operations), e.stderr)
+        )
+    middle = len(operations) // 2
+    return run_operations(operations[:middle]) + run_operations(operations[middle:])
@@ -0,0 +1,161 @@
+import json
+import os
+
+from leapp.libraries.stdlib import api
+
+SPACE_PLAN_NAME = 'dnf-space-plan.json'
+SPACE_PLAN_PATH = os.path.join('/var/lib/leapp', SPACE_PLAN_NAME)
+"""
+Path to the space plan inside the target userspace container.
+
+The space plan is created by our DNF plugin when the upgrade transaction
+is resolved (the check stage). It contains:
+  * download_size - size of packages that need to be downloaded (in bytes)
+  * net_sizes - installed sizes of incoming packages reduced by installed
+    sizes of outgoing packages, per directory
+  * container_size - size of the container (in MiB) when the plan has been
+    created; added by `anchor_space_plan`
+  * approximate - True when filelists of repositories were not loaded (see
+    `LEAPP_DNF_TRIM_METADATA`), so net sizes per directory are estimated
+    from files of installed packages
+"""
+
+INITRAMFS_BUILD_OVERHEAD = 500
+"""
+Space (in MiB) consumed inside the target userspace container by the upgrade initramfs build.
+
+It covers packages installed into the container for the needs of the upgrade
+initramfs and the temporary space consumed by dracut (usually 400+ MiB).
+"""
+
+
+class SpacePlan(object):
+    """
+    Disk space required by the resolved upgrade transaction.
+
+    All sizes are in bytes, except of the container_size which is in MiB.
+    """
+
+    def __init__(self, download_size, net_sizes, container_size=None, approximate=False):
+        self.download_size = download_size
+        self.net_sizes = net_sizes
+        self.container_size = container_size
+        self.approximate = approximate
+
+    def dump(self):
+        return {
+            'download_size': self.download_size,
+            'net_sizes': self.net_sizes,
+            'container_size': self.container_size,
+            'approximate': self.approximate,
+        }
+
+
+def _to_mibs(size):
+    # round up; we rather want to reserve a bit more
+    return int((max(size, 0) + 1024 * 1024 - 1) // (1024 * 1024))
+
+
+def _get_plan_path(userspace_path):
+    return os.path.join(userspace_path, SPACE_PLAN_PATH.lstrip('/'))
+
+
+def load_space_plan(userspace_path):
+    """
+    Return the space plan stored inside the target userspace container.
+
+    Return None if the plan does not exist (e.g. the upgrade transaction has
+    not been resolved yet) or it cannot be read.
+
+    :param userspace_path: Path to the userspace container.
+    :type userspace_path: str
+    :rtype: Optional[SpacePlan]
+    """
+    try:
+        with open(_get_plan_path(userspace_path)) as f:
+            data = json.load(f)
+        return SpacePlan(
+            download_size=int(data['download_size']),
+            net_sizes=data['net_sizes'],
+            container_size=data.get('container_size'),
+            approximate=bool(data.get('approximate', False)),
+        )
+    except (OSError, IOError):
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        api.current_logger().warning('Cannot read the space plan of the upgrade transaction: {}'.format(str(e)))
+        return None
+
+
+def remove_space_plan(userspace_path):
+    """
+    Remove the space plan from the target userspace container if present.
+    """
+    try:
+        os.unlink(_get_plan_path(userspace_path))
+    except OSError:
+        pass
+
+
+def anchor_space_plan(userspace_path, plan, container_size):
+    """
+    Store the current size of the container (in MiB) into the space plan.
+
+    The container is expected to grow by `get_container_growth` MiB after
+    the space plan is anchored.
+    """
+    plan.container_size = container_size
+    with open(_get_plan_path(userspace_path), 'w') as f:
+        json.dump(plan.dump(), f, sort_keys=True, indent=2)
+
+
+def get_container_growth(plan):
+    """
+    Return the expected growth of the container (in MiB) after the upgrade transaction is resolved.
+
+    It covers the download of packages into the DNF cache inside the container
+    and the build of the upgrade initramfs.
+    """
+    return _to_mibs(plan.download_size) + INITRAMFS_BUILD_OVERHEAD
+
+
+def get_mountpoint(mount_points, path):
+    """
+    Return the mountpoint (from the given list) hosting the given path.
+    """
+    for mp in sorted(mount_points, reverse=True):
+        if path == mp or path.startswith(mp.rstrip('/') + '/'):
+            return mp
+    return None
+
+
+def _get_sizes_per_mountpoint(sizes, mount_points):
+    result = dict.fromkeys(mount_points, 0)
+    for path, size in sizes.items():
+        mp = get_mountpoint(mount_points, path)
+        if mp:
+            result[mp] += size
+    return result
+
+
+def get_required_space(plan, mount_points, container_mountpoint=None):
+    """
+    Return the space (in MiB) required by the upgrade transaction per mountpoint.
+
+    The installed sizes of outgoing packages are subtracted from the installed
+    sizes of incoming packages, as that is how RPM evaluates the required space
+    as well. The mountpoint hosting the container needs to cover the growth of
+    the container in addition.
+
+    :param plan: The space plan of the upgrade transaction.
+    :type plan: SpacePlan
+    :param mount_points: List of mountpoints to calculate the required space for.
+    :type mount_points: List[str]
+    :param container_mountpoint: The mountpoint hosting the target userspace container.
+    :type container_mountpoint: Optional[str]
+    :rtype: Dict[str, int]
+    """
+    required = {mp: _to_mibs(size) for mp, size in _get_sizes_per_mountpoint(plan.net_sizes, mount_points).items()}
+    if container_mountpoint in required:
+        required[container_mountpoint] += get_container_growth(plan)
+    return required
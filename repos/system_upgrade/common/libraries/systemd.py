@@ -1,5 +1,6 @@
 import fnmatch
 import os
+import re
 
 from leapp.libraries.stdlib import api, CalledProcessError, run
 from leapp.models import SystemdServiceFile, SystemdServicePreset
@@ -16,18 +17,47 @@ SYSTEMD_SYSTEM_LOAD_PATH = [
 ]
 
 
+_IS_ENABLED_STATES = ('enabled', 'enabled-runtime', 'static', 'alias', 'indirect', 'generated')
+"""Unit file states for which `systemctl is-enabled` succeeds"""
+
+_IS_ACTIVE_STATES = ('active', 'reloading')
+"""Unit active states for which `systemctl is-active` succeeds"""
+
+
+def _raise_walk_error(err):
+    raise err
+
+
+def _walk_names(path):
+    """
+    Yield paths of all entries under the path, same as `find <path> -mindepth 1`
+
+    Symlinks to directories are not followed.
+
+    :raises: OSError: if a directory cannot be listed
+    """
+    for root, dirs, files in os.walk(path, onerror=_raise_walk_error):
+        dirs.sort()
+        for name in sorted(dirs + files):
+            yield os.path.join(root, name)
+
+
 def get_broken_symlinks():
     """
     Get broken systemd symlinks on the system
 
+    Same as `find /etc/systemd/system/ -xtype l`, the directory is walked
+    natively instead of spawning the find utility.
+
     :return: List of broken systemd symlinks
     :rtype: list[str]
-    :raises: CalledProcessError: if the `find` command fails
-    :raises: OSError: if the find utility is not found
+    :raises: OSError: if the directory cannot be walked
     """
     try:
-        return run(['find', SYSTEMD_SYMLINKS_DIR, '-xtype', 'l'], split=True)['stdout']
-    except (OSError, CalledProcessError):
+        # NOTE: exists() follows the symlink, so it is False for dangling symlinks and symlink loops
+        return [path for path in _walk_names(SYSTEMD_SYMLINKS_DIR)
+                if os.path.islink(path) and not os.path.exists(path)]
+    except OSError:
         api.current_logger().error('Cannot obtain the list of broken systemd symlinks.')
         raise
 
@@ -106,6 +136,111 @@ def get_service_files():
     return services_files
 
 
+def get_unit_file_states():
+    """
+    Get states of all unit files on the system
+
+    All unit files are listed by a single `systemctl list-unit-files` call,
+    use `get_unit_file_state` to look units up in the result instead of calling
+    `systemctl is-enabled` for each of them.
+
+    :return: Dictionary mapping unit files (e.g. sshd.service) to their states (e.g. enabled)
+    :rtype: dict[str, str]
+    :raises: CalledProcessError: in case of failure of `systemctl` command
+    """
+    try:
+        cmd = ['systemctl', 'list-unit-files', '--all', '--plain', '--no-legend']
+        unit_files_data = run(cmd, split=True)['stdout']
+    except CalledProcessError as err:
+        api.current_logger().error('Cannot obtain the list of unit files:{}'.format(str(err)))
+        raise
+    return dict(entry.split()[:2] for entry in unit_files_data if len(entry.split()) >= 2)
+
+
+def _get_unit_name(unit):
+    # same as systemctl, the .service suffix is implied
+    return unit if '.' in unit else '{}.service'.format(unit)
+
+
+def get_unit_file_state(unit, unit_file_states):
+    """
+    Get the state of the unit file, the same as reported by `systemctl is-enabled`
+
+    Instances of template units do not have a unit file of their own, so they
+    are not listed by `systemctl list-unit-files`. Their state is queried
+    by `systemctl is-enabled`.
+
+    :param unit: The systemd unit, the .service suffix can be omitted
+    :param unit_file_states: States of unit files as returned by `get_unit_file_states`
+    :return: The state of the unit file or None if it cannot be obtained (e.g. the unit does not exist)
+    :rtype: str | None
+    """
+    unit = _get_unit_name(unit)
+    if unit in unit_file_states:
+        return unit_file_states[unit]
+    if '@.' in unit or '@' not in unit:
+        # not an instance, so the unit file does not exist
+        return None
+    try:
+        # NOTE: the command fails for disabled units as well, but the state is printed anyway
+        ret = run(['systemctl', 'is-enabled', unit], split=True, checked=False)['stdout']
+    except OSError:
+        return None
+    return ret[0].strip() if ret and ret[0].strip() else None
+
+
+def is_unit_enabled(unit, unit_file_states):
+    """
+    Return True if `systemctl is-enabled` succeeds for the unit
+
+    Note that the command succeeds also for static, indirect, alias and generated
+    unit files. Compare the result of `get_unit_file_state` to check for
+    a particular state.
+
+    :param unit: The systemd unit, the .service suffix can be omitted
+    :param unit_file_states: States of unit files as returned by `get_unit_file_states`
+    """
+    return get_unit_file_state(unit, unit_file_states) in _IS_ENABLED_STATES
+
+
+def get_unit_active_states():
+    """
+    Get active states of all units loaded by systemd
+
+    All units are listed by a single `systemctl list-units` call instead
+    of calling `systemctl is-active` for each of them. Units that are not
+    loaded (e.g. not existing units) are not listed, these are inactive.
+
+    :return: Dictionary mapping units (e.g. sshd.service) to their active states (e.g. active)
+    :rtype: dict[str, str]
+    :raises: CalledProcessError: in case of failure of `systemctl` command
+    """
+    try:
+        units_data = run(['systemctl', 'list-units', '--all', '--plain', '--no-legend'], split=True)['stdout']
+    except CalledProcessError as err:
+        api.current_logger().error('Cannot obtain the list of units:{}'.format(str(err)))
+        raise
+    active_states = {}
+    for entry in units_data:
+        # columns: UNIT LOAD ACTIVE SUB DESCRIPTION; failed units can be marked by a leading bullet
+        columns = entry.split()
+        if columns and '.' not in columns[0]:
+            columns = columns[1:]
+        if len(columns) >= 3:
+            active_states[columns[0]] = columns[2]
+    return active_states
+
+
+def is_unit_active(unit, active_states):
+    """
+    Return True if `systemctl is-active` succeeds for the unit
+
+    :param unit: The systemd unit, the .service suffix can be omitted
+    :param active_states: Active states of units as returned by `get_unit_active_states`
+    """
+    return active_states.get(_get_unit_name(unit)) in _IS_ACTIVE_STATES
+
+
 def _join_presets_resolving_overrides(etc_files, usr_files):
     """
     Join presets and resolve preset file overrides
@@ -138,13 +273,13 @@ def _search_preset_files(path):
     :param path: The path to search preset files in
     :return: List of found preset files
     :rtype: list[str]
-    :raises: CalledProcessError: if the `find` command fails
-    :raises: OSError: if the find utility is not found
+    :raises: OSError: if the directory cannot be walked
     """
     if os.path.isdir(path):
         try:
-            return run(['find', path, '-name', '*.preset'], split=True)['stdout']
-        except (OSError, CalledProcessError) as err:
+            # NOTE: symlinks are kept, a preset file linked to /dev/null blocks the one in /usr/
+            return [preset for preset in _walk_names(path) if fnmatch.fnmatch(os.path.basename(preset), '*.preset')]
+        except OSError as err:
             api.current_logger().error('Cannot obtain list of systemd preset files in {}:{}'.format(path, str(err)))
             raise
     else:
@@ -156,8 +291,7 @@ def _get_system_preset_files():
     Get systemd system preset files and remove overriding entries. Entries in /run/systemd/system are ignored.
 
     :return: List of system systemd preset files
-    :raises: CalledProcessError: if the `find` command fails
-    :raises: OSError: if the find utility is not found
+    :raises: OSError: if a preset directory cannot be walked
     """
     etc_files = _search_preset_files(_ETC_PRESETS_PATH)
     usr_files = _search_preset_files(_USR_PRESETS_PATH)
@@ -167,14 +301,41 @@ def _get_system_preset_files():
     return preset_files
 
 
-def _recursive_glob(pattern, root_dir):
-    for _, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            if fnmatch.fnmatch(filename, pattern):
-                yield filename
+def _get_unit_files(load_path):
+    """
+    Get names of all files in the given paths
+
+    Each path is walked just once, preset entries are then matched against
+    the result instead of walking the paths for each entry again.
+
+    :param load_path: List of paths to look systemd unit files up in
+    :return: Names of found files
+    :rtype: set[str]
+    """
+    unit_files = set()
+    for path in load_path:
+        for _, _, filenames in os.walk(path):
+            unit_files.update(filenames)
+    return unit_files
+
+
+_GLOB_CHARS = ('*', '?', '[')
+
 
+def _match_unit_files(pattern, unit_files):
+    """
+    Get unit files matching the glob pattern
 
-def _parse_preset_entry(entry, presets, load_path):
+    Patterns without glob characters (the most of preset entries) are
+    looked up directly.
+    """
+    if not any(char in pattern for char in _GLOB_CHARS):
+        return [pattern] if pattern in unit_files else []
+    match = re.compile(fnmatch.translate(pattern)).match
+    return [unit_file for unit_file in unit_files if match(unit_file)]
+
+
+def _parse_preset_entry(entry, presets, unit_files):
     """
     Parse a single entry (line) in a preset file
 
@@ -182,31 +343,28 @@ def _parse_preset_entry(entry, presets, load_path):
 
     :param entry: The entry to parse
     :param presets: Dictionary to store the presets into
-    :param load_path: List of paths to look systemd unit files up in
+    :param unit_files: Names of unit files, as returned by `_get_unit_files`
     """
 
     columns = entry.split()
     if len(columns) < 2 or columns[0] not in ('enable', 'disable'):
         raise ValueError('Invalid preset file entry: "{}"'.format(entry))
 
-    for path in load_path:
-        # TODO(mmatuska): This currently also globs non unit files,
-        # so the results need to be filtered with something like endswith('.<unit_type>')
-        unit_files = _recursive_glob(columns[1], root_dir=path)
-
-        for unit_file in unit_files:
-            if '@' in columns[1] and len(columns) > 2:
-                # unit is a template,
-                # if the entry contains instance names after template unit name
-                # the entry only applies to the specified instances, not to the
-                # template itself
-                for instance in columns[2:]:
-                    service_name = unit_file[:unit_file.index('@') + 1] + instance + '.service'
-                    if service_name not in presets:  # first occurrence has priority
-                        presets[service_name] = columns[0]
+    # TODO(mmatuska): This currently also globs non unit files,
+    # so the results need to be filtered with something like endswith('.<unit_type>')
+    for unit_file in _match_unit_files(columns[1], unit_files):
+        if '@' in columns[1] and len(columns) > 2:
+            # unit is a template,
+            # if the entry contains instance names after template unit name
+            # the entry only applies to the specified instances, not to the
+            # template itself
+            for instance in columns[2:]:
+                service_name = unit_file[:unit_file.index('@') + 1] + instance + '.service'
+                if service_name not in presets:  # first occurrence has priority
+                    presets[service_name] = columns[0]
 
-            elif unit_file not in presets:  # first occurrence has priority
-                presets[unit_file] = columns[0]
+        elif unit_file not in presets:  # first occurrence has priority
+            presets[unit_file] = columns[0]
 
 
 def _parse_preset_files(preset_files, load_path, ignore_invalid_entries):
@@ -220,6 +378,7 @@ def _parse_preset_files(preset_files, load_path, ignore_invalid_entries):
     :raises: ValueError: when a preset file has invalid content
     """
     presets = {}
+    unit_files = _get_unit_files(load_path)
 
     for preset in preset_files:
         with open(preset, 'r') as preset_file:
@@ -227,7 +386,7 @@ def _parse_preset_files(preset_files, load_path, ignore_invalid_entries):
                 stripped = line.strip()
                 if stripped and stripped[0] not in ('#', ';'):  # ignore comments
                     try:
-                        _parse_preset_entry(stripped, presets, load_path)
+                        _parse_preset_entry(stripped, presets, unit_files)
                     except ValueError as err:
                         new_msg = 'Invalid preset file {pfile}: {error}'.format(pfile=preset, error=str(err))
                         if ignore_invalid_entries:
@@ -247,19 +406,18 @@ def get_system_service_preset_files(service_files, ignore_invalid_entries=False)
     :param ignore_invalid_entries: Ignore invalid entries in preset files if True, raise ValueError otherwise
     :return: List of system systemd services presets
     :rtype: list[SystemdServicePreset]
-    :raises: CalledProcessError: In case of errors when discovering systemd preset files
-    :raises: OSError: When the `find` command is not available
+    :raises: OSError: In case of errors when discovering systemd preset files
     :raises: ValueError: When a preset file has invalid content and ignore_invalid_entries is False
     """
     preset_files = _get_system_preset_files()
     presets = _parse_preset_files(preset_files, SYSTEMD_SYSTEM_LOAD_PATH, ignore_invalid_entries)
+    service_states = {s.name: s.state for s in service_files}
 
     preset_models = []
     for unit, state in presets.items():
         if unit.endswith('.service'):
-            service_file = next(iter([s for s in service_files if s.name == unit]), None)
             # presets can also be set on instances of template services which don't have a unit file
-            if service_file and service_file.state in ('static', 'transient'):
+            if service_states.get(unit) in ('static', 'transient'):
                 continue
             preset_models.append(SystemdServicePreset(service=unit, state=state))
 
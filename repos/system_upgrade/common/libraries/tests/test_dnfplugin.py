@@ -1,3 +1,5 @@
+import json
+import os
 from collections import namedtuple
 
 import pytest
@@ -5,8 +7,8 @@ import pytest
 import leapp.models
 from leapp.libraries.common import dnfplugin
 from leapp.libraries.common.config.version import get_major_version
-from leapp.libraries.common.testutils import CurrentActorMocked
-from leapp.libraries.stdlib import api
+from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
 from leapp.models.fields import Boolean
 from leapp.topics import Topic
 
@@ -67,6 +69,8 @@ class DATADnfPluginDataDnfConf(leapp.models.Model):
     platform_id = fields.StringEnum(choices=['platform:el8', 'platform:el9'])
     releasever = fields.String()
     installroot = fields.StringEnum(choices=['/installroot'])
+    load_filelists = fields.Boolean()
+    pinned_repos = fields.List(fields.String())
     test_flag = fields.Boolean()
 
 
@@ -81,11 +85,32 @@ class DATADnfPluginDataRHUI(leapp.models.Model):
     aws = fields.Model(DATADnfPluginDataRHUIAWS)
 
 
+class DATADnfPluginDataSpacePlan(leapp.models.Model):
+    topic = DATADnfPluginDataTopic
+    path = fields.StringEnum(choices=['/var/lib/leapp/dnf-space-plan.json'])
+
+
+class DATADnfPluginDataDownload(leapp.models.Model):
+    topic = DATADnfPluginDataTopic
+    max_parallel_downloads = fields.Nullable(fields.Integer())
+    fastestmirror = fields.Nullable(fields.Boolean())
+    stats_path = fields.StringEnum(choices=['/var/lib/leapp/dnf-download-stats.json'])
+
+
+class DATADnfPluginDataUpgrade(leapp.models.Model):
+    topic = DATADnfPluginDataTopic
+    stats_path = fields.StringEnum(choices=['/var/lib/leapp/dnf-transaction-stats.json'])
+    changed_files_path = fields.Nullable(fields.StringEnum(choices=['/var/lib/leapp/dnf-changed-files']))
+
+
 class DATADnfPluginData(leapp.models.Model):
     topic = DATADnfPluginDataTopic
     pkgs_info = fields.Model(DATADnfPluginDataPkgsInfo)
     dnf_conf = fields.Model(DATADnfPluginDataDnfConf)
     rhui = fields.Model(DATADnfPluginDataRHUI)
+    space_plan = fields.Model(DATADnfPluginDataSpacePlan)
+    download = fields.Model(DATADnfPluginDataDownload)
+    upgrade = fields.Model(DATADnfPluginDataUpgrade)
 
 
 # Delete those models from leapp.models to 'unpolute' the module
@@ -93,6 +118,9 @@ del leapp.models.DATADnfPluginDataPkgsInfo
 del leapp.models.DATADnfPluginDataDnfConf
 del leapp.models.DATADnfPluginDataRHUI
 del leapp.models.DATADnfPluginDataRHUIAWS
+del leapp.models.DATADnfPluginDataSpacePlan
+del leapp.models.DATADnfPluginDataDownload
+del leapp.models.DATADnfPluginDataUpgrade
 del leapp.models.DATADnfPluginData
 
 
@@ -191,3 +219,164 @@ def test_build_plugin_data(monkeypatch):
                 )
             )
         )
+
+
+@pytest.mark.parametrize('envars,expected_parallel,expected_fastestmirror', [
+    ({}, None, None),
+    ({'LEAPP_DNF_MAX_PARALLEL_DOWNLOADS': '10', 'LEAPP_DNF_FASTESTMIRROR': '1'}, 10, True),
+    ({'LEAPP_DNF_MAX_PARALLEL_DOWNLOADS': '1', 'LEAPP_DNF_FASTESTMIRROR': '0'}, 1, False),
+    ({'LEAPP_DNF_MAX_PARALLEL_DOWNLOADS': '21', 'LEAPP_DNF_FASTESTMIRROR': 'yes'}, None, None),
+    ({'LEAPP_DNF_MAX_PARALLEL_DOWNLOADS': 'many'}, None, None),
+])
+def test_build_plugin_data_download(monkeypatch, envars, expected_parallel, expected_fastestmirror):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.4', envars=envars))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    created = DATADnfPluginData.create(
+        dnfplugin.build_plugin_data(
+            target_repoids=['BASEOS', 'APPSTREAM'],
+            debug=False,
+            test=True,
+            on_aws=False,
+            tasks=leapp.models.FilteredRpmTransactionTasks()
+        )
+    )
+    assert created.download.max_parallel_downloads == expected_parallel
+    assert created.download.fastestmirror == expected_fastestmirror
+    assert created.download.stats_path == dnfplugin.DNF_DOWNLOAD_STATS_PATH
+
+
+@pytest.mark.parametrize('envars,expected', [
+    ({}, True),
+    ({'LEAPP_DNF_TRIM_METADATA': '0'}, True),
+    ({'LEAPP_DNF_TRIM_METADATA': '1'}, False),
+])
+def test_build_plugin_data_load_filelists(monkeypatch, envars, expected):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.4', envars=envars))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    created = DATADnfPluginData.create(
+        dnfplugin.build_plugin_data(
+            target_repoids=['BASEOS', 'APPSTREAM'],
+            debug=False,
+            test=True,
+            on_aws=False,
+            tasks=leapp.models.FilteredRpmTransactionTasks()
+        )
+    )
+    assert created.dnf_conf.load_filelists is expected
+
+
+def test_build_plugin_data_pinned_repos(monkeypatch):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.4'))
+    monkeypatch.setattr(dnfplugin.metadatacache, 'get_pinned_repoids', lambda repoids: sorted(repoids)[:1])
+    created = DATADnfPluginData.create(
+        dnfplugin.build_plugin_data(
+            target_repoids=['BASEOS', 'APPSTREAM'],
+            debug=False,
+            test=True,
+            on_aws=False,
+            tasks=leapp.models.FilteredRpmTransactionTasks()
+        )
+    )
+    assert created.dnf_conf.pinned_repos == ['APPSTREAM']
+
+
+def test_build_plugin_data_upgrade(monkeypatch):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.4'))
+    created = DATADnfPluginData.create(
+        dnfplugin.build_plugin_data(
+            target_repoids=['BASEOS'],
+            debug=False,
+            test=True,
+            on_aws=False,
+            tasks=leapp.models.FilteredRpmTransactionTasks()
+        )
+    )
+    assert created.upgrade.stats_path == dnfplugin.DNF_TRANSACTION_STATS_PATH
+    assert created.upgrade.changed_files_path is None
+
+
+def test_build_plugin_data_targeted_relabel(monkeypatch):
+    envars = {'LEAPP_SELINUX_TARGETED_RELABEL': '1'}
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.4', envars=envars))
+    created = DATADnfPluginData.create(
+        dnfplugin.build_plugin_data(
+            target_repoids=['BASEOS'],
+            debug=False,
+            test=True,
+            on_aws=False,
+            tasks=leapp.models.FilteredRpmTransactionTasks()
+        )
+    )
+    assert created.upgrade.changed_files_path == dnfplugin.DNF_CHANGED_FILES_PATH
+
+
+class MockedChangedFilesContext(object):
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def full_path(self, path):
+        return os.path.join(self.base_dir, path.lstrip('/'))
+
+
+def test_reset_changed_files(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_SELINUX_TARGETED_RELABEL': '1'}))
+    monkeypatch.setattr(dnfplugin.selinuxrelabel, 'CHANGED_FILES_PATH', tmpdir.join('changed').strpath)
+    monkeypatch.setattr(dnfplugin.selinuxrelabel, 'UPGRADE_START_PATH', tmpdir.join('start').strpath)
+    context = MockedChangedFilesContext(tmpdir.mkdir('container').strpath)
+    container_list = tmpdir.join('container', dnfplugin.DNF_CHANGED_FILES_PATH.lstrip('/'))
+    container_list.write('/usr/bin/bash\n', ensure=True)
+    tmpdir.join('changed').write('/usr/bin/bash\n')
+
+    dnfplugin.reset_changed_files(context)
+
+    assert not container_list.exists()
+    assert not tmpdir.join('changed').exists()
+    assert tmpdir.join('start').exists()
+
+
+class MockedPluginDataContext(object):
+    def __init__(self, path, load_filelists):
+        self.path = path
+        self.copied = []
+        with open(path, 'w') as f:
+            json.dump({'dnf_conf': {'load_filelists': load_filelists}}, f)
+
+    def open(self, dummy_path, *args, **kwargs):
+        return open(self.path, *args, **kwargs)
+
+    def copy_from(self, src, dst):
+        self.copied.append((src, dst))
+
+
+@pytest.mark.parametrize('stage,stderr,load_filelists,expected', [
+    ('check', 'nothing provides /usr/bin/python3 needed by foo-1.0-1.el9.noarch', False, True),
+    ('download', 'package foo-1.0-1.el9.noarch requires /bin/csh, but none of the providers can be installed',
+     False, True),
+    ('check', 'nothing provides /usr/bin/python3 needed by foo-1.0-1.el9.noarch', True, False),
+    ('check', 'nothing provides libfoo.so.1()(64bit) needed by foo-1.0-1.el9.x86_64', False, False),
+    ('upgrade', 'nothing provides /usr/bin/python3 needed by foo-1.0-1.el9.noarch', False, False),
+])
+def test_retry_with_filelists(monkeypatch, tmpdir, stage, stderr, load_filelists, expected):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    context = MockedPluginDataContext(tmpdir.join('data.json').strpath, load_filelists)
+    err = CalledProcessError('dnf failed', ['dnf'], {'exit_code': 1, 'stderr': stderr})
+
+    assert dnfplugin._retry_with_filelists(context, stage, err) is expected
+
+    with open(context.path) as f:
+        assert json.load(f)['dnf_conf']['load_filelists'] is (load_filelists or expected)
+
+
+@pytest.mark.parametrize('content', ('broken', '{}'))
+def test_retry_with_filelists_unreadable_data(monkeypatch, tmpdir, content):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    context = MockedPluginDataContext(tmpdir.join('data.json').strpath, False)
+    with open(context.path, 'w') as f:
+        f.write(content)
+    stderr = 'nothing provides /bin/csh needed by foo'
+    err = CalledProcessError('dnf failed', ['dnf'], {'exit_code': 1, 'stderr': stderr})
+
+    assert dnfplugin._retry_with_filelists(context, 'check', err) is False
+    assert api.current_logger.warnmsg
+    with open(context.path) as f:
+        assert f.read() == content
@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+from leapp.libraries.common import factsnapshot
+from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
+from leapp.models import FirmwareFacts
+
+
+@pytest.fixture
+def snapshot_dir(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked())
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(factsnapshot, 'SNAPSHOT_DIR', os.path.join(tmpdir.strpath, 'facts-snapshot'))
+    monkeypatch.setattr(factsnapshot, '_get_repository_version', lambda: 'leapp-upgrade-el8toel9-0.20.0-1.el8')
+    return factsnapshot.SNAPSHOT_DIR
+
+
+class CollectorMocked(object):
+    def __init__(self, firmware='bios'):
+        self.called = 0
+        self.firmware = firmware
+
+    def __call__(self):
+        self.called += 1
+        return FirmwareFacts(firmware=self.firmware)
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_fingerprint(tmpdir):
+    input_file = os.path.join(tmpdir.strpath, 'input')
+    input_dir = tmpdir.mkdir('inputs').strpath
+    _write(input_file, 'a')
+    paths = [input_file, input_dir, os.path.join(tmpdir.strpath, 'missing')]
+
+    fingerprint = factsnapshot.get_fingerprint(paths)
+    assert factsnapshot.get_fingerprint(paths) == fingerprint
+
+    _write(os.path.join(input_dir, 'new'), 'b')
+    assert factsnapshot.get_fingerprint(paths) != fingerprint
+
+    fingerprint = factsnapshot.get_fingerprint(paths)
+    _write(input_file, 'modified')
+    assert factsnapshot.get_fingerprint(paths) != fingerprint
+
+
+def test_reuse_or_collect(snapshot_dir, tmpdir):
+    input_file = os.path.join(tmpdir.strpath, 'input')
+    _write(input_file, 'a')
+    collector = CollectorMocked()
+
+    first = factsnapshot.reuse_or_collect('firmware', [input_file], FirmwareFacts, collector)
+    second = factsnapshot.reuse_or_collect('firmware', [input_file], FirmwareFacts, CollectorMocked('efi'))
+
+    assert collector.called == 1
+    assert first == second == FirmwareFacts(firmware='bios')
+    assert os.path.isfile(os.path.join(snapshot_dir, 'firmware.json'))
+
+
+def test_reuse_or_collect_changed_inputs(snapshot_dir, tmpdir):
+    input_file = os.path.join(tmpdir.strpath, 'input')
+    _write(input_file, 'a')
+    factsnapshot.reuse_or_collect('firmware', [input_file], FirmwareFacts, CollectorMocked())
+
+    _write(input_file, 'changed')
+    collector = CollectorMocked('efi')
+
+    assert factsnapshot.reuse_or_collect('firmware', [input_file], FirmwareFacts, collector).firmware == 'efi'
+    assert collector.called == 1
+
+
+def test_reuse_or_collect_full_rescan(monkeypatch, snapshot_dir, tmpdir):
+    factsnapshot.reuse_or_collect('firmware', [], FirmwareFacts, CollectorMocked())
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_FULL_FACTS_RESCAN': '1'}))
+    collector = CollectorMocked('efi')
+
+    assert factsnapshot.reuse_or_collect('firmware', [], FirmwareFacts, collector).firmware == 'efi'
+    assert collector.called == 1
+    # the new snapshot is stored for next executions
+    assert factsnapshot.load_snapshot('firmware', factsnapshot.get_fingerprint([]), FirmwareFacts).firmware == 'efi'
+
+
+def test_load_snapshot_invalid(snapshot_dir):
+    fingerprint = factsnapshot.get_fingerprint([])
+    os.makedirs(snapshot_dir)
+    path = os.path.join(snapshot_dir, 'firmware.json')
+
+    assert factsnapshot.load_snapshot('firmware', fingerprint, FirmwareFacts) is None
+
+    _write(path, 'broken')
+    assert factsnapshot.load_snapshot('firmware', fingerprint, FirmwareFacts) is None
+
+    _write(path, json.dumps({'format': 0, 'fingerprint': fingerprint, 'message': {'firmware': 'bios'}}))
+    assert factsnapshot.load_snapshot('firmware', fingerprint, FirmwareFacts) is None
+
+
+def test_reuse_or_collect_repository_updated(monkeypatch, snapshot_dir):
+    factsnapshot.reuse_or_collect('firmware', [], FirmwareFacts, CollectorMocked())
+    monkeypatch.setattr(factsnapshot, '_get_repository_version', lambda: 'leapp-upgrade-el8toel9-0.21.0-1.el8')
+    collector = CollectorMocked('efi')
+
+    assert factsnapshot.reuse_or_collect('firmware', [], FirmwareFacts, collector).firmware == 'efi'
+    assert collector.called == 1
+
+
+@pytest.mark.parametrize('fails', (False, True))
+def test_get_repository_version(monkeypatch, fails):
+    def run_mocked(cmd, **kwargs):
+        if fails:
+            raise CalledProcessError(message='not installed', command=cmd, result={'exit_code': 1})
+        return {'stdout': 'leapp-upgrade-el8toel9-0.20.0-1.el8\n'}
+
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(src_ver='8.10', dst_ver='9.4'))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(factsnapshot, 'run', run_mocked)
+    monkeypatch.setattr(factsnapshot, '_repository_version', {})
+
+    expected = None if fails else 'leapp-upgrade-el8toel9-0.20.0-1.el8'
+    assert factsnapshot._get_repository_version() == expected
+    # evaluated once per process
+    monkeypatch.setattr(factsnapshot, 'run', lambda *args, **kwargs: pytest.fail('rpm must not be called again'))
+    assert factsnapshot._get_repository_version() == expected
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from leapp.libraries.common import metadatacache
+from leapp.libraries.common.testutils import logger_mocked
+from leapp.libraries.stdlib import api
+
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setenv('LEAPP_EXECUTION_ID', 'execution-1')
+    return tmpdir.mkdir('dnf-metadata-cache').strpath
+
+
+def test_get_bind(tmpdir):
+    cache_dir = os.path.join(tmpdir.strpath, 'dnf-metadata-cache')
+    assert metadatacache.get_bind(cache_dir) == '{}:/var/cache/dnf'.format(cache_dir)
+    assert os.path.isdir(cache_dir)
+
+
+def test_pinned_metadata(monkeypatch, cache_dir):
+    assert metadatacache.get_pinned_repoids(['baseos'], cache_dir) == []
+
+    metadatacache.pin_metadata(['baseos', 'appstream'], cache_dir)
+
+    assert metadatacache.get_pinned_repoids(['baseos', 'crb'], cache_dir) == ['baseos']
+    assert metadatacache.get_pinning_setopts(['appstream', 'baseos'], cache_dir) == [
+        '--setopt=appstream.metadata_expire=-1',
+        '--setopt=baseos.metadata_expire=-1',
+    ]
+
+    # the metadata are refreshed again by the next leapp execution
+    monkeypatch.setenv('LEAPP_EXECUTION_ID', 'execution-2')
+    assert metadatacache.get_pinned_repoids(['baseos'], cache_dir) == []
+    assert metadatacache.get_pinning_setopts(['baseos'], cache_dir) == []
+
+
+def test_unpin_metadata(cache_dir):
+    metadatacache.pin_metadata(['baseos'], cache_dir)
+    metadatacache.unpin_metadata(cache_dir)
+    assert metadatacache.get_pinned_repoids(['baseos'], cache_dir) == []
+
+
+def test_pin_metadata_unknown_execution(monkeypatch, cache_dir):
+    monkeypatch.delenv('LEAPP_EXECUTION_ID')
+    metadatacache.pin_metadata(['baseos'], cache_dir)
+    assert metadatacache.get_pinned_repoids(['baseos'], cache_dir) == []
+
+
+def test_remove_packages(cache_dir):
+    repo_dir = os.path.join(cache_dir, 'baseos-0123456789abcdef')
+    os.makedirs(os.path.join(repo_dir, 'repodata'))
+    os.makedirs(os.path.join(repo_dir, 'packages'))
+    with open(os.path.join(repo_dir, 'packages', 'bash.rpm'), 'w') as f:
+        f.write('rpm')
+
+    metadatacache.remove_packages(cache_dir)
+
+    assert os.listdir(repo_dir) == ['repodata']
@@ -0,0 +1,178 @@
+import os
+from collections import namedtuple
+
+import pytest
+
+from leapp.libraries.common import mounting
+from leapp.libraries.common.testutils import logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
+
+
+@pytest.mark.parametrize('targets,expected', [
+    ([], []),
+    (['/a'], ['/a']),
+    (['/a', '/a/b', '/a/b/c', '/ab'], ['/a', '/ab']),
+    (['/mnt', '/target', '/mnt/root_/system_overlay', '/mnt/root_var'], ['/mnt', '/target']),
+])
+def test_get_topmost_targets(targets, expected):
+    assert mounting.get_topmost_targets(targets) == expected
+
+
+class MountOperationsMocked(object):
+    def __init__(self, monkeypatch, fail_on=None):
+        self.mounted = []
+        self.unmounted = []
+        self.fail_on = fail_on
+        monkeypatch.setattr(mounting, 'umount_lazy', self.unmounted.append)
+        monkeypatch.setattr(mounting, '_remove_path', lambda dummy_path: None)
+        monkeypatch.setattr(mounting, '_makedirs', lambda *args, **kwargs: None)
+        monkeypatch.setattr(mounting.MountingBase, '_do_mount', self._mount_mocked())
+        monkeypatch.setattr(mounting.LoopMount, '_do_mount', self._mount_mocked())
+
+    def _mount_mocked(self):
+        mocked = self
+
+        def _do_mount(mount):
+            if mount.target == mocked.fail_on:
+                raise CalledProcessError('mount failed', ['mount'], {'exit_code': 32})
+            mocked.mounted.append(mount.target)
+        return _do_mount
+
+
+def _get_mounts():
+    return [
+        mounting.LoopMount(source='/imgs/root_', target='/mnt/root_'),
+        mounting.OverlayMount(name='system_overlay', source='/', workdir='/mnt/root_'),
+        mounting.NullMount(target='/mnt/null'),
+        mounting.BindMount(source='/mnt/root_/system_overlay', target='/target'),
+        mounting.LoopMount(source='/imgs/root_var', target='/mnt/root_var'),
+        mounting.BindMount(source='/mnt/root_var', target='/mnt/root_/system_overlay/var'),
+    ]
+
+
+def test_mount_orchestrator(monkeypatch):
+    mocked = MountOperationsMocked(monkeypatch)
+    with mounting.MountOrchestrator(_get_mounts(), root='/mnt') as orchestrator:
+        expected = [
+            '/mnt', '/mnt/root_', '/mnt/root_/system_overlay', '/target',
+            '/mnt/root_var', '/mnt/root_/system_overlay/var'
+        ]
+        assert mocked.mounted == expected
+        assert orchestrator.targets == expected
+    # each target is ensured to be unmounted before the mount + topmost targets in the end
+    assert mocked.unmounted[len(expected):] == ['/target', '/mnt']
+    assert not orchestrator.targets
+
+
+def test_mount_orchestrator_failure(monkeypatch):
+    mocked = MountOperationsMocked(monkeypatch, fail_on='/mnt/root_var')
+    orchestrator = mounting.MountOrchestrator(_get_mounts())
+    with pytest.raises(mounting.MountError):
+        orchestrator.mount()
+    assert mocked.mounted == ['/mnt/root_', '/mnt/root_/system_overlay', '/target']
+    assert mocked.unmounted[-2:] == ['/target', '/mnt/root_']
+    assert not orchestrator.targets
+
+
+@pytest.mark.parametrize('mount,expected', [
+    (mounting.BindMount(source='/src', target='/dst'), ('/src', None, mounting.MS_BIND, None)),
+    (mounting.TypedMount(fstype='proc', source='proc', target='/dst'), ('proc', 'proc', 0, None)),
+    (mounting.OverlayMount(name='ovl', source='/', workdir='/work'),
+     ('overlay2', 'overlay', 0, 'lowerdir=/,upperdir=/work/upper,workdir=/work/work')),
+    (mounting.LoopMount(source='/img', target='/dst'), None),
+])
+def test_syscall_options(mount, expected):
+    assert mount._syscall_options() == expected
+
+
+def test_do_mount_fallback(monkeypatch):
+    commands = []
+
+    def _syscall_mount_mocked(*args):
+        raise OSError(1, 'Operation not permitted')
+
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(mounting, '_syscall_mount', _syscall_mount_mocked)
+    monkeypatch.setattr(mounting, 'run', lambda cmd, **kwargs: commands.append(cmd))
+    mounting.BindMount(source='/src', target='/dst')._do_mount()
+    assert commands == [['mount', '-o', 'bind', '/src', '/dst']]
+
+
+EnvVar = namedtuple('EnvVar', ('name', 'value'))
+
+
+def test_get_ppid():
+    assert mounting._get_ppid(os.getpid()) == os.getppid()
+
+
+def test_nspawn_session():
+    # the shell stands for systemd-nspawn forking the container PID 1
+    session = mounting.NspawnSession(['sh', '-c', '"$@"; true', 'sh'], [EnvVar('LEAPP_X', '1')])
+    session.start()
+    try:
+        assert mounting._get_ppid(session.leader_pid) == session._process.pid
+        assert session.make_command(['rpm', '-q', 'bash']) == [
+            'nsenter', '--target', str(session.leader_pid), '--mount', '--uts', '--ipc', '--pid', '--root', '--wd',
+            '--', 'env', '-i', 'PATH={}'.format(mounting._NSPAWN_PATH), 'container=systemd-nspawn', 'HOME=/root',
+            'LEAPP_X=1', 'rpm', '-q', 'bash',
+        ]
+    finally:
+        process = session._process
+        session.stop()
+    assert process.returncode is not None
+    assert not session.leader_pid
+
+
+def test_nspawn_session_start_failure():
+    session = mounting.NspawnSession(['false'], [])
+    with pytest.raises(OSError):
+        session.start()
+
+
+class NspawnSessionMocked(object):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.started = 0
+        self.stopped = 0
+
+    def __call__(self, nspawn_cmd, env_vars):
+        self.nspawn_cmd = nspawn_cmd
+        return self
+
+    def start(self):
+        if self.fail:
+            raise OSError(1, 'Operation not permitted')
+        self.started += 1
+
+    def stop(self):
+        self.stopped += 1
+
+    def make_command(self, cmd):
+        return ['nsenter'] + cmd
+
+
+@pytest.mark.parametrize('fail', (False, True))
+def test_isolated_actions_session(monkeypatch, fail):
+    commands = []
+    session = NspawnSessionMocked(fail=fail)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(mounting, 'get_source_major_version', lambda: '8')
+    monkeypatch.setattr(mounting, 'NspawnSession', session)
+    monkeypatch.setattr(mounting, 'run', lambda cmd, **kwargs: commands.append(cmd))
+    context = mounting.NspawnActions(base_dir='/target', env_vars=[EnvVar('LEAPP_X', '1')])
+    with context.session():
+        # nested sessions reuse the running one
+        with context.session():
+            context.call(['true'])
+        context.call(['false'])
+    context.call(['true'])
+
+    assert session.nspawn_cmd[-2:] == ['/target', '--setenv=LEAPP_X=1']
+    assert commands[-1][0] == 'systemd-nspawn'
+    if fail:
+        assert session.stopped == 0
+        assert [cmd[0] for cmd in commands] == ['systemd-nspawn'] * 3
+    else:
+        assert session.started == 1
+        assert session.stopped == 1
+        assert commands[:2] == [['nsenter', 'true'], ['nsenter', 'false']]
@@ -0,0 +1,298 @@
+import os
+
+import pytest
+
+from leapp.exceptions import StopActorExecutionError
+from leapp.libraries.common import metadatacache, mounting, overlaygen, spaceplanner
+from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api
+
+
+@pytest.mark.parametrize('envars,images_count,expected', [
+    ({'LEAPP_OVL_IMG_WORKERS': '1'}, 10, 1),
+    ({'LEAPP_OVL_IMG_WORKERS': '4'}, 10, 4),
+    ({'LEAPP_OVL_IMG_WORKERS': '4'}, 2, 2),
+    ({'LEAPP_OVL_IMG_WORKERS': '4'}, 0, 1),
+    ({'LEAPP_OVL_IMG_WORKERS': '0'}, 10, 3),
+    ({'LEAPP_OVL_IMG_WORKERS': 'many'}, 10, 3),
+    ({}, 10, 3),
+])
+def test_get_img_creation_workers(monkeypatch, envars, images_count, expected):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars=envars))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(overlaygen.multiprocessing, 'cpu_count', lambda: 3)
+    assert overlaygen._get_img_creation_workers(images_count) == expected
+
+
+def test_create_sparse_file(tmpdir):
+    path = os.path.join(str(tmpdir), 'img')
+    overlaygen._create_sparse_file(path, 200, 'hint')
+    assert os.path.getsize(path) == 200 * 1024 * 1024
+
+
+def test_create_sparse_file_error(tmpdir):
+    path = os.path.join(str(tmpdir), 'missing', 'img')
+    with pytest.raises(StopActorExecutionError) as err:
+        overlaygen._create_sparse_file(path, 200, 'hint')
+    assert path in err.value.message
+    assert err.value.details == {'hint': 'hint'}
+
+
+@pytest.mark.parametrize('workers', ('1', '4'))
+def test_create_mount_disk_images(monkeypatch, tmpdir, workers):
+    formatted = []
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_OVL_IMG_WORKERS': workers}))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(overlaygen, '_format_disk_image_xfs', formatted.append)
+
+    disk_sizes = {'/': 2048, '/var': 10, '/home': 512}
+    images = overlaygen._create_mount_disk_images(str(tmpdir), disk_sizes)
+
+    assert set(images.keys()) == set(disk_sizes.keys())
+    assert sorted(formatted) == sorted(images.values())
+    for mountpoint, image in images.items():
+        assert image == os.path.join(str(tmpdir), overlaygen._mount_name(mountpoint))
+        # too small disk images are enlarged to be possible to format them
+        assert os.path.getsize(image) == max(disk_sizes[mountpoint], 130) * 1024 * 1024
+
+
+@pytest.mark.parametrize('workers', ('1', '4'))
+def test_create_mount_disk_images_error(monkeypatch, tmpdir, workers):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_OVL_IMG_WORKERS': workers}))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    def _format_mocked(diskimage_path):
+        if diskimage_path.endswith(('root_home', 'root_var')):
+            raise StopActorExecutionError(message='Cannot create XFS filesystem in {}'.format(diskimage_path))
+
+    monkeypatch.setattr(overlaygen, '_format_disk_image_xfs', _format_mocked)
+
+    disk_sizes = {'/': 2048, '/var': 1024, '/home': 512, '/srv': 512}
+    with pytest.raises(StopActorExecutionError) as err:
+        overlaygen._create_mount_disk_images(str(tmpdir), disk_sizes)
+    # the error related to the first failed mountpoint is raised
+    assert err.value.message.endswith('root_home')
+
+
+class MockedStorageInfo(object):
+    def __init__(self, mountpoints):
+        self.fstab = [MockedFstabEntry(mp) for mp in mountpoints]
+
+
+class MockedFstabEntry(object):
+    def __init__(self, fs_file):
+        self.fs_file = fs_file
+        self.fs_vfstype = 'xfs'
+
+
+def test_get_overlay_mounts():
+    mounts = {
+        mp: mounting.LoopMount(source='/imgs/{}'.format(overlaygen._mount_name(mp)),
+                               target=overlaygen._mount_dir('/mnt', mp))
+        for mp in ('/', '/var', '/var/lib', '/home')
+    }
+    root_overlay, overlay_mounts = overlaygen._get_overlay_mounts(mounts, mount_target='/target')
+    assert root_overlay.target == '/mnt/root_/system_overlay'
+    assert [mnt.target for mnt in overlay_mounts] == [
+        '/mnt/root_',
+        '/mnt/root_/system_overlay',
+        '/target',
+        '/mnt/root_home',
+        '/mnt/root_home/root_home',
+        '/mnt/root_/system_overlay/home',
+        '/mnt/root_var',
+        '/mnt/root_var/root_var',
+        '/mnt/root_/system_overlay/var',
+        '/mnt/root_var_lib',
+        '/mnt/root_var_lib/root_var_lib',
+        '/mnt/root_/system_overlay/var/lib',
+        '/mnt/root_/system_overlay/var/cache/dnf',
+    ]
+    # the original mapping is not modified
+    assert len(mounts) == 4
+
+
+def test_get_overlay_mounts_no_root():
+    with pytest.raises(StopActorExecutionError):
+        overlaygen._get_overlay_mounts({'/var': mounting.LoopMount(source='/img', target='/mnt/root_var')})
+
+
+class MockedRunDu(object):
+    def __init__(self, size='1500'):
+        self.size = size
+        self.called = 0
+
+    def __call__(self, cmd):
+        assert cmd[:2] == ['du', '-sPmx']
+        self.called += 1
+        return {'stdout': '{}\t{}'.format(self.size, cmd[-1])}
+
+
+def test_get_container_size_recorded(monkeypatch, tmpdir):
+    run_mocked = MockedRunDu()
+    monkeypatch.setattr(overlaygen, 'run', run_mocked)
+    assert overlaygen._get_container_size(str(tmpdir)) == 1500
+    assert overlaygen._get_container_size(str(tmpdir)) == 1500
+    assert run_mocked.called == 1
+
+    overlaygen.invalidate_container_size(str(tmpdir))
+    assert overlaygen._get_container_size(str(tmpdir)) == 1500
+    assert run_mocked.called == 2
+
+
+def test_get_container_size_another_container(monkeypatch, tmpdir):
+    run_mocked = MockedRunDu()
+    monkeypatch.setattr(overlaygen, 'run', run_mocked)
+    overlaygen._get_container_size(str(tmpdir))
+    # e.g. the container has been replaced by a copy including the record
+    monkeypatch.setattr(overlaygen, '_get_container_id', lambda dummy_path: [0, 0])
+    overlaygen._get_container_size(str(tmpdir))
+    assert run_mocked.called == 2
+
+
+@pytest.mark.parametrize('used_before,used_after,expected', [
+    (0, 300 * 1024 * 1024, 1800),
+    (300 * 1024 * 1024, 300 * 1024 * 1024, 1500),
+    # space released by other processes
+    (300 * 1024 * 1024, 0, 1500),
+])
+def test_track_container_size(monkeypatch, tmpdir, used_before, used_after, expected):
+    used_space = [used_before, used_after]
+    run_mocked = MockedRunDu()
+    monkeypatch.setattr(overlaygen, 'run', run_mocked)
+    monkeypatch.setattr(overlaygen, '_get_used_space', lambda dummy_path: used_space.pop(0))
+    monkeypatch.setattr(overlaygen, '_get_excluded_used_space', lambda *args: 0)
+    with overlaygen.track_container_size(str(tmpdir)):
+        pass
+    assert overlaygen._get_container_size(str(tmpdir)) == expected
+    assert run_mocked.called == 1
+
+
+def test_track_container_size_excluded_dirs(monkeypatch, tmpdir):
+    # 300 MiB consumed during the action, 200 MiB of that by packages downloaded into the shared DNF cache
+    used_space = [0, 300 * 1024 * 1024]
+    excluded_space = [0, 200 * 1024 * 1024]
+    excluded_dirs = []
+
+    def mocked_get_excluded_used_space(dummy_path, dirs):
+        excluded_dirs.append(dirs)
+        return excluded_space.pop(0)
+
+    monkeypatch.setattr(overlaygen, 'run', MockedRunDu())
+    monkeypatch.setattr(overlaygen, '_get_used_space', lambda dummy_path: used_space.pop(0))
+    monkeypatch.setattr(overlaygen, '_get_excluded_used_space', mocked_get_excluded_used_space)
+    with overlaygen.track_container_size(str(tmpdir), excluded_dirs=['/var/lib/leapp/scratch']):
+        pass
+    assert overlaygen._get_container_size(str(tmpdir)) == 1600
+    assert excluded_dirs[0] == [metadatacache.METADATA_CACHE_DIR, '/var/lib/leapp/scratch']
+
+
+def test_get_tree_used_space(tmpdir):
+    tmpdir.join('package.rpm').write('x' * 10000)
+    subdir = tmpdir.mkdir('repodata')
+    subdir.join('primary.xml').write('y' * 10000)
+    os.link(tmpdir.join('package.rpm').strpath, subdir.join('hardlink.rpm').strpath)
+    device = os.stat(tmpdir.strpath).st_dev
+    expected = sum(os.lstat(path.strpath).st_blocks * 512
+                   for path in (tmpdir, tmpdir.join('package.rpm'), subdir, subdir.join('primary.xml')))
+
+    assert overlaygen._get_tree_used_space(tmpdir.strpath, device) == expected
+    # e.g. a loop device mounted inside the scratch directory
+    assert overlaygen._get_tree_used_space(tmpdir.strpath, device + 1) == 0
+
+
+def test_track_container_size_error(monkeypatch, tmpdir):
+    run_mocked = MockedRunDu()
+    monkeypatch.setattr(overlaygen, 'run', run_mocked)
+    with pytest.raises(StopActorExecutionError):
+        with overlaygen.track_container_size(str(tmpdir)):
+            raise StopActorExecutionError('dnf failed')
+    assert not os.path.exists(os.path.join(str(tmpdir), overlaygen.CONTAINER_SIZE_FILE))
+
+
+@pytest.mark.parametrize('cont_size,expected', [('1000', 2200), ('2000', 1200), ('3100', 200), ('4000', 200)])
+def test_get_recommended_leapp_free_space(monkeypatch, tmpdir, cont_size, expected):
+    run_mocked = MockedRunDu(cont_size)
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.8'))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(overlaygen, 'run', run_mocked)
+    assert overlaygen.get_recommended_leapp_free_space(str(tmpdir)) == expected
+    assert overlaygen.get_recommended_leapp_free_space(str(tmpdir)) == expected
+    assert run_mocked.called == 1
+
+
+def test_get_recommended_leapp_free_space_no_container(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.8'))
+    assert overlaygen.get_recommended_leapp_free_space(None) == 3200
+    assert overlaygen.get_recommended_leapp_free_space(os.path.join(str(tmpdir), 'missing')) == 3200
+
+
+def test_get_recommended_leapp_free_space_plan(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.8'))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(overlaygen, 'run', MockedRunDu('1500'))
+    plan = spaceplanner.SpacePlan(download_size=1000 * 1024 * 1024, net_sizes={}, container_size=1200)
+    monkeypatch.setattr(spaceplanner, 'load_space_plan', lambda dummy_path: plan)
+    # the container has grown by 300 MiB since the plan has been created
+    expected = 1000 + spaceplanner.INITRAMFS_BUILD_OVERHEAD - 300
+    assert overlaygen.get_recommended_leapp_free_space(str(tmpdir)) == expected
+
+
+class MockedStorageInfoFS(object):
+    def __init__(self, tmpdir):
+        self.fstab = [MockedFstabEntry('/'), MockedFstabEntry(str(tmpdir))]
+
+
+@pytest.mark.parametrize('free_space,missing', [
+    ({'/': 1000, 'container': 3000}, []),
+    ({'/': 100, 'container': 3000}, ['/']),
+    ({'/': 1000, 'container': 1000}, ['container']),
+    ({'/': 100, 'container': 1000}, ['/', 'container']),
+])
+def test_ensure_enough_transaction_space(monkeypatch, tmpdir, free_space, missing):
+    container_mp = str(tmpdir)
+    userspace_path = os.path.join(container_mp, 'el8userspace')
+    os.mkdir(userspace_path)
+    free_space = {(container_mp if mp == 'container' else mp): size for mp, size in free_space.items()}
+    plan = spaceplanner.SpacePlan(
+        download_size=1000 * 1024 * 1024,
+        net_sizes={'/usr': 500 * 1024 * 1024, container_mp: 100 * 1024 * 1024},
+    )
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(overlaygen, 'run', MockedRunDu('1500'))
+    monkeypatch.setattr(spaceplanner, 'load_space_plan', lambda dummy_path: plan)
+    monkeypatch.setattr(spaceplanner, 'anchor_space_plan', lambda dummy_path, plan, size: None)
+    monkeypatch.setattr(overlaygen, '_get_fspace', lambda path, **kwargs: free_space[path])
+
+    if not missing:
+        overlaygen.ensure_enough_transaction_space(userspace_path, MockedStorageInfoFS(tmpdir))
+        return
+    with pytest.raises(StopActorExecutionError) as err:
+        overlaygen.ensure_enough_transaction_space(userspace_path, MockedStorageInfoFS(tmpdir))
+    detail = err.value.details['detail']
+    assert len(detail.splitlines()) == len(missing)
+    if '/' in missing:
+        assert '/: needed 500 MiB, available 100 MiB' in detail
+    if 'container' in missing:
+        needed = 100 + 1000 + spaceplanner.INITRAMFS_BUILD_OVERHEAD
+        assert '{}: needed {} MiB, available 1000 MiB'.format(container_mp, needed) in detail
+
+
+def test_ensure_enough_transaction_space_approximate(monkeypatch, tmpdir):
+    userspace_path = os.path.join(str(tmpdir), 'el8userspace')
+    os.mkdir(userspace_path)
+    plan = spaceplanner.SpacePlan(download_size=0, net_sizes={'/usr': 500 * 1024 * 1024}, approximate=True)
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(overlaygen, 'run', MockedRunDu('1500'))
+    monkeypatch.setattr(spaceplanner, 'load_space_plan', lambda dummy_path: plan)
+    monkeypatch.setattr(spaceplanner, 'anchor_space_plan', lambda dummy_path, plan, size: None)
+    monkeypatch.setattr(overlaygen, '_get_fspace', lambda path, **kwargs: 100)
+
+    overlaygen.ensure_enough_transaction_space(userspace_path, MockedStorageInfoFS(tmpdir))
+    assert '/: needed 500 MiB, available 100 MiB' in api.current_logger.warnmsg[0]
+
+
+def test_ensure_enough_transaction_space_no_plan(monkeypatch):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(spaceplanner, 'load_space_plan', lambda dummy_path: None)
+    overlaygen.ensure_enough_transaction_space('/var/lib/leapp/el8userspace', MockedStorageInfo(['/']))
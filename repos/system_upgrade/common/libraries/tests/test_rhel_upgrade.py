@@ -0,0 +1,111 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('dnf')
+pytest.importorskip('rpm')
+
+PLUGIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'files', 'rhel_upgrade.py')
+
+
+def _load_plugin():
+    # the plugin is not a python module of the repository, it is installed into the target userspace container
+    # (DNF is available on Python 3 systems only)
+    from importlib.util import module_from_spec, spec_from_file_location  # pylint: disable=import-outside-toplevel
+
+    spec = spec_from_file_location('rhel_upgrade', PLUGIN_PATH)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+rhel_upgrade = _load_plugin()
+
+
+class MockedPackage(object):
+    def __init__(self, name, version='1', reponame='baseos', files=(), installsize=0):
+        self.name = name
+        self.epoch = 0
+        self.version = version
+        self.release = '1.el8'
+        self.arch = 'x86_64'
+        self.reponame = reponame
+        self.files = list(files)
+        self.installsize = installsize
+        self.downloadsize = installsize // 2
+
+    def localPkg(self):
+        return '/nonexistent/{}.rpm'.format(self.name)
+
+
+class MockedQuery(object):
+    def __init__(self, pkgs, installed=()):
+        self.pkgs = list(pkgs)
+        self._installed = list(installed)
+
+    def filter(self, **kwargs):
+        pkgs = [pkg for pkg in self.pkgs if all(getattr(pkg, key) == value for key, value in kwargs.items())]
+        return MockedQuery(pkgs, self._installed)
+
+    def installed(self):
+        return MockedQuery(self._installed)
+
+    def run(self):
+        return list(self.pkgs)
+
+
+class MockedTransaction(object):
+    def __init__(self, to_install, to_remove):
+        self.install_set = set(to_install)
+        self.remove_set = set(to_remove)
+
+
+class MockedSack(object):
+    def __init__(self, available, installed):
+        self.available = available
+        self.installed = installed
+
+    def query(self):
+        return MockedQuery(self.available + self.installed, self.installed)
+
+
+class MockedBase(object):
+    def __init__(self, available=(), installed=()):
+        self.sack = MockedSack(list(available), list(installed))
+        self.transaction = None
+
+
+class MockedCli(object):
+    def __init__(self, base):
+        self.base = base
+
+
+@pytest.mark.parametrize('load_filelists,expected', [
+    (True, {'/usr/bin': 200, '/usr/share/bash': 300, '/usr': 200, '/etc': -100}),
+    # files of the installed bash are used for the upgraded one, the new package is accounted to /usr
+    (False, {'/usr/bin': 200, '/etc': 200, '/usr': 200}),
+])
+def test_store_space_plan(tmpdir, load_filelists, expected):
+    installed = MockedPackage('bash', reponame='@System', files=['/usr/bin/bash', '/etc/bashrc'], installsize=200)
+    # only files listed in the primary metadata are known without filelists
+    upgrade = MockedPackage(
+        'bash', version='5.1', files=['/usr/bin/bash', '/usr/share/bash/x'] if load_filelists else ['/usr/bin/bash'],
+        installsize=600,
+    )
+    new = MockedPackage('zsh', installsize=200)
+    base = MockedBase(available=[upgrade, new], installed=[installed])
+    base.transaction = MockedTransaction([upgrade, new], [installed])
+    command = rhel_upgrade.RhelUpgradeCommand(MockedCli(base))
+    command.plugin_data = {
+        'dnf_conf': {'load_filelists': load_filelists},
+        'space_plan': {'path': tmpdir.join('plan.json').strpath},
+    }
+
+    command._store_space_plan()
+
+    with open(tmpdir.join('plan.json').strpath) as f:
+        plan = json.load(f)
+    assert plan['download_size'] == 400
+    assert plan['approximate'] is not load_filelists
+    assert {path: size for path, size in plan['net_sizes'].items() if size} == expected
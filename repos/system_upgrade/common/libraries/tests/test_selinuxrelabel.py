@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+from leapp.libraries.common import selinuxrelabel
+from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api
+
+
+@pytest.fixture
+def manifests(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_SELINUX_TARGETED_RELABEL': '1'}))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(selinuxrelabel, 'CHANGED_FILES_PATH', os.path.join(tmpdir.strpath, 'changed'))
+    monkeypatch.setattr(selinuxrelabel, 'UPGRADE_START_PATH', os.path.join(tmpdir.strpath, 'start'))
+    return tmpdir
+
+
+@pytest.mark.parametrize('enabled', (True, False))
+def test_mark_upgrade_start(monkeypatch, manifests, enabled):
+    if not enabled:
+        monkeypatch.setattr(api, 'current_actor', CurrentActorMocked())
+    # data of a previous attempt
+    manifests.join('changed').write('/usr/bin/bash\n')
+    manifests.join('start').write('')
+
+    selinuxrelabel.mark_upgrade_start()
+
+    assert not manifests.join('changed').exists()
+    assert manifests.join('start').exists() == enabled
+
+
+def test_get_relabel_paths(monkeypatch, manifests):
+    manifests.join('changed').write('/usr/bin/bash\n/usr/share/doc/bash/README\n/usr/bin\n')
+    manifests.join('start').write('')
+    since = []
+
+    def find_changed_files_mocked(start_time):
+        since.append(start_time)
+        return ['/usr/lib/locale/locale-archive']
+
+    monkeypatch.setattr(selinuxrelabel, '_find_changed_files', find_changed_files_mocked)
+
+    assert selinuxrelabel.get_relabel_paths() == [
+        '/usr',
+        '/usr/bin',
+        '/usr/bin/bash',
+        '/usr/lib',
+        '/usr/lib/locale',
+        '/usr/lib/locale/locale-archive',
+        '/usr/share',
+        '/usr/share/doc',
+        '/usr/share/doc/bash',
+        '/usr/share/doc/bash/README',
+    ]
+    assert since == [os.stat(manifests.join('start').strpath).st_mtime]
+
+
+@pytest.mark.parametrize('missing', ('changed', 'start'))
+def test_get_relabel_paths_missing_manifest(monkeypatch, manifests, missing):
+    monkeypatch.setattr(selinuxrelabel, '_find_changed_files', lambda since: [])
+    manifests.join('changed').write('/usr/bin/bash\n')
+    manifests.join('start').write('')
+    manifests.join(missing).remove()
+    with pytest.raises((IOError, OSError)):
+        selinuxrelabel.get_relabel_paths()
+
+
+def test_find_changed_files(monkeypatch, tmpdir):
+    root = tmpdir.mkdir('root')
+    old = root.mkdir('old')
+    old.join('file').write('')
+    excluded = root.mkdir('excluded')
+    nfs = root.mkdir('nfs')
+    data = root.mkdir('data')
+    log = root.mkdir('log')
+    # timestamps of files are not precise
+    time.sleep(0.05)
+    tmpdir.join('start').write('')
+    time.sleep(0.05)
+    created = root.mkdir('new').join('file')
+    created.write('')
+    for path in (excluded, nfs, data, log):
+        path.join('file').write('')
+    monkeypatch.setattr(selinuxrelabel, 'SCAN_EXCLUDED_PATHS', (excluded.strpath,))
+    monkeypatch.setattr(selinuxrelabel, 'SCAN_NESTED_MOUNTS', (nfs.strpath, log.strpath))
+    mounts = {root.strpath: 'xfs', nfs.strpath: 'nfs4', data.strpath: 'xfs', log.strpath: 'xfs'}
+    monkeypatch.setattr(selinuxrelabel, '_get_mounts', lambda: mounts)
+
+    since = os.stat(tmpdir.join('start').strpath).st_mtime
+    missing = tmpdir.join('missing').strpath
+    assert sorted(selinuxrelabel._find_changed_files(since, tops=(root.strpath, missing))) == [
+        log.strpath,
+        log.join('file').strpath,
+        root.join('new').strpath,
+        created.strpath,
+    ]
+
+
+def test_find_changed_files_unsupported_top(monkeypatch, tmpdir):
+    root = tmpdir.mkdir('root')
+    tmpdir.join('start').write('')
+    root.join('file').write('')
+    monkeypatch.setattr(selinuxrelabel, '_get_mounts', lambda: {root.strpath: 'nfs4'})
+
+    since = os.stat(tmpdir.join('start').strpath).st_mtime - 1
+    assert selinuxrelabel._find_changed_files(since, tops=(root.strpath,)) == []
+
+
+def test_get_mounts(tmpdir):
+    mounts = tmpdir.join('mounts')
+    mounts.write(
+        '/dev/vda1 / xfs rw,relatime 0 0\n'
+        'proc /proc proc rw 0 0\n'
+        'server:/data /mnt/my\\040data nfs4 rw 0 0\n'
+    )
+    assert selinuxrelabel._get_mounts(mounts.strpath) == {'/': 'xfs', '/proc': 'proc', '/mnt/my data': 'nfs4'}
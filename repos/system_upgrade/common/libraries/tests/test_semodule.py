@@ -0,0 +1,59 @@
+import pytest
+
+from leapp.libraries.common import semodule
+from leapp.libraries.common.testutils import logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
+
+
+class RunMocked(object):
+    def __init__(self, failing=()):
+        self.commands = []
+        self.failing = failing
+
+    def __call__(self, cmd, *args, **kwargs):
+        self.commands.append(cmd)
+        if any(module in cmd for module in self.failing):
+            raise CalledProcessError('Mock error', cmd, {'exit_code': 1, 'stderr': 'broken module'})
+        return {'stdout': ''}
+
+
+def _operations(names):
+    return [['-X', '400', '-i', '{}.cil'.format(name)] for name in names]
+
+
+@pytest.fixture
+def run_mocked(monkeypatch):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+
+    def _mock(failing=()):
+        mocked = RunMocked(failing)
+        monkeypatch.setattr(semodule, 'run', mocked)
+        return mocked
+    return _mock
+
+
+def test_run_operations(run_mocked):
+    run = run_mocked()
+
+    assert semodule.run_operations(_operations('abc')) == []
+    assert run.commands == [['semodule', '-X', '400', '-i', 'a.cil', '-X', '400', '-i', 'b.cil',
+                             '-X', '400', '-i', 'c.cil']]
+
+
+def test_run_operations_empty(run_mocked):
+    run = run_mocked()
+
+    assert semodule.run_operations([]) == []
+    assert run.commands == []
+
+
+def test_run_operations_failed(run_mocked):
+    run = run_mocked(failing=('b.cil', 'g.cil'))
+
+    failed = semodule.run_operations(_operations('abcdefgh'))
+
+    assert failed == [(['-X', '400', '-i', 'b.cil'], 'broken module'), (['-X', '400', '-i', 'g.cil'], 'broken module')]
+    # successful operations are applied in the original order
+    applied = [cmd[4::4] for cmd in run.commands if not any(module in cmd for module in ('b.cil', 'g.cil'))]
+    assert [name for cmd in applied for name in cmd] == ['a.cil', 'c.cil', 'd.cil', 'e.cil', 'f.cil', 'h.cil']
+    assert len(run.commands) < 2 * len('abcdefgh')
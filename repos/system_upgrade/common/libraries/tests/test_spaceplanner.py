@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from leapp.libraries.common import spaceplanner
+from leapp.libraries.common.testutils import logger_mocked
+from leapp.libraries.stdlib import api
+
+MiB = 1024 * 1024
+
+
+def _store_plan(userspace_path, **kwargs):
+    plan = {'download_size': 1000 * MiB, 'net_sizes': {'/usr': 700 * MiB, '/var/lib': 20 * MiB}}
+    plan.update(kwargs)
+    path = os.path.join(userspace_path, spaceplanner.SPACE_PLAN_PATH.lstrip('/'))
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        json.dump(plan, f)
+
+
+def test_load_space_plan(tmpdir):
+    _store_plan(str(tmpdir))
+    plan = spaceplanner.load_space_plan(str(tmpdir))
+    assert plan.download_size == 1000 * MiB
+    assert plan.net_sizes == {'/usr': 700 * MiB, '/var/lib': 20 * MiB}
+    assert plan.container_size is None
+    assert not plan.approximate
+
+
+def test_load_space_plan_approximate(tmpdir):
+    _store_plan(str(tmpdir), approximate=True)
+    plan = spaceplanner.load_space_plan(str(tmpdir))
+    spaceplanner.anchor_space_plan(str(tmpdir), plan, 1234)
+    assert spaceplanner.load_space_plan(str(tmpdir)).approximate
+
+
+def test_load_space_plan_missing(tmpdir):
+    assert spaceplanner.load_space_plan(str(tmpdir)) is None
+
+
+def test_load_space_plan_invalid(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    _store_plan(str(tmpdir), download_size='a lot')
+    assert spaceplanner.load_space_plan(str(tmpdir)) is None
+    assert api.current_logger.warnmsg
+
+
+def test_anchor_space_plan(tmpdir):
+    _store_plan(str(tmpdir))
+    plan = spaceplanner.load_space_plan(str(tmpdir))
+    spaceplanner.anchor_space_plan(str(tmpdir), plan, 1234)
+    assert spaceplanner.load_space_plan(str(tmpdir)).container_size == 1234
+
+
+@pytest.mark.parametrize('path,expected', [
+    ('/usr', '/'),
+    ('/var', '/var'),
+    ('/var/lib', '/var'),
+    ('/var/lib/leapp', '/var/lib/leapp'),
+    ('/var/lib/leappx', '/var'),
+])
+def test_get_mountpoint(path, expected):
+    assert spaceplanner.get_mountpoint(['/', '/var', '/var/lib/leapp', '/home'], path) == expected
+
+
+def test_get_required_space():
+    plan = spaceplanner.SpacePlan(
+        download_size=300 * MiB + 1,
+        net_sizes={'/usr': 700 * MiB, '/usr/share': 100 * MiB, '/var/lib': 20 * MiB, '/opt': -200 * MiB},
+    )
+    required = spaceplanner.get_required_space(plan, ['/', '/var', '/home'], container_mountpoint='/var')
+    assert required == {
+        '/': 600,
+        '/var': 20 + 301 + spaceplanner.INITRAMFS_BUILD_OVERHEAD,
+        '/home': 0,
+    }
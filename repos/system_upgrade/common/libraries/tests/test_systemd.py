@@ -65,6 +65,98 @@ def test_get_service_files(monkeypatch):
     assert service_files == expected
 
 
+def test_get_unit_file_states(monkeypatch):
+    def run_mocked(cmd, *args, **kwargs):
+        if cmd == ['systemctl', 'list-unit-files', '--all', '--plain', '--no-legend']:
+            return {'stdout': [
+                'proc-sys-fs-binfmt_misc.automount      static   -',
+                'auditd.service                         enabled  enabled',
+                'getty@.service                         enabled  enabled',
+                'sshd.socket                            disabled disabled',
+                '',
+            ]}
+        raise ValueError('Attempted to call unexpected command: {}'.format(cmd))
+
+    monkeypatch.setattr(systemd, 'run', run_mocked)
+
+    assert systemd.get_unit_file_states() == {
+        'proc-sys-fs-binfmt_misc.automount': 'static',
+        'auditd.service': 'enabled',
+        'getty@.service': 'enabled',
+        'sshd.socket': 'disabled',
+    }
+
+
+def test_get_unit_file_state(monkeypatch):
+    commands = []
+
+    def run_mocked(cmd, *args, **kwargs):
+        commands.append(cmd)
+        return {'stdout': ['disabled'] if cmd[-1] == 'getty@tty2.service' else ['enabled']}
+
+    monkeypatch.setattr(systemd, 'run', run_mocked)
+    unit_file_states = {'auditd.service': 'enabled', 'dbus.service': 'static', 'getty@.service': 'enabled'}
+
+    assert systemd.get_unit_file_state('auditd', unit_file_states) == 'enabled'
+    assert systemd.get_unit_file_state('missing.service', unit_file_states) is None
+    assert systemd.get_unit_file_state('getty@tty1.service', unit_file_states) == 'enabled'
+    assert systemd.get_unit_file_state('getty@tty2.service', unit_file_states) == 'disabled'
+    assert systemd.is_unit_enabled('dbus.service', unit_file_states)
+    assert not systemd.is_unit_enabled('getty@tty2.service', unit_file_states)
+    assert not systemd.is_unit_enabled('missing.service', unit_file_states)
+    # only instances of template units are queried
+    assert commands == [['systemctl', 'is-enabled', 'getty@tty1.service']] + [
+        ['systemctl', 'is-enabled', 'getty@tty2.service']] * 2
+
+
+def test_get_unit_active_states(monkeypatch):
+    def run_mocked(cmd, *args, **kwargs):
+        if cmd == ['systemctl', 'list-units', '--all', '--plain', '--no-legend']:
+            return {'stdout': [
+                'auditd.service   loaded    active   running Security Auditing Service',
+                '\u25cf kdump.service  loaded    failed   failed  Crash recovery kernel arming',
+                'nfs.service      not-found inactive dead    nfs.service',
+            ]}
+        raise ValueError('Attempted to call unexpected command: {}'.format(cmd))
+
+    monkeypatch.setattr(systemd, 'run', run_mocked)
+    active_states = systemd.get_unit_active_states()
+
+    assert active_states == {'auditd.service': 'active', 'kdump.service': 'failed', 'nfs.service': 'inactive'}
+    assert systemd.is_unit_active('auditd', active_states)
+    assert not systemd.is_unit_active('kdump.service', active_states)
+    assert not systemd.is_unit_active('missing.service', active_states)
+
+
+def test_get_broken_symlinks(monkeypatch, tmpdir):
+    wants_dir = tmpdir.mkdir('multi-user.target.wants')
+    tmpdir.join('unit.service').write('')
+    wants_dir.join('unit.service').mksymlinkto(tmpdir.join('unit.service'))
+    wants_dir.join('broken.service').mksymlinkto(tmpdir.join('missing.service'))
+    tmpdir.join('loop.service').mksymlinkto(tmpdir.join('loop.service'))
+    tmpdir.join('linked.target.wants').mksymlinkto(wants_dir)
+    monkeypatch.setattr(systemd, 'SYSTEMD_SYMLINKS_DIR', tmpdir.strpath + '/')
+
+    assert systemd.get_broken_symlinks() == [
+        tmpdir.join('loop.service').strpath,
+        wants_dir.join('broken.service').strpath,
+    ]
+
+
+def test_search_preset_files(tmpdir):
+    tmpdir.join('90-default.preset').write('')
+    tmpdir.join('50-blocked.preset').mksymlinkto('/dev/null')
+    tmpdir.join('README').write('')
+    tmpdir.mkdir('sub').join('00-nested.preset').write('')
+
+    assert systemd._search_preset_files(tmpdir.strpath) == [
+        tmpdir.join('50-blocked.preset').strpath,
+        tmpdir.join('90-default.preset').strpath,
+        tmpdir.join('sub', '00-nested.preset').strpath,
+    ]
+    assert systemd._search_preset_files(tmpdir.join('missing').strpath) == []
+
+
 def test_preset_files_overrides():
     etc_files = [
         '/etc/systemd/system-preset/00-abc.preset',
@@ -150,7 +242,7 @@ _PARSE_PRESET_ENTRIES_TEST_DEFINITION = (
 @pytest.mark.parametrize('entry,expected', _PARSE_PRESET_ENTRIES_TEST_DEFINITION)
 def test_parse_preset_entry(monkeypatch, entry, expected):
     presets = {}
-    systemd._parse_preset_entry(entry, presets, TEST_SYSTEMD_LOAD_PATH)
+    systemd._parse_preset_entry(entry, presets, systemd._get_unit_files(TEST_SYSTEMD_LOAD_PATH))
     assert presets == expected
 
 
@@ -165,7 +257,26 @@ def test_parse_preset_entry(monkeypatch, entry, expected):
 def test_parse_preset_entry_invalid(monkeypatch, entry):
     presets = {}
     with pytest.raises(ValueError, match=r'^Invalid preset file entry: '):
-        systemd._parse_preset_entry(entry, presets, TEST_SYSTEMD_LOAD_PATH)
+        systemd._parse_preset_entry(entry, presets, systemd._get_unit_files(TEST_SYSTEMD_LOAD_PATH))
+
+
+def test_get_unit_files():
+    assert systemd._get_unit_files(TEST_SYSTEMD_LOAD_PATH + [os.path.join(CURR_DIR, 'missing')]) == {
+        'abc.service', 'example.service', 'example.socket', 'extra.service', 'globbed-one.service',
+        'globbed-two.service', 'template2@.service', 'template@.service'
+    }
+
+
+@pytest.mark.parametrize('pattern,expected', [
+    ('example.service', ['example.service']),
+    ('missing.service', []),
+    ('example.*', ['example.service', 'example.socket']),
+    ('template?@.service', ['template2@.service']),
+    ('globbed-[a-o]*', ['globbed-one.service']),
+])
+def test_match_unit_files(pattern, expected):
+    unit_files = systemd._get_unit_files(TEST_SYSTEMD_LOAD_PATH)
+    assert sorted(systemd._match_unit_files(pattern, unit_files)) == expected
 
 
 def test_parse_preset_files(monkeypatch):
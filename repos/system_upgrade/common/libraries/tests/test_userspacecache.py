@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from leapp.libraries.common import userspacecache
+from leapp.libraries.common.testutils import CurrentActorMocked, logger_mocked
+from leapp.libraries.stdlib import api
+
+
+def _create_repomd(cache_dir, repodir, content):
+    repodata = os.path.join(cache_dir, repodir, 'repodata')
+    os.makedirs(repodata)
+    with open(os.path.join(repodata, 'repomd.xml'), 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def cache_env(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(dst_ver='8.8'))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(userspacecache, 'is_nogpgcheck_set', lambda: False)
+    gpg_dir = tmpdir.mkdir('rpm-gpg')
+    gpg_dir.join('RPM-GPG-KEY-redhat-release').write('key')
+    monkeypatch.setattr(userspacecache, 'get_path_to_gpg_certs', lambda: gpg_dir.strpath)
+    return gpg_dir
+
+
+def test_get_cache_key(cache_env):
+    key = userspacecache.get_cache_key(['appstream', 'baseos'], ['dnf', 'dnf', 'bash'])
+    assert key == userspacecache.get_cache_key(['baseos', 'appstream'], ['bash', 'dnf'])
+    assert key['target_version'] == '8.8'
+    assert key['packages'] == ['bash', 'dnf']
+
+
+def test_get_cache_key_gpg_keys(monkeypatch, cache_env):
+    key = userspacecache.get_cache_key(['baseos'], ['dnf'])
+    assert key['gpg_keys']
+
+    cache_env.join('RPM-GPG-KEY-custom').write('custom key')
+    new_key = userspacecache.get_cache_key(['baseos'], ['dnf'])
+    assert new_key['gpg_keys'] != key['gpg_keys']
+
+    cache_env.join('RPM-GPG-KEY-custom').remove()
+    assert userspacecache.get_cache_key(['baseos'], ['dnf']) == key
+
+    monkeypatch.setattr(userspacecache, 'is_nogpgcheck_set', lambda: True)
+    assert userspacecache.get_cache_key(['baseos'], ['dnf'])['gpg_keys'] is None
+
+
+def test_get_metadata_digest(tmpdir):
+    cache_dir = str(tmpdir)
+    _create_repomd(cache_dir, 'baseos-0123456789abcdef', 'baseos-v1')
+    _create_repomd(cache_dir, 'appstream-0123456789abcdef', 'appstream-v1')
+    _create_repomd(cache_dir, 'appstream-debug-0123456789abcdef', 'appstream-debug-v1')
+    digest = userspacecache.get_metadata_digest(cache_dir, ['baseos', 'appstream'])
+    assert digest
+
+    # metadata of not used repositories do not affect the digest
+    with open(os.path.join(cache_dir, 'appstream-debug-0123456789abcdef/repodata/repomd.xml'), 'w') as f:
+        f.write('appstream-debug-v2')
+    assert userspacecache.get_metadata_digest(cache_dir, ['appstream', 'baseos']) == digest
+
+    with open(os.path.join(cache_dir, 'appstream-0123456789abcdef/repodata/repomd.xml'), 'w') as f:
+        f.write('appstream-v2')
+    assert userspacecache.get_metadata_digest(cache_dir, ['appstream', 'baseos']) != digest
+
+
+def test_get_metadata_digest_missing(tmpdir):
+    cache_dir = str(tmpdir)
+    assert userspacecache.get_metadata_digest(cache_dir, ['baseos']) is None
+    _create_repomd(cache_dir, 'baseos-0123456789abcdef', 'baseos-v1')
+    assert userspacecache.get_metadata_digest(cache_dir, ['baseos', 'appstream']) is None
+
+
+def test_cache_key_matching(cache_env, tmpdir):
+    userspace = str(tmpdir)
+    key = userspacecache.get_cache_key(['baseos'], ['dnf'])
+    assert not userspacecache.is_cache_key_matching(userspace, key)
+
+    userspacecache.store_cache_record(userspace, key, 'digest')
+    assert userspacecache.is_cache_key_matching(userspace, key)
+    assert userspacecache.is_metadata_matching(userspace, 'digest')
+
+    another_key = userspacecache.get_cache_key(['baseos', 'appstream'], ['dnf'])
+    assert not userspacecache.is_cache_key_matching(userspace, another_key)
+    assert 'changed: repoids' in api.current_logger.infomsg[-1]
+    # the record is invalidated
+    assert not userspacecache.is_cache_key_matching(userspace, key)
+
+
+def test_metadata_changed(cache_env, tmpdir):
+    userspace = str(tmpdir)
+    key = userspacecache.get_cache_key(['baseos'], ['dnf'])
+    userspacecache.store_cache_record(userspace, key, 'digest')
+    assert not userspacecache.is_metadata_matching(userspace, 'another-digest')
+    assert not userspacecache.is_cache_key_matching(userspace, key)
+
+
+def test_cache_disabled(monkeypatch, tmpdir):
+    monkeypatch.setattr(api, 'current_actor', CurrentActorMocked(envars={'LEAPP_NO_USERSPACE_CACHE': '1'}))
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(userspacecache, 'is_nogpgcheck_set', lambda: False)
+    monkeypatch.setattr(userspacecache, 'get_path_to_gpg_certs', lambda: str(tmpdir))
+    userspace = str(tmpdir)
+    key = userspacecache.get_cache_key(['baseos'], ['dnf'])
+    userspacecache.store_cache_record(userspace, key, 'digest')
+    assert not userspacecache.is_cache_key_matching(userspace, key)
+    assert not os.path.exists(os.path.join(userspace, userspacecache.CACHE_RECORD_FILE))
+
+
+def test_store_cache_record_without_digest(cache_env, tmpdir):
+    userspace = str(tmpdir)
+    userspacecache.store_cache_record(userspace, userspacecache.get_cache_key(['baseos'], ['dnf']), None)
+    assert not os.path.exists(os.path.join(userspace, userspacecache.CACHE_RECORD_FILE))
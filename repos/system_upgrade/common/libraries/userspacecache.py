@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import re
+
+from leapp.libraries.common.config import get_env
+from leapp.libraries.common.config.version import get_target_version
+from leapp.libraries.common.gpg import get_path_to_gpg_certs, is_nogpgcheck_set
+from leapp.libraries.stdlib import api
+
+CACHE_RECORD_FILE = '.leapp_userspace_cache.json'
+"""
+Name of the file (stored inside the target userspace container) describing the container.
+
+The target userspace container is kept on the system between leapp executions.
+The record describes what the container has been created for, so it can be
+reused when the same container is requested again instead of creating it from
+scratch. The record is stored inside the container, so the removal of the
+container removes the record as well.
+
+The record contains:
+  * key - the target system, packages, repositories and trusted GPG keys the container has been created for
+  * metadata_digest - digest of metadata of the repositories used for the creation
+"""
+
+
+def is_cache_disabled():
+    """
+    Return True if the target userspace container must not be reused
+
+    The reuse is disabled by (envar) `LEAPP_NO_USERSPACE_CACHE=1`.
+    """
+    return get_env('LEAPP_NO_USERSPACE_CACHE', '0') == '1'
+
+
+def _get_record_path(userspace_path):
+    return os.path.join(userspace_path, CACHE_RECORD_FILE)
+
+
+def _get_files_digest(path):
+    """
+    Return the digest of names and content of files in the given directory.
+
+    Return None when the directory cannot be read.
+    """
+    try:
+        filenames = sorted(os.listdir(path))
+    except OSError:
+        return None
+    digest = hashlib.sha256()
+    for filename in filenames:
+        filepath = os.path.join(path, filename)
+        if not os.path.isfile(filepath):
+            continue
+        digest.update(filename.encode('utf-8'))
+        with open(filepath, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def get_cache_key(enabled_repos, packages):
+    """
+    Return the key describing the requested target userspace container.
+
+    GPG keys are imported into the container only during its creation, so
+    the key covers the content of the directory with trusted GPG keys as well.
+    An added or removed key requires a new container.
+
+    :param enabled_repos: Repoids of repositories used for the installation of packages.
+    :type enabled_repos: List[str]
+    :param packages: Packages to install into the container.
+    :type packages: List[str]
+    :rtype: dict
+    """
+    nogpgcheck = is_nogpgcheck_set()
+    return {
+        'target_version': get_target_version(),
+        'architecture': api.current_actor().configuration.architecture,
+        'nogpgcheck': nogpgcheck,
+        'gpg_keys': None if nogpgcheck else _get_files_digest(get_path_to_gpg_certs()),
+        'packages': sorted(set(packages)),
+        'repoids': sorted(set(enabled_repos)),
+    }
+
+
+def get_metadata_digest(cache_dir, repoids):
+    """
+    Return the digest of metadata of given repositories cached in the DNF cache.
+
+    The digest is computed from repomd.xml files which reference (with
+    checksums) all other metadata of a repository. Return None when metadata
+    of any repository are not present in the DNF cache.
+
+    :param cache_dir: Path to the DNF cache directory.
+    :type cache_dir: str
+    :param repoids: Repoids of repositories to compute the digest for.
+    :type repoids: List[str]
+    :rtype: Optional[str]
+    """
+    try:
+        cache_entries = sorted(os.listdir(cache_dir))
+    except OSError:
+        return None
+    digest = hashlib.sha256()
+    for repoid in sorted(set(repoids)):
+        # the cache directory of a repository is named <repoid>-<hash>
+        dir_regex = re.compile(r'^{}-[0-9a-f]+$'.format(re.escape(repoid)))
+        repomds = [
+            os.path.join(cache_dir, entry, 'repodata', 'repomd.xml') for entry in cache_entries
+            if dir_regex.match(entry)
+        ]
+        repomds = [repomd for repomd in repomds if os.path.isfile(repomd)]
+        if not repomds:
+            return None
+        digest.update(repoid.encode('utf-8'))
+        for repomd in repomds:
+            with open(repomd, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _load_record(userspace_path):
+    try:
+        with open(_get_record_path(userspace_path)) as f:
+            return json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+
+
+def store_cache_record(userspace_path, key, metadata_digest):
+    """
+    Store the record describing the created target userspace container.
+
+    Nothing is stored if the metadata digest is not known, as such a container
+    could not be reused anyway.
+    """
+    if not metadata_digest:
+        api.current_logger().debug('Metadata of repositories are not cached. The container cannot be reused later.')
+        return
+    with open(_get_record_path(userspace_path), 'w') as f:
+        json.dump({'key': key, 'metadata_digest': metadata_digest}, f, sort_keys=True, indent=2)
+
+
+def invalidate_cache(userspace_path, reason):
+    """
+    Invalidate the target userspace container, so it is not reused anymore.
+
+    Call it whenever the container is modified in a way that is not expected
+    to be present in a newly created container (e.g. installed packages).
+
+    :param userspace_path: Path to the userspace container.
+    :type userspace_path: str
+    :param reason: Reason of the invalidation, logged.
+    :type reason: str
+    """
+    try:
+        os.unlink(_get_record_path(userspace_path))
+    except OSError:
+        return
+    api.current_logger().info('Invalidated the cached target userspace container: {}'.format(reason))
+
+
+def is_cache_key_matching(userspace_path, key):
+    """
+    Return True if the existing container has been created for the given key.
+
+    The cache is invalidated if it does not match.
+    """
+    if is_cache_disabled():
+        invalidate_cache(userspace_path, 'the reuse is disabled by LEAPP_NO_USERSPACE_CACHE')
+        return False
+    record = _load_record(userspace_path)
+    if not record:
+        api.current_logger().debug('No cached target userspace container is available.')
+        return False
+    cached_key = record.get('key', {})
+    changed = sorted(item for item in set(key) | set(cached_key) if key.get(item) != cached_key.get(item))
+    if changed:
+        invalidate_cache(userspace_path, 'changed: {}'.format(', '.join(changed)))
+        return False
+    return True
+
+
+def is_metadata_matching(userspace_path, metadata_digest):
+    """
+    Return True if metadata of repositories did not change since the creation of the container.
+
+    The cache is invalidated if metadata changed.
+    """
+    record = _load_record(userspace_path) or {}
+    if not metadata_digest or record.get('metadata_digest') != metadata_digest:
+        invalidate_cache(userspace_path, 'metadata of repositories changed')
+        return False
+    return True
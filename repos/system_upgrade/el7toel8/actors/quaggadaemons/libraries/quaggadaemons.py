@@ -1,4 +1,5 @@
-from leapp.libraries.stdlib import api, CalledProcessError, run
+from leapp.libraries.common import systemd
+from leapp.libraries.stdlib import api, CalledProcessError
 from leapp.models import QuaggaToFrrFacts
 
 QUAGGA_DAEMONS = [
@@ -13,20 +14,38 @@ QUAGGA_DAEMONS = [
 ]
 
 
-def _check_service(name, state):
-    try:
-        run(['systemctl', 'is-{}'.format(state), name])
+def _check_service(name, state, is_in_state):
+    if is_in_state:
         api.current_logger().debug('%s is %s', name, state)
-    except CalledProcessError:
+    else:
         api.current_logger().debug('%s is not %s', name, state)
-        return False
+    return is_in_state
+
+
+def _get_unit_active_states():
+    try:
+        return systemd.get_unit_active_states()
+    except (OSError, CalledProcessError) as err:
+        api.current_logger().warning('Cannot obtain active states of systemd units: {}'.format(str(err)))
+        return {}
+
 
-    return True
+def _get_unit_file_states():
+    try:
+        return systemd.get_unit_file_states()
+    except (OSError, CalledProcessError) as err:
+        api.current_logger().warning('Cannot obtain states of systemd unit files: {}'.format(str(err)))
+        return {}
 
 
 def process_daemons():
-    active_daemons = [daemon for daemon in QUAGGA_DAEMONS if _check_service(daemon, 'active')]
-    enabled_daemons = [daemon for daemon in QUAGGA_DAEMONS if _check_service(daemon, 'enabled')]
+    # states of all units are obtained at once instead of calling systemctl for each daemon
+    active_states = _get_unit_active_states()
+    unit_file_states = _get_unit_file_states()
+    active_daemons = [daemon for daemon in QUAGGA_DAEMONS
+                      if _check_service(daemon, 'active', systemd.is_unit_active(daemon, active_states))]
+    enabled_daemons = [daemon for daemon in QUAGGA_DAEMONS
+                       if _check_service(daemon, 'enabled', systemd.is_unit_enabled(daemon, unit_file_states))]
 
     if active_daemons:
         api.current_logger().debug('active quaggadaemons: %s', ', '.join(active_daemons))
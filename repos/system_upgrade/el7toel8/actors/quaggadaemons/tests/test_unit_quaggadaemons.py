@@ -1,21 +1,44 @@
 from leapp.libraries.actor import quaggadaemons
+from leapp.libraries.common import systemd
+from leapp.libraries.common.testutils import logger_mocked
+from leapp.libraries.stdlib import api, CalledProcessError
 from leapp.models import QuaggaToFrrFacts
 
-# daemons for mocked _check_service function
+# daemons for mocked systemctl output
 TEST_DAEMONS = ['bgpd', 'ospfd', 'zebra']
 
 
-def mock_check_service(name, state):
-    if name in TEST_DAEMONS:
-        return True
-
-    return False
-
-
-def test_process_daemons():
-    quaggadaemons._check_service = mock_check_service
+def test_process_daemons(monkeypatch):
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(systemd, 'get_unit_active_states', lambda: {
+        'bgpd.service': 'active',
+        'ospfd.service': 'reloading',
+        'ripd.service': 'failed',
+        'zebra.service': 'active',
+    })
+    monkeypatch.setattr(systemd, 'get_unit_file_states', lambda: {
+        'babeld.service': 'disabled',
+        'bgpd.service': 'enabled',
+        'ospfd.service': 'enabled',
+        'ripd.service': 'masked',
+        'zebra.service': 'enabled',
+    })
 
     facts = quaggadaemons.process_daemons()
     assert isinstance(facts, QuaggaToFrrFacts)
     assert facts.active_daemons == TEST_DAEMONS
     assert facts.enabled_daemons == TEST_DAEMONS
+
+
+def test_process_daemons_systemctl_fails(monkeypatch):
+    def systemctl_failed():
+        raise CalledProcessError(message='systemctl failed', command=['systemctl'], result={'exit_code': 1})
+
+    monkeypatch.setattr(api, 'current_logger', logger_mocked())
+    monkeypatch.setattr(systemd, 'get_unit_active_states', systemctl_failed)
+    monkeypatch.setattr(systemd, 'get_unit_file_states', systemctl_failed)
+
+    facts = quaggadaemons.process_daemons()
+    assert facts.active_daemons == []
+    assert facts.enabled_daemons == []
+    assert len(api.current_logger.warnmsg) == 2